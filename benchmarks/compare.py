@@ -0,0 +1,70 @@
+import argparse
+import json
+import sys
+
+
+def load(path: str) -> dict[str, dict]:
+    # JSON pytest-benchmark (--benchmark-json) -> {полное имя бенчмарка: stats}
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    return {bench["fullname"]: bench["stats"] for bench in data.get("benchmarks", [])}
+
+
+def compare(baseline: dict[str, dict], current: dict[str, dict], threshold: float = 0.15,
+            stat: str = "median") -> list[dict]:
+    # строка на каждый бенчмарк; regression — медленнее базы больше чем на threshold (0.15 = 15%)
+    rows = []
+    for name in sorted(baseline.keys() | current.keys()):
+        before = baseline.get(name, {}).get(stat)
+        after = current.get(name, {}).get(stat)
+        change = (after - before) / before if before and after is not None else None
+        if before is None:
+            status = "new"
+        elif after is None:
+            status = "missing"
+        elif change > threshold:
+            status = "regression"
+        elif change < -threshold:
+            status = "faster"
+        else:
+            status = "ok"
+        rows.append({"name": name, "before": before, "after": after, "change": change, "status": status})
+    return rows
+
+
+def _us(seconds) -> str:
+    return "—" if seconds is None else f"{seconds * 1e6:,.1f} µs"
+
+
+def format_rows(rows: list[dict]) -> str:
+    width = max((len(row["name"]) for row in rows), default=10)
+    lines = []
+    for row in rows:
+        change = "" if row["change"] is None else f"{row['change'] * 100:+.1f}%"
+        mark = "  <-- REGRESSION" if row["status"] == "regression" else ""
+        lines.append(
+            f"{row['name']:<{width}}  {_us(row['before']):>14}  {_us(row['after']):>14}  {change:>8}  {row['status']}{mark}"
+        )
+    return "\n".join(lines)
+
+
+def main(argv: list[str] | None = None) -> int:
+    # python benchmarks/compare.py benchmarks/baseline.json current.json [--threshold 0.15]
+    parser = argparse.ArgumentParser(description="Сравнение результатов pytest-benchmark с базовыми")
+    parser.add_argument("baseline", help="JSON с базовыми результатами")
+    parser.add_argument("current", help="JSON нового прогона")
+    parser.add_argument("--threshold", type=float, default=0.15, help="допустимое замедление, доля (0.15 = 15%%)")
+    parser.add_argument("--stat", default="median", choices=["min", "median", "mean", "max"])
+    args = parser.parse_args(argv)
+
+    rows = compare(load(args.baseline), load(args.current), args.threshold, args.stat)
+    print(format_rows(rows))
+    regressions = [row for row in rows if row["status"] == "regression"]
+    if regressions:
+        print(f"\n{len(regressions)} регрессий больше {args.threshold * 100:.0f}% ({args.stat})")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,71 @@
+import asyncio
+import os
+import sqlite3
+import sys
+
+import pytest
+
+# Корень проекта в PYTHONPATH: botApp и фейковый Sheets API из tests/conftest.py
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+import botApp  # noqa: E402
+from tests.conftest import SHEET_HEADER, FakeSheets, use_db  # noqa: E402
+
+# размеры таблицы users и листа Leads, на которых меряем
+TABLE_SIZES = (1_000, 100_000)
+SHEET_SIZES = (1_000, 20_000)
+
+
+@pytest.fixture(scope="session")
+def _lead_db_files(tmp_path_factory):
+    # БД с N лидами строится один раз на сессию
+    files = {}
+    for size in TABLE_SIZES:
+        path = str(tmp_path_factory.mktemp("bench") / f"leads_{size}.db")
+        with pytest.MonkeyPatch.context() as mp:
+            use_db(mp, path)
+            botApp.init_db()
+        conn = sqlite3.connect(path)
+        conn.executemany(
+            "INSERT INTO users (chat_id, username, first_name, last_interaction, lang) VALUES (?, ?, ?, ?, 'ru')",
+            ((chat_id, f"user{chat_id}", "Lead", "2024-01-01T00:00:00") for chat_id in range(1, size + 1)),
+        )
+        conn.commit()
+        conn.close()
+        files[size] = path
+    return files
+
+
+@pytest.fixture(params=TABLE_SIZES, ids=lambda size: f"{size}_leads")
+def lead_db(request, monkeypatch, _lead_db_files):
+    # возвращает число лидов; chat_id существующих — 1..N
+    use_db(monkeypatch, _lead_db_files[request.param])
+    return request.param
+
+
+@pytest.fixture(params=SHEET_SIZES, ids=lambda size: f"{size}_rows")
+def leads_sheet(request, monkeypatch):
+    # фейковый Sheets API с листом на N строк и свой цикл событий: бенчмарк вызывает run(coro)
+    from aiohttp.test_utils import TestServer
+    from sheets_client import AsyncSheetsClient, StaticToken
+
+    loop = asyncio.new_event_loop()
+    fake = FakeSheets()
+    fake.rows.extend(
+        [str(chat_id), f"user{chat_id}", "Lead", "2024-01-01", "False", "", "", "0", "False"]
+        for chat_id in range(1, request.param + 1)
+    )
+    assert len(fake.rows[0]) == len(SHEET_HEADER)
+    server = TestServer(fake.app())
+    loop.run_until_complete(server.start_server())
+    client = AsyncSheetsClient(
+        "bench-sheet", StaticToken(fake.token), base_url=str(server.make_url("/v4/spreadsheets")),
+    )
+    monkeypatch.setattr(botApp, "_sheets_client", client)
+    monkeypatch.setattr(botApp, "_breakers", {})
+    yield fake, request.param, loop.run_until_complete
+    loop.run_until_complete(client.close())
+    loop.run_until_complete(server.close())
+    loop.close()
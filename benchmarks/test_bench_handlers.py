@@ -0,0 +1,30 @@
+import pytest
+
+import botApp
+
+MESSAGES = ["Проект", "  project ", "proekt", "Здравствуйте, пришлите проект", "/settings", "hello", "โครงการ"]
+
+
+@pytest.mark.benchmark(group="keyboards")
+@pytest.mark.parametrize("lang", ["ru", "en", "th"])
+def test_greeting_keyboard(benchmark, lang):
+    markup = benchmark(botApp.greeting_keyboard, lang)
+    assert sum(len(row) for row in markup.inline_keyboard) == 3
+
+
+@pytest.mark.benchmark(group="keyboards")
+def test_followup_keyboard(benchmark):
+    markup = benchmark(botApp.followup_keyboard, "ru")
+    assert markup.inline_keyboard[0][0].url
+
+
+@pytest.mark.benchmark(group="intents")
+def test_project_re(benchmark):
+    matched = benchmark(lambda: [bool(botApp.PROJECT_RE.match(text)) for text in MESSAGES])
+    assert matched[:3] == [True, True, True]
+
+
+@pytest.mark.benchmark(group="intents")
+def test_intent_classifier(benchmark):
+    intents = benchmark(lambda: [botApp.intent_classifier.classify(text) for text in MESSAGES])
+    assert intents[0].name == "project" and intents[4].kind == "command"
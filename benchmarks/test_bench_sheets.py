@@ -0,0 +1,28 @@
+import pytest
+
+import botApp
+
+pytestmark = pytest.mark.benchmark(group="sheets")
+
+
+def test_sheet_update_existing_row(benchmark, leads_sheet):
+    # пачка журнала из одной записи: чтение шапки и колонки chat_id всего листа, затем один batchUpdate
+    fake, size, run = leads_sheet
+    chat_id = size // 2
+    benchmark(lambda: run(botApp._write_sheet_changes([(chat_id, {"last_message": "Проект"})])))
+    assert fake.rows[chat_id][5] == "Проект"
+
+
+def test_sheet_update_missing_row_appends(benchmark, leads_sheet):
+    fake, size, run = leads_sheet
+    benchmark(lambda: run(botApp._write_sheet_changes([(size + 1, {"last_message": "Проект"})])))
+    assert fake.rows[size + 1][0] == str(size + 1)
+
+
+def test_sheet_changes_batch(benchmark, leads_sheet):
+    # сборка пачки из 200 изменений (как из журнала) по уже прочитанному индексу
+    _, size, run = leads_sheet
+    header, rows = run(botApp._sheet_index())
+    changes = [(chat_id, {"followup_attempts": "1"}) for chat_id in range(1, size + 1, max(size // 200, 1))]
+    updates, appends = benchmark(botApp._sheet_changes, header, rows, changes)
+    assert len(updates) == len(changes) and not appends
@@ -0,0 +1,36 @@
+import itertools
+
+import pytest
+
+import botApp
+
+pytestmark = pytest.mark.benchmark(group="storage")
+
+
+def test_get_user(benchmark, lead_db):
+    # чтение по первичному ключу из середины таблицы
+    user = benchmark(botApp.get_user, lead_db // 2)
+    assert user["chat_id"] == lead_db // 2
+
+
+def test_upsert_existing_user(benchmark, lead_db):
+    benchmark(botApp.upsert_user, lead_db // 2, "renamed", "Lead")
+    assert botApp.get_user(lead_db // 2)["username"] == "renamed"
+
+
+def test_upsert_new_user(benchmark, lead_db):
+    # каждый вызов — новый лид (вставка в конец индекса)
+    chat_ids = itertools.count(lead_db + 1)
+    benchmark(lambda: botApp.upsert_user(next(chat_ids), "new", "Lead"))
+    assert botApp.get_user(lead_db + 1) is not None
+
+
+def test_update_user_fields(benchmark, lead_db):
+    benchmark(botApp.update_user_fields, lead_db // 2, last_message="Проект", followup_attempts=1)
+    assert botApp.get_user(lead_db // 2)["last_message"] == "Проект"
+
+
+def test_update_user_fields_with_sheet_journal(benchmark, lead_db, monkeypatch):
+    # та же транзакция плюс запись в sheets_outbox; фоновую отправку не будим
+    monkeypatch.setattr(botApp.get_outbox_drainer(), "notify", lambda: None)
+    benchmark(botApp.update_user_fields, lead_db // 2, sheet={"last_message": "Проект"}, last_message="Проект")
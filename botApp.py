@@ -1,98 +1,125 @@
 # app.py
 import os
+import sys
 import re
 import json
+import hashlib
 import sqlite3
 import logging
 import asyncio
+import time
+import itertools
 from datetime import datetime, timedelta
 from zoneinfo import ZoneInfo
-from aiohttp import web
 
 from aiogram import Bot, Dispatcher, Router, F
 from aiogram.filters import CommandStart
-from aiogram.types import Message, CallbackQuery
+from aiogram.types import Message, CallbackQuery, ChatMemberUpdated
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 from aiogram.types import URLInputFile, BufferedInputFile
 
-from apscheduler.schedulers.asyncio import AsyncIOScheduler
-from apscheduler.triggers.date import DateTrigger
+from settings import Settings, RuntimeSettings, RUNTIME_KEYS, load_env_file
 
-import gspread
-from google.oauth2.service_account import Credentials
-from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+# google-auth, aiohttp, apscheduler и aiohttp.web импортируются лениво —
+# только когда реально нужны (см. sheets_client, get_scheduler, run_webhook)
 
-# -------------------- Загрузка окружения --------------------
-def load_env_file(path: str = "environment.ini"):
-    if not os.path.exists(path):
-        return
-    try:
-        with open(path, "r", encoding="utf-8") as f:
-            for raw in f:
-                line = raw.strip()
-                if not line or line.startswith("#"):
-                    continue
-                # убираем инлайн-комментарии
-                if "#" in line:
-                    line = line.split("#", 1)[0].strip()
-                if "=" not in line:
-                    continue
-                key, value = line.split("=", 1)
-                key = key.strip()
-                value = value.strip().strip('"').strip("'")
-                if key and value and key not in os.environ:
-                    os.environ[key] = value
-    except Exception:
-        # не критично для запуска, просто логируем позже если чего-то не хватает
-        pass
+# -------------------- Конфиг --------------------
+# Статический конфиг читается один раз (env + environment.ini) при первом обращении;
+# PDF_URL и параметры напоминаний меняются из админки и хранятся в таблице settings.
+# В режиме нескольких ботов (TENANTS) всё, что получают через get_*(), своё у каждого бота:
+# текущий бот выставляется в контексте (tenants.current_tenant) для апдейта или фоновой задачи.
+_settings: Settings | None = None
+_runtime: RuntimeSettings | None = None
 
-# загрузим переменные до чтения через os.getenv
-load_env_file()
+def _scoped(name: str, factory):
+    # ленивый объект: у текущего тенанта — свой, иначе глобальный объект модуля с этим именем
+    tenant = current_tenant()
+    if tenant is not None:
+        return tenant.get(name, factory)
+    value = globals().get(name)
+    if value is None:
+        value = globals()[name] = factory()
+    return value
 
-# -------------------- Конфиг --------------------
-TIMEZONE = os.getenv("TIMEZONE", "Europe/Amsterdam")
-TZ = ZoneInfo(TIMEZONE)
+def _peek(name: str):
+    # уже созданный ленивый объект текущего тенанта (или глобальный) — без создания
+    tenant = current_tenant()
+    return tenant.state.get(name) if tenant is not None else globals().get(name)
 
-BOT_TOKEN = os.getenv("BOT_TOKEN", "")
-ADMIN_CHAT_ID = int(os.getenv("ADMIN_CHAT_ID", "0"))
+def get_settings() -> Settings:
+    global _settings
+    tenant = current_tenant()
+    if tenant is not None:
+        return tenant.settings
+    if _settings is None:
+        # загрузим переменные до чтения из окружения
+        load_env_file()
+        _settings = Settings.from_env()
+    return _settings
 
-# Канал: НУЖЕН NUMERIC chat_id (например -1001234567890), а не t.me/...
-CHANNEL_ID = int(os.getenv("CHANNEL_ID", "0"))
-CHANNEL_LINK = os.getenv("CHANNEL_LINK", "https://t.me/rome_estate_channel")
-MANAGER_CONTACT = os.getenv("MANAGER_CONTACT", "https://t.me/manager_telegram_or_site")
+def _new_runtime() -> RuntimeSettings:
+    cfg = get_settings()
+    runtime = RuntimeSettings(
+        cfg.db_path,
+        defaults={key: getattr(cfg, key) for key in RUNTIME_KEYS},
+    )
+    runtime.subscribe(_on_runtime_setting_changed)
+    return runtime
 
-PDF_URL = os.getenv("PDF_URL", "https://drive.google.com/uc?id=DRIVE_FILE_ID&export=download")
-# Разрешаем русское/латинское написание, а также 'proekt' с латинской/русской 'o'
-PROJECT_RE = re.compile(r"(?i)^\s*(?:проек(?:t|т)\w*|pr[oо]ekt|project)\s*$")
+def get_runtime() -> RuntimeSettings:
+    return _scoped("_runtime", _new_runtime)
 
-REMINDER_INTERVAL_DAYS = int(os.getenv("REMINDER_INTERVAL_DAYS", "2"))
-REMINDER_MAX_ATTEMPTS = int(os.getenv("REMINDER_MAX_ATTEMPTS", "3"))
+def get_templates() -> dict:
+    tenant = current_tenant()
+    return tenant.templates if tenant is not None and tenant.templates else TEMPLATES
 
-GSHEET_ID = os.getenv("GSHEET_ID", "GOOGLE_SHEET_ID")
-GSHEET_WORKSHEET = os.getenv("GSHEET_WORKSHEET", "Leads")
-GOOGLE_SERVICE_JSON = os.getenv("GOOGLE_SERVICE_JSON", "")  # путь к файлу, либо JSON строка
+def _on_runtime_setting_changed(key: str, value):
+    logger.info(f"Runtime setting changed: {key}={value!r}")
+    if key == "pdf_url" and value:
+        # общая ссылка — документ каталога для всех языков и сегментов
+        get_catalog().publish(value)
 
-# Webhook (опционально)
-WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")  # например, https://your.domain.com/telegram/webhook
-WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram/webhook")
-WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
-WEBAPP_HOST = os.getenv("WEBAPP_HOST", "0.0.0.0")
-WEBAPP_PORT = int(os.getenv("WEBAPP_PORT", "8080"))
+def _now() -> datetime:
+    return datetime.now(get_settings().tz)
+
+# Разрешаем русское/латинское написание, а также 'proekt' с латинской/русской 'o'
+# (маршрутизация идёт через intent_classifier ниже; выражение оставлено для совместимости)
+PROJECT_RE = re.compile(r"(?i)^\s*(?:проек(?:t|т)\w*|pr[oо]ekt|project)\s*$")
 
 # -------------------- Логирование --------------------
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s %(levelname)s %(name)s: %(message)s"
-)
 logger = logging.getLogger("rome_estate_bot")
 
+def setup_logging():
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s %(levelname)s %(name)s: %(message)s"
+    )
+    logger.addHandler(recent_errors)
+
 from templates import TEMPLATES
+from sheets_client import AsyncSheetsClient, ServiceAccountToken, SheetsError, rowcol_to_a1, sheets_failure
+from followups import Cadence, FollowupQueue, FollowupDispatcher
+from lifecycle import InflightTracker, Lifecycle
+from chat_queue import ChatSerializer
+from breakers import CircuitBreaker, CircuitOpenError, TelegramBreakerMiddleware, format_breakers, telegram_failure
+from intents import IntentClassifier
+from documents import DocumentCatalog, ANY_LANG, DEFAULT_SEGMENT, DEFAULT_FILENAME
+from outbox import SheetsOutbox, OutboxDrainer, OutboxItem
+from dashboard import Dashboard, RecentErrors
+from tenants import Tenant, TenantMiddleware, current_tenant, load_tenants
+from retention import archive_path_for, db_stats, run_retention
+from snapshots import export_snapshot, prune_snapshots
+from segments import SegmentIndex
+from funnel import FunnelMeter, count_api_calls, format_funnel, mark_conversion, mark_entry
+from profiler import LoopLagMonitor, format_collapsed, sample_stacks, top_frames
+from memdiag import MemoryTracker, crossed, executor_stats, open_client_sessions, rss_bytes
 
-# -------------------- SQLite --------------------
-DB_PATH = os.getenv("DB_PATH", "bot.db")
+# последние предупреждения/ошибки для дашборда (подключается в setup_logging), с пометкой бота-тенанта
+recent_errors = RecentErrors(scope=lambda: getattr(current_tenant(), "name", None))
 
+# -------------------- SQLite --------------------
 def init_db():
-    conn = sqlite3.connect(DB_PATH)
+    conn = sqlite3.connect(get_settings().db_path)
     conn.execute("""
         CREATE TABLE IF NOT EXISTS users (
             chat_id INTEGER PRIMARY KEY,
@@ -104,22 +131,31 @@ def init_db():
             file_sent_at TEXT,
             followup_attempts INTEGER DEFAULT 0,
             manager_contacted INTEGER DEFAULT 0,
-            lang TEXT
+            lang TEXT,
+            tz TEXT,
+            segment TEXT
         )
     """)
-    # миграция: добавить колонку lang, если её нет
+    # миграция: добавить колонки lang и tz (часовой пояс лида), если их нет
     try:
         cur = conn.execute("PRAGMA table_info(users)")
         cols = {row[1] for row in cur.fetchall()}
         if "lang" not in cols:
             conn.execute("ALTER TABLE users ADD COLUMN lang TEXT")
+        if "tz" not in cols:
+            conn.execute("ALTER TABLE users ADD COLUMN tz TEXT")
+        if "segment" not in cols:
+            conn.execute("ALTER TABLE users ADD COLUMN segment TEXT")
     except Exception:
         pass
+    SheetsOutbox.init(conn)
     conn.commit()
     conn.close()
+    get_catalog().ensure_schema(seed_url=get_runtime().get("pdf_url"))
 
-def upsert_user(chat_id: int, username: str | None, first_name: str | None):
-    conn = sqlite3.connect(DB_PATH)
+def upsert_user(chat_id: int, username: str | None, first_name: str | None, sheet: bool = False):
+    conn = sqlite3.connect(get_settings().db_path)
+    is_new = sheet and conn.execute("SELECT 1 FROM users WHERE chat_id=?", (chat_id,)).fetchone() is None
     conn.execute("""
         INSERT INTO users (chat_id, username, first_name, last_interaction)
         VALUES (?, ?, ?, ?)
@@ -127,183 +163,631 @@ def upsert_user(chat_id: int, username: str | None, first_name: str | None):
           username=COALESCE(EXCLUDED.username, username),
           first_name=COALESCE(EXCLUDED.first_name, first_name),
           last_interaction=?
-    """, (chat_id, username, first_name, datetime.now(TZ).isoformat(), datetime.now(TZ).isoformat()))
+    """, (chat_id, username, first_name, _now().isoformat(), _now().isoformat()))
+    if sheet:
+        # строка лида в таблице — в той же транзакции, что и users
+        conn.row_factory = sqlite3.Row
+        user = dict(conn.execute("SELECT * FROM users WHERE chat_id=?", (chat_id,)).fetchone())
+        values = {name: _sheet_value(name, user.get(col)) for name, col in SHEET_TO_DB.items() if name != "chat_id"}
+        if is_new:
+            values["date_joined"] = user.get("last_interaction") or _now().isoformat()
+        get_outbox_drainer().outbox.journal(conn, chat_id, values)
     conn.commit()
     conn.close()
+    get_segment_index().add(chat_id)
+    if sheet:
+        get_outbox_drainer().notify()
 
-def update_user_fields(chat_id: int, **fields):
-    if not fields:
+def update_user_fields(chat_id: int, sheet: dict | None = None, **fields):
+    # sheet — колонки Google Sheets, которые нужно обновить вместе с users
+    if not fields and not sheet:
         return
-    conn = sqlite3.connect(DB_PATH)
-    cols = ", ".join([f"{k}=?" for k in fields.keys()])
-    values = list(fields.values())
-    values.append(chat_id)
-    conn.execute(f"UPDATE users SET {cols} WHERE chat_id=?", values)
+    conn = sqlite3.connect(get_settings().db_path)
+    if fields:
+        cols = ", ".join([f"{k}=?" for k in fields.keys()])
+        values = list(fields.values())
+        values.append(chat_id)
+        conn.execute(f"UPDATE users SET {cols} WHERE chat_id=?", values)
+    if sheet:
+        get_outbox_drainer().outbox.journal(conn, chat_id, {k: _sheet_value(k, v) for k, v in sheet.items()})
     conn.commit()
     conn.close()
+    if fields:
+        get_segment_index().update(chat_id, fields)
+    if sheet:
+        get_outbox_drainer().notify()
 
 def get_user(chat_id: int) -> dict | None:
-    conn = sqlite3.connect(DB_PATH)
+    conn = sqlite3.connect(get_settings().db_path)
+    conn.row_factory = sqlite3.Row
     cur = conn.execute("SELECT * FROM users WHERE chat_id=?", (chat_id,))
     row = cur.fetchone()
     conn.close()
     if not row:
         return None
-    keys = ["chat_id", "username", "first_name", "subscribed", "last_message",
-            "last_interaction", "file_sent_at", "followup_attempts", "manager_contacted", "lang"]
-    return dict(zip(keys, row))
+    return dict(row)
+
+# -------------------- Сегменты лидов --------------------
+# Битовые маски по языку, подписке, PDF, числу фоллоу-апов и контакту менеджера (segments.py):
+# строятся из users при старте и после архивации, дальше обновляются из upsert_user/update_user_fields.
+_segment_index: SegmentIndex | None = None
+
+def get_segment_index() -> SegmentIndex:
+    return _scoped("_segment_index", SegmentIndex)
+
+async def rebuild_segments() -> SegmentIndex:
+    index = get_segment_index()
+    index.begin_rebuild()
+    fresh = None
+    try:
+        fresh = await asyncio.to_thread(SegmentIndex.from_db, get_settings().db_path, lang_of=_user_lang)
+    except Exception:
+        logger.exception("Segment index rebuild failed")
+    finally:
+        index.finish_rebuild(fresh)
+    logger.info(f"Segment index: {len(index)} leads")
+    return index
+
+# -------------------- Предохранители --------------------
+# Отдельный предохранитель на каждую внешнюю зависимость: пока она недоступна,
+# вызовы отклоняются сразу (CircuitOpenError) и срабатывает запасной путь.
+BREAKER_NAMES = ("telegram", "sheets", "drive")
+_breakers: dict[str, CircuitBreaker] = {}
+
+def get_breaker(name: str) -> CircuitBreaker:
+    breakers = _scoped("_breakers", dict)
+    breaker = breakers.get(name)
+    if breaker is None:
+        cfg = get_settings()
+        breaker = breakers[name] = CircuitBreaker(
+            name,
+            failure_rate=cfg.breaker_failure_rate,
+            min_calls=cfg.breaker_min_calls,
+            window=cfg.breaker_window_seconds,
+            open_seconds=cfg.breaker_open_seconds,
+        )
+    return breaker
+
+def breakers_report() -> str:
+    return format_breakers(get_breaker(name) for name in BREAKER_NAMES)
 
 # -------------------- Google Sheets --------------------
-GSCOPE = ["https://www.googleapis.com/auth/spreadsheets"]
+# Sheets API вызывается напрямую через aiohttp (sheets_client.py): без потоков,
+# одна сессия с keep-alive, пакетные batchUpdate/append
+SHEET_HEADER = [
+    "chat_id", "username", "first_name", "date_joined", "subscribed",
+    "last_message", "file_sent", "followup_attempts", "manager_contacted",
+]
+_sheets_client: AsyncSheetsClient | None = None
 
-def _build_gspread_client():
-    if not GOOGLE_SERVICE_JSON:
+def _load_service_account_info() -> dict:
+    service_json = get_settings().google_service_json
+    if not service_json:
         raise RuntimeError("GOOGLE_SERVICE_JSON is empty")
     # Если указан путь к файлу и он существует — читаем файл
-    if os.path.isfile(GOOGLE_SERVICE_JSON):
-        creds = Credentials.from_service_account_file(GOOGLE_SERVICE_JSON, scopes=GSCOPE)
-    else:
-        # Если строка похожа на JSON — парсим; иначе бросаем понятную ошибку
-        stripped = GOOGLE_SERVICE_JSON.strip()
-        if stripped.startswith("{"):
-            info = json.loads(stripped)
-            creds = Credentials.from_service_account_info(info, scopes=GSCOPE)
-        else:
-            raise FileNotFoundError(f"Service account file not found: {GOOGLE_SERVICE_JSON}")
-    gc = gspread.authorize(creds)
-    return gc
+    if os.path.isfile(service_json):
+        with open(service_json, "r", encoding="utf-8") as f:
+            return json.load(f)
+    # Если строка похожа на JSON — парсим; иначе бросаем понятную ошибку
+    stripped = service_json.strip()
+    if stripped.startswith("{"):
+        return json.loads(stripped)
+    raise FileNotFoundError(f"Service account file not found: {service_json}")
 
-async def gs_write_new_user(user: dict):
-    def _task():
-        try:
-            gc = _build_gspread_client()
-            sh = gc.open_by_key(GSHEET_ID).worksheet(GSHEET_WORKSHEET)
-            sh.append_row([
-                str(user["chat_id"]),
-                user.get("username") or "",
-                user.get("first_name") or "",
-                datetime.now(TZ).isoformat(),
-                str(bool(user.get("subscribed", 0))),
-                user.get("last_message") or "",
-                "",  # file_sent
-                str(user.get("followup_attempts", 0)),
-                str(bool(user.get("manager_contacted", 0))),
-            ], value_input_option="USER_ENTERED")
-        except Exception as e:
-            logger.warning(f"Sheets write new user skipped: {e}")
-    await asyncio.to_thread(_task)
+# в режиме нескольких ботов клиенты Sheets делят один пул соединений (см. main_tenants)
+_shared_sheets_session = None
 
-async def gs_update_by_chat_id(chat_id: int, updates: dict):
-    def _task():
-        try:
-            gc = _build_gspread_client()
-            ws = gc.open_by_key(GSHEET_ID).worksheet(GSHEET_WORKSHEET)
+def _new_sheets_client() -> AsyncSheetsClient:
+    cfg = get_settings()
+    return AsyncSheetsClient(
+        cfg.gsheet_id,
+        ServiceAccountToken(_load_service_account_info),
+        max_connections=cfg.sheets_max_connections,
+        breaker=get_breaker("sheets"),
+        session=_shared_sheets_session,
+    )
+
+def get_sheets_client() -> AsyncSheetsClient:
+    # клиент создаётся при первом обращении и переиспользуется
+    return _scoped("_sheets_client", _new_sheets_client)
+
+def _ws_range(a1: str = "") -> str:
+    title = "'" + get_settings().gsheet_worksheet.replace("'", "''") + "'"
+    return f"{title}!{a1}" if a1 else title
+
+async def _sheet_index() -> tuple[list[str], dict[str, int]]:
+    # шапка и номера строк по chat_id: два чтения параллельно, одинаковые
+    # одновременные чтения от разных задач склеиваются клиентом
+    client = get_sheets_client()
+    head, col = await asyncio.gather(client.get_values(_ws_range("1:1")), client.get_values(_ws_range("A:A")))
+    header = [h.strip() for h in (head[0] if head else [])] or SHEET_HEADER
+    rows = {}
+    for row_no, cell in enumerate(col[1:], start=2):
+        if cell and cell[0].strip():
+            rows.setdefault(cell[0].strip(), row_no)
+    return header, rows
+
+def _sheet_changes(header: list[str], rows: dict[str, int], changes: list[tuple[int, dict]]):
+    # changes: [(chat_id, {колонка: значение})] -> ячейки для batchUpdate и новые строки для append
+    name_to_idx = {name: idx for idx, name in enumerate(header)}
+    updates: dict[tuple[int, int], str] = {}
+    appends: dict[str, list[str]] = {}
+    for chat_id, values in changes:
+        key = str(chat_id)
+        if key in rows:
+            for name, value in values.items():
+                if name in name_to_idx and name != "date_joined":
+                    updates[(rows[key], name_to_idx[name] + 1)] = value
+            continue
+        # строки нет — дописываем её целиком
+        row = appends.setdefault(key, [""] * len(header))
+        row[0] = key
+        for name, value in values.items():
+            if name in name_to_idx:
+                row[name_to_idx[name]] = value
+        if "date_joined" in name_to_idx and not row[name_to_idx["date_joined"]]:
+            row[name_to_idx["date_joined"]] = _now().isoformat()
+    return updates, list(appends.values())
+
+# журнал и сверка дописывают строки лидов, которых нет в таблице: чтение и запись одного
+# из них не должны перемежаться с другим, иначе оба допишут одного лида (дубль останется навсегда)
+_sheet_write_lock: asyncio.Lock | None = None
+
+def get_sheet_write_lock() -> asyncio.Lock:
+    return _scoped("_sheet_write_lock", asyncio.Lock)
+
+async def _write_sheet_changes(changes: list[tuple[int, dict]]):
+    # одна пачка: чтение шапки и колонки chat_id, один batchUpdate и один append
+    async with get_sheet_write_lock():
+        header, rows = await _sheet_index()
+        updates, appends = _sheet_changes(header, rows, changes)
+        client = get_sheets_client()
+        if updates:
+            await client.batch_update([
+                {"range": _ws_range(rowcol_to_a1(r, c)), "values": [[v]]} for (r, c), v in updates.items()
+            ])
+        if appends:
+            await client.append(_ws_range("A1"), appends)
+
+# -------------------- Журнал записей в Sheets (outbox) --------------------
+# Хендлеры не ходят в таблицу: изменения журналируются в sheets_outbox вместе
+# с users (update_user_fields(..., sheet=...)), фоновая задача отправляет их пачками.
+_outbox_drainer: OutboxDrainer | None = None
+
+def get_outbox_drainer() -> OutboxDrainer:
+    cfg = get_settings()
+    return _scoped(
+        "_outbox_drainer",
+        lambda: OutboxDrainer(
+            SheetsOutbox(cfg.db_path), _apply_outbox, batch_size=cfg.sheets_outbox_batch,
+            max_attempts=cfg.sheets_outbox_max_attempts, retryable=_outbox_retryable, on_parked=_alert_outbox_parked,
+        ),
+    )
+
+async def _apply_outbox(items: list[OutboxItem]):
+    # ошибки не глотаем — записи останутся в журнале до следующей попытки
+    await _write_sheet_changes([(item.chat_id, item.values) for item in items])
+
+def _outbox_retryable(e: BaseException) -> bool:
+    # запрос, отклонённый таблицей (4xx, кроме 429), повторять бесполезно;
+    # сеть, 429/5xx и открытый предохранитель — ждём восстановления
+    return not isinstance(e, SheetsError) or sheets_failure(e)
+
+async def _alert_outbox_parked(items: list[OutboxItem], error: str):
+    cfg = get_settings()
+    if not cfg.admin_chat_id:
+        return
+    ids = ", ".join(str(item.chat_id) for item in items[:10]) + (" …" if len(items) > 10 else "")
+    bot = Bot(cfg.bot_token)
+    try:
+        await bot.send_message(
+            cfg.admin_chat_id,
+            f"Sheets: {len(items)} записей журнала отложено ({ids})\n{error[:300]}\n"
+            "Таблицу по БД выправит /reconcile.",
+        )
+    finally:
+        await bot.session.close()
+
+# -------------------- Сверка SQLite ↔ Google Sheets --------------------
+# колонка в таблице -> колонка в users
+SHEET_TO_DB = {
+    "chat_id": "chat_id",
+    "username": "username",
+    "first_name": "first_name",
+    "subscribed": "subscribed",
+    "last_message": "last_message",
+    "last_interaction": "last_interaction",
+    "file_sent": "file_sent_at",
+    "followup_attempts": "followup_attempts",
+    "manager_contacted": "manager_contacted",
+}
+BOOL_COLUMNS = {"subscribed", "manager_contacted"}
+
+def _sheet_value(column: str, value) -> str:
+    if column in BOOL_COLUMNS:
+        return str(bool(int(value or 0)))
+    return "" if value is None else str(value)
+
+def _norm_cell(value) -> str:
+    # Sheets отдаёт TRUE/FALSE, мы пишем True/False
+    v = str(value).strip()
+    return v.lower() if v.lower() in ("true", "false") else v
+
+def _row_hash(values) -> str:
+    joined = "\x1f".join(_norm_cell(v) for v in values)
+    return hashlib.sha1(joined.encode("utf-8")).hexdigest()
+
+def _load_users_for_sheet() -> list[dict]:
+    conn = sqlite3.connect(get_settings().db_path)
+    conn.row_factory = sqlite3.Row
+    cols = ", ".join(SHEET_TO_DB.values())
+    rows = [dict(r) for r in conn.execute(f"SELECT {cols} FROM users ORDER BY chat_id")]
+    conn.close()
+    return rows
+
+def _reconcile_plan(values: list[list[str]], users: list[dict]) -> dict:
+    # values — результат get_all_values (первая строка — заголовок)
+    header = [h.strip() for h in values[0]] if values else []
+    compared = [(idx, name) for idx, name in enumerate(header) if name in SHEET_TO_DB and name != "chat_id"]
+    sheet_rows = {}
+    for row_no, row in enumerate(values[1:], start=2):
+        if row and row[0].strip() and row[0].strip() not in sheet_rows:
+            sheet_rows[row[0].strip()] = (row_no, row)
+
+    updates, appends = [], []
+    in_sync = 0
+    seen = set()
+    for user in users:
+        key = str(user["chat_id"])
+        seen.add(key)
+        expected = [_sheet_value(name, user.get(SHEET_TO_DB[name])) for _, name in compared]
+        if key not in sheet_rows:
+            new_row = []
+            for name in header:
+                if name in SHEET_TO_DB:
+                    new_row.append(_sheet_value(name, user.get(SHEET_TO_DB[name])))
+                elif name == "date_joined":
+                    new_row.append(user.get("last_interaction") or _now().isoformat())
+                else:
+                    new_row.append("")
+            appends.append(new_row)
+            continue
+        row_no, row = sheet_rows[key]
+        actual = [row[idx] if idx < len(row) else "" for idx, _ in compared]
+        # дешёвое сравнение по хэшу строки, по ячейкам — только при расхождении
+        if _row_hash(actual) == _row_hash(expected):
+            in_sync += 1
+            continue
+        for (idx, _), a, e in zip(compared, actual, expected):
+            if _norm_cell(a) != _norm_cell(e):
+                updates.append((row_no, idx + 1, e))
+
+    return {
+        "updates": updates,
+        "appends": appends,
+        "report": {
+            "db_rows": len(users),
+            "sheet_rows": len(sheet_rows),
+            "in_sync": in_sync,
+            "changed_rows": len({r for r, _, _ in updates}),
+            "changed_cells": len(updates),
+            "appended": len(appends),
+            "sheet_only": len(set(sheet_rows) - seen),
+        },
+    }
+
+async def reconcile_sheet(dry_run: bool = False) -> dict | None:
+    client = get_sheets_client()
+    try:
+        async with get_sheet_write_lock():
+            # одно чтение всей таблицы вместо поиска по каждому пользователю
+            plan = _reconcile_plan(await client.get_values(_ws_range()), _load_users_for_sheet())
+            report = plan["report"]
+            if not dry_run:
+                if plan["updates"]:
+                    await client.batch_update([
+                        {"range": _ws_range(rowcol_to_a1(row, col)), "values": [[value]]}
+                        for row, col, value in plan["updates"]
+                    ])
+                if plan["appends"]:
+                    await client.append(_ws_range("A1"), plan["appends"])
+    except Exception as e:
+        logger.warning(f"Sheets reconcile skipped: {e}")
+        return None
+    if not dry_run:
+        report["finished_at"] = _now().isoformat()
+        logger.info(f"Sheets reconcile: {report}")
+    return report
+
+def format_reconcile_report(report: dict) -> str:
+    return (
+        f"Строк в БД: {report['db_rows']}, в таблице: {report['sheet_rows']}\n"
+        f"Совпадают: {report['in_sync']}\n"
+        f"Расходятся: {report['changed_rows']} (ячеек: {report['changed_cells']})\n"
+        f"Нет в таблице: {report['appended']}\n"
+        f"Только в таблице: {report['sheet_only']}"
+    )
+
+# -------------------- Каталог документов --------------------
+DOCS_PREWARM_CONCURRENCY = 4
+_catalog: DocumentCatalog | None = None
+
+def get_catalog() -> DocumentCatalog:
+    return _scoped("_catalog", lambda: DocumentCatalog(get_settings().db_path))
+
+async def prewarm_documents(bot: Bot, docs: list[dict] | None = None) -> dict:
+    # заранее загружаем брошюры в служебный чат и сохраняем file_id:
+    # дальше лиды получают файл одним вызовом, без скачивания по URL
+    cfg = get_settings()
+    chat_id = cfg.docs_cache_chat_id or cfg.admin_chat_id
+    catalog = get_catalog()
+    docs = [d for d in (catalog.active() if docs is None else docs) if not d.get("file_id")]
+    if not docs or not chat_id:
+        return {"uploaded": 0, "failed": 0}
+    sem = asyncio.Semaphore(DOCS_PREWARM_CONCURRENCY)
+
+    async def upload(doc: dict) -> bool:
+        async with sem:
+            try:
+                msg = await bot.send_document(
+                    chat_id,
+                    URLInputFile(doc["url"], filename=doc["filename"]),
+                    disable_notification=True,
+                )
+                catalog.set_file_id(doc["id"], msg.document.file_id)
+            except Exception as e:
+                logger.warning(f"Document prewarm failed for {doc['lang']}/{doc['segment']}: {e}")
+                catalog.set_file_id(doc["id"], None, error=str(e)[:200])
+                return False
             try:
-                cell = ws.find(str(chat_id))
+                # file_id остаётся валидным и после удаления сообщения
+                await bot.delete_message(chat_id, msg.message_id)
             except Exception:
-                cell = None
-            if not cell:
-                ws.append_row([
-                    str(chat_id),
-                    "", "", datetime.now(TZ).isoformat(),
-                    str(bool(updates.get("subscribed", 0))),
-                    updates.get("last_message", ""),
-                    "",
-                    str(updates.get("followup_attempts", "")),
-                    str(bool(updates.get("manager_contacted", 0))),
-                ], value_input_option="USER_ENTERED")
-                return
-            row = cell.row
-            header = [h.strip() for h in ws.row_values(1)]
-            name_to_idx = {name: idx+1 for idx, name in enumerate(header)}
-            cells_to_update = []
-            for k, v in updates.items():
-                if k in name_to_idx:
-                    cells_to_update.append({
-                        "range": gspread.utils.rowcol_to_a1(row, name_to_idx[k]),
-                        "values": [[str(v)]],
-                    })
-            if cells_to_update:
-                body = {"valueInputOption": "USER_ENTERED", "data": [{"range": c["range"], "values": c["values"]} for c in cells_to_update]}
-                ws.spreadsheet.values_batch_update(body)
+                pass
+            return True
+
+    results = await asyncio.gather(*(upload(d) for d in docs))
+    report = {"uploaded": sum(results), "failed": len(results) - sum(results)}
+    logger.info(f"Documents prewarmed: {report}")
+    return report
+
+async def send_brochure(message: Message, doc: dict | None, caption: str | None = None) -> bool:
+    # caption — текст к брошюре в том же сообщении (компактная воронка);
+    # False — документ не ушёл, лиду отправлен контакт менеджера
+    catalog = get_catalog()
+    if doc and doc.get("file_id"):
+        try:
+            await message.answer_document(doc["file_id"], caption=caption)
+            catalog.hits += 1
+            return True
         except Exception as e:
-            logger.warning(f"Sheets update skipped for {chat_id}: {e}")
-    await asyncio.to_thread(_task)
+            # file_id мог устареть (например, сменился токен бота) — забываем и шлём по URL
+            logger.warning(f"Send document by file_id failed: {e}")
+            catalog.set_file_id(doc["id"], None, error=str(e)[:200])
+    catalog.misses += 1
+    drive = get_breaker("drive")
+    if not drive.allow():
+        # ссылка (Drive) недавно не отдавалась: не ждём таймаутов загрузки —
+        # базовая брошюра из кэша Telegram или сразу контакт менеджера
+        fallback = catalog.resolve(ANY_LANG, DEFAULT_SEGMENT)
+        if fallback and fallback.get("file_id") and (not doc or fallback["id"] != doc["id"]):
+            try:
+                await message.answer_document(fallback["file_id"], caption=caption)
+                catalog.hits += 1
+                return True
+            except Exception as e:
+                logger.warning(f"Send cached default document failed: {e}")
+        await message.answer(
+            "Не удалось отправить PDF. Свяжитесь с менеджером 👇",
+            reply_markup=followup_keyboard()
+        )
+        return False
+    url = doc["url"] if doc else get_runtime().get("pdf_url")
+    filename = doc["filename"] if doc else DEFAULT_FILENAME
+    sent = None
+    delivered = False
+    try:
+        sent = await message.answer_document(URLInputFile(url, filename=filename), caption=caption)
+        delivered = True
+        drive.record_success()
+    except Exception as e:
+        logger.exception("Send document via URL failed: %s", e)
+        # ошибка самого Bot API не говорит о недоступности ссылки
+        if not isinstance(e, CircuitOpenError) and not telegram_failure(e):
+            drive.record_failure(e)
+        # Fallback: скачиваем и отправляем как байты
+        try:
+            import aiohttp
+            async with aiohttp.ClientSession() as session:
+                async with session.get(url) as resp:
+                    content = await resp.read()
+                    if resp.status == 200 and content:
+                        drive.record_success()
+                        sent = await message.answer_document(BufferedInputFile(content, filename=filename), caption=caption)
+                        delivered = True
+                    else:
+                        drive.record_failure(f"HTTP {resp.status}")
+                        await message.answer(
+                            "Не удалось загрузить PDF по ссылке. Свяжитесь с менеджером 👇",
+                            reply_markup=followup_keyboard()
+                        )
+        except Exception as e:
+            logger.exception("Fallback download+send failed")
+            if not isinstance(e, CircuitOpenError) and not telegram_failure(e):
+                drive.record_failure(e)
+            await message.answer(
+                "Не удалось отправить PDF. Свяжитесь с менеджером 👇",
+                reply_markup=followup_keyboard()
+            )
+    # холодная отправка тоже прогревает кэш
+    file_id = getattr(getattr(sent, "document", None), "file_id", None)
+    if doc and file_id:
+        catalog.set_file_id(doc["id"], file_id)
+    return delivered
 
 # -------------------- Бот и маршруты --------------------
 router = Router()
-scheduler = AsyncIOScheduler(timezone=str(TZ))
+_scheduler = None
+
+def get_scheduler():
+    global _scheduler
+    if _scheduler is None:
+        from apscheduler.schedulers.asyncio import AsyncIOScheduler
+        _scheduler = AsyncIOScheduler(timezone=get_settings().timezone)
+    return _scheduler
+
+def __getattr__(name: str):
+    # botApp.scheduler создаётся лениво при первом обращении
+    if name == "scheduler":
+        return get_scheduler()
+    # совместимость со старыми именами конфига: botApp.TZ, botApp.PDF_URL, ...
+    if name == "TZ":
+        return get_settings().tz
+    if name.lower() in RUNTIME_KEYS:
+        return get_runtime().get(name.lower())
+    if name.isupper() and name.lower() in Settings.__dataclass_fields__:
+        return getattr(get_settings(), name.lower())
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 def greeting_keyboard(lang: str = "ru"):
     kb = InlineKeyboardBuilder()
-    btns = TEMPLATES.get(lang, TEMPLATES["ru"]) ["buttons"]
-    kb.button(text=btns["subscribe"], url=CHANNEL_LINK)
+    btns = get_templates().get(lang, get_templates()["ru"]) ["buttons"]
+    kb.button(text=btns["subscribe"], url=get_settings().channel_link)
     kb.button(text=btns["check_sub"], callback_data="check_sub")
     kb.button(text=btns["change_lang"], callback_data="lang_menu")
     return kb.as_markup()
 
 def followup_keyboard(lang: str = "ru"):
     kb = InlineKeyboardBuilder()
-    btns = TEMPLATES.get(lang, TEMPLATES["ru"]) ["buttons"]
-    kb.button(text=btns["contact_manager"], url=MANAGER_CONTACT)
+    btns = get_templates().get(lang, get_templates()["ru"]) ["buttons"]
+    kb.button(text=btns["contact_manager"], url=get_settings().manager_contact)
     return kb.as_markup()
 
+# -------------------- Ответ в теле вебхука --------------------
+# В режиме WEBHOOK_REPLY последний ответ хендлера не отправляется отдельным запросом,
+# а возвращается как TelegramMethod: aiogram кладёт его в HTTP-ответ на вебхук.
+# Результата (Message) у такого вызова нет, поэтому так отвечаем только последним действием.
+def webhook_reply_enabled() -> bool:
+    cfg = get_settings()
+    return bool(cfg.webhook_url and cfg.webhook_reply)
+
+async def reply_inline(method):
+    if webhook_reply_enabled():
+        return method
+    return await method
+
+# -------------------- Вызовы Telegram в воронке --------------------
+# FunnelMeter считает запросы к Bot API при обработке апдейтов лидов; FUNNEL_COMPACT=1 сокращает их:
+# правка сообщения вместо нового, брошюра с подписью вместо текста и документа.
+CAPTION_LIMIT = 1024
+_funnel_meter: FunnelMeter | None = None
+
+def get_funnel_meter() -> FunnelMeter:
+    return _scoped("_funnel_meter", FunnelMeter)
+
+async def _meter_funnel(handler, event, data):
+    user = data.get("event_from_user")
+    is_admin = user is not None and user.id == get_settings().admin_chat_id
+    return await get_funnel_meter()(handler, event, data, skip=is_admin)
+
+def funnel_compact() -> bool:
+    return bool(get_settings().funnel_compact)
+
 @router.message(CommandStart())
 async def on_start(message: Message, bot: Bot):
-    upsert_user(message.from_user.id, message.from_user.username, message.from_user.first_name)
-    await gs_write_new_user(get_user(message.from_user.id))
+    upsert_user(message.from_user.id, message.from_user.username, message.from_user.first_name, sheet=True)
+    mark_entry()
+    ru = get_templates()["ru"]
     kb = InlineKeyboardBuilder()
-    kb.button(text=TEMPLATES["ru"]["lang_buttons"]["ru"], callback_data="lang:ru")
-    kb.button(text=TEMPLATES["ru"]["lang_buttons"]["en"], callback_data="lang:en")
-    kb.button(text=TEMPLATES["ru"]["lang_buttons"]["th"], callback_data="lang:th")
-    await message.answer(TEMPLATES["ru"]["choose_lang"], reply_markup=kb.as_markup())
+    kb.button(text=ru["lang_buttons"]["ru"], callback_data="lang:ru")
+    kb.button(text=ru["lang_buttons"]["en"], callback_data="lang:en")
+    kb.button(text=ru["lang_buttons"]["th"], callback_data="lang:th")
+    return await reply_inline(message.answer(ru["choose_lang"], reply_markup=kb.as_markup()))
 
 @router.callback_query(F.data.startswith("lang:"))
 async def on_set_lang(callback: CallbackQuery):
     lang = callback.data.split(":",1)[1]
     if lang not in ("ru","en","th"):
         lang = "ru"
-    # сохраним в last_message специальный маркер
-    update_user_fields(callback.from_user.id, last_message=f"_lang:{lang}")
-    tmpl = TEMPLATES[lang]
-    await callback.message.edit_text(tmpl["greeting"], reply_markup=greeting_keyboard(lang))
+    # язык — в колонку lang (маркер в last_message перезаписывается следующим сообщением)
+    fields = {"last_message": f"_lang:{lang}", "lang": lang}
+    tz = _lang_tz(lang)
+    if tz and not (get_user(callback.from_user.id) or {}).get("tz"):
+        # пояс из импорта точнее — не перезаписываем
+        fields["tz"] = tz
+    update_user_fields(callback.from_user.id, **fields)
+    tmpl = get_templates()[lang]
+    # сразу снимаем «часики» с кнопки, затем правим сообщение
+    await callback.answer()
+    return await reply_inline(callback.message.edit_text(tmpl["greeting"], reply_markup=greeting_keyboard(lang)))
 
 @router.callback_query(F.data == "lang_menu")
 async def on_lang_menu(callback: CallbackQuery):
     # показать меню выбора языка ещё раз
+    ru = get_templates()["ru"]
     kb = InlineKeyboardBuilder()
-    kb.button(text=TEMPLATES["ru"]["lang_buttons"]["ru"], callback_data="lang:ru")
-    kb.button(text=TEMPLATES["ru"]["lang_buttons"]["en"], callback_data="lang:en")
-    kb.button(text=TEMPLATES["ru"]["lang_buttons"]["th"], callback_data="lang:th")
-    await callback.message.edit_text(TEMPLATES["ru"]["choose_lang"], reply_markup=kb.as_markup())
+    kb.button(text=ru["lang_buttons"]["ru"], callback_data="lang:ru")
+    kb.button(text=ru["lang_buttons"]["en"], callback_data="lang:en")
+    kb.button(text=ru["lang_buttons"]["th"], callback_data="lang:th")
+    await callback.answer()
+    return await reply_inline(callback.message.edit_text(ru["choose_lang"], reply_markup=kb.as_markup()))
+
+# -------------------- Подписка на канал --------------------
+# Флаг users.subscribed ведётся по событиям chat_member канала (бот — админ канала),
+# поэтому проверка подписанного лида — локальный запрос к SQLite без вызова API.
+SUBSCRIBED_STATUSES = {"creator", "administrator", "member"}
+
+def _is_member(member) -> bool:
+    status = getattr(member, "status", None)
+    return status in SUBSCRIBED_STATUSES or (status == "restricted" and bool(getattr(member, "is_member", False)))
+
+async def is_subscribed(bot: Bot, chat_id: int) -> bool:
+    u = get_user(chat_id)
+    if u and u.get("subscribed"):
+        return True
+    # отметки нет: подписался до того, как бот стал админом, или событие ещё в пути
+    member = await bot.get_chat_member(chat_id=get_settings().channel_id, user_id=chat_id)
+    if not _is_member(member):
+        return False
+    if u:
+        update_user_fields(chat_id, sheet={"subscribed": True}, subscribed=1)
+    return True
+
+@router.chat_member()
+async def on_channel_member(event: ChatMemberUpdated):
+    if event.chat.id != get_settings().channel_id:
+        return
+    user = event.new_chat_member.user
+    subscribed = _is_member(event.new_chat_member)
+    u = get_user(user.id)
+    # не лид бота или ничего не изменилось
+    if u is None or bool(u.get("subscribed")) == subscribed:
+        return
+    update_user_fields(user.id, sheet={"subscribed": subscribed}, subscribed=int(subscribed))
+    logger.info(f"Channel membership: {user.id} {'subscribed' if subscribed else 'unsubscribed'}")
 
 @router.callback_query(F.data == "check_sub")
 async def on_check_sub(callback: CallbackQuery, bot: Bot):
     try:
-        lang = "ru"
-        u = get_user(callback.from_user.id)
-        if u and (u.get("last_message") or "").startswith("_lang:"):
-            lang = u["last_message"].split(":",1)[1]
-        await callback.message.answer(TEMPLATES[lang]["checking_subscription"])
-        member = await bot.get_chat_member(chat_id=CHANNEL_ID, user_id=callback.from_user.id)
-        status = getattr(member, "status", None)
-        if status in {"creator", "administrator", "member"}:
-            update_user_fields(callback.from_user.id, subscribed=1)
-            await gs_update_by_chat_id(callback.from_user.id, {"subscribed": True})
-            await callback.message.answer(TEMPLATES[lang]["subscribed_ok"])
-        else:
-            await callback.answer("Похоже, вы ещё не подписаны 😔", show_alert=True)
+        tmpl = get_templates()[_user_lang(get_user(callback.from_user.id))]
+        if not funnel_compact():
+            await callback.message.answer(tmpl["checking_subscription"])
+        subscribed = await is_subscribed(bot, callback.from_user.id)
     except Exception as e:
         logger.exception("getChatMember error")
-        await callback.answer("Не удалось проверить подписку, попробуйте ещё раз.", show_alert=True)
+        return await reply_inline(callback.answer("Не удалось проверить подписку, попробуйте ещё раз.", show_alert=True))
+    if not subscribed:
+        return await reply_inline(callback.answer("Похоже, вы ещё не подписаны 😔", show_alert=True))
+    await callback.answer()
+    if funnel_compact():
+        # приветствие с кнопкой «Проверить подписку» превращается в ответ — кнопка больше не нужна
+        return await reply_inline(callback.message.edit_text(tmpl["subscribed_ok"]))
+    return await reply_inline(callback.message.answer(tmpl["subscribed_ok"]))
 
-@router.message(F.text.regexp(PROJECT_RE))
 async def on_project(message: Message, bot: Bot):
     # проверим подписку на всякий
     try:
-        member = await bot.get_chat_member(chat_id=CHANNEL_ID, user_id=message.from_user.id)
-        status = getattr(member, "status", None)
-        if status not in {"creator", "administrator", "member"}:
+        if not await is_subscribed(bot, message.from_user.id):
             await message.answer(
                 "Похоже, вы ещё не подписаны!😔\nНажмите кнопку ниже, чтобы подписаться и продолжить.",
                 reply_markup=greeting_keyboard(),
@@ -317,102 +801,159 @@ async def on_project(message: Message, bot: Bot):
         )
         return
 
-    lang = "ru"
     u = get_user(message.from_user.id)
-    if u:
-        if u.get("lang") in ("ru","en","th"):
-            lang = u["lang"]
-        elif (u.get("last_message") or "").startswith("_lang:"):
-            lang = u["last_message"].split(":",1)[1]
-    await message.answer(TEMPLATES[lang]["pdf_sent"])
-    try:
-        await message.answer_document(URLInputFile(PDF_URL, filename="RomeEstate_30_Projects.pdf"))
-    except Exception as e:
-        logger.exception("Send document via URL failed: %s", e)
-        # Fallback: скачиваем и отправляем как байты
-        try:
-            import aiohttp
-            async with aiohttp.ClientSession() as session:
-                async with session.get(PDF_URL) as resp:
-                    content = await resp.read()
-                    if resp.status == 200 and content:
-                        await message.answer_document(BufferedInputFile(content, filename="RomeEstate_30_Projects.pdf"))
-                    else:
-                        await message.answer(
-                            "Не удалось загрузить PDF по ссылке. Свяжитесь с менеджером 👇",
-                            reply_markup=followup_keyboard()
-                        )
-        except Exception:
-            logger.exception("Fallback download+send failed")
-            await message.answer(
-                "Не удалось отправить PDF. Свяжитесь с менеджером 👇",
-                reply_markup=followup_keyboard()
-            )
+    lang = _user_lang(u)
+    text = get_templates()[lang]["pdf_sent"]
+    doc = get_catalog().resolve(lang, (u or {}).get("segment"))
+    if funnel_compact() and len(text) <= CAPTION_LIMIT:
+        # не ушла — лиду уже отправлен контакт менеджера, «подборка готова» ему противоречила бы
+        delivered = await send_brochure(message, doc, caption=text)
+    else:
+        await message.answer(text)
+        delivered = await send_brochure(message, doc)
+    if delivered:
+        mark_conversion()
 
-    now_iso = datetime.now(TZ).isoformat()
+    now_iso = _now().isoformat()
     update_user_fields(
         message.from_user.id,
+        sheet={
+            "last_message": "project_requested",
+            "file_sent": now_iso,
+            "followup_attempts": 0
+        },
         last_message="project_requested",
         file_sent_at=now_iso,
         followup_attempts=0
     )
-    await gs_update_by_chat_id(message.from_user.id, {
-        "last_message": "project_requested",
-        "file_sent": now_iso,
-        "followup_attempts": 0
-    })
 
     schedule_followup(message.from_user.id, initial=True)
 
-@router.message()
 async def on_any_message(message: Message):
     upsert_user(message.from_user.id, message.from_user.username, message.from_user.first_name)
+    now_iso = _now().isoformat()
     update_user_fields(
         message.from_user.id,
+        sheet={"last_message": message.text or "", "last_interaction": now_iso},
         last_message=message.text or "",
-        last_interaction=datetime.now(TZ).isoformat()
+        last_interaction=now_iso
     )
-    await gs_update_by_chat_id(message.from_user.id, {
-        "last_message": message.text or "",
-        "last_interaction": datetime.now(TZ).isoformat()
-    })
 
     # Fallback/вопросы — отправим контакт менеджера
-    lang = "ru"
-    u = get_user(message.from_user.id)
-    if u and (u.get("last_message") or "").startswith("_lang:"):
-        lang = u["last_message"].split(":",1)[1]
-    await message.answer(TEMPLATES[lang]["fallback_question"], reply_markup=followup_keyboard(lang))
+    lang = _user_lang(get_user(message.from_user.id))
+    return await reply_inline(message.answer(get_templates()[lang]["fallback_question"], reply_markup=followup_keyboard(lang)))
 
 # -------------------- Follow-up --------------------
-def schedule_followup(chat_id: int, initial: bool = False):
+# Последовательность напоминаний задаётся данными (runtime-настройка followup_cadence, JSON);
+# если она пустая — N одинаковых шагов через reminder_interval_days.
+# Сроки живут в куче FollowupQueue, одна фоновая задача отправляет созревшие пачками.
+FOLLOWUP_BATCH_SIZE = 100
+FOLLOWUP_CONCURRENCY = 10
+
+followup_queue = FollowupQueue()
+_cadence_cache: dict | None = None
+
+def get_cadence() -> Cadence:
+    cache = _scoped("_cadence_cache", dict)
+    runtime = get_runtime()
+    key = (
+        runtime.get("followup_cadence"),
+        runtime.get("reminder_interval_days"),
+        runtime.get("reminder_max_attempts"),
+    )
+    if key not in cache:
+        raw, interval_days, max_attempts = key
+        cadence = None
+        if raw:
+            try:
+                cadence = Cadence.from_config(raw)
+            except Exception as e:
+                logger.warning(f"Invalid followup_cadence, using uniform: {e}")
+        if cadence is None:
+            cadence = Cadence.uniform(interval_days, max_attempts)
+        cache.clear()
+        cache[key] = cadence
+    return cache[key]
+
+def _user_lang(user: dict | None) -> str:
+    if user:
+        if user.get("lang") in ("ru", "en", "th"):
+            return user["lang"]
+        marker = user.get("last_message") or ""
+        if marker.startswith("_lang:") and marker.split(":", 1)[1] in ("ru", "en", "th"):
+            return marker.split(":", 1)[1]
+    return "ru"
+
+def _user_tz(user: dict | None):
+    if user and user.get("tz"):
+        try:
+            return ZoneInfo(user["tz"])
+        except Exception:
+            pass
+    return get_settings().tz
+
+def _lang_tz(lang: str) -> str | None:
+    # пояс по языку из LANG_TIMEZONES; неизвестное имя пояса — не пишем
+    name = get_settings().lang_tz.get(lang)
+    if not name:
+        return None
+    try:
+        ZoneInfo(name)
+    except Exception:
+        logger.warning(f"LANG_TIMEZONES: unknown time zone {name!r} for {lang}")
+        return None
+    return name
+
+def _followup_text(lang: str, template: str) -> str:
+    tmpl = get_templates().get(lang, get_templates()["ru"])
+    return tmpl.get(template) or get_templates()["ru"].get(template) or tmpl["followup"]
+
+def _parse_ts(value: str) -> datetime:
+    # время из users; без пояса (старый импорт, ручная правка) — в поясе бота
+    dt = datetime.fromisoformat(value)
+    return dt.replace(tzinfo=get_settings().tz) if dt.tzinfo is None else dt
+
+def _followup_due(user: dict, step: int, cadence: Cadence) -> datetime | None:
+    # срок шага по каденции, отсчитанный от выдачи PDF
+    if cadence.step(step) is None or not user.get("file_sent_at"):
+        return None
+    try:
+        anchor = _parse_ts(user["file_sent_at"])
+    except ValueError:
+        return None
+    return cadence.adjust_quiet(cadence.due_at(anchor, step), _user_tz(user))
+
+def schedule_followup(chat_id: int, initial: bool = False, last_sent: datetime | None = None):
     user = get_user(chat_id)
     if not user:
         return
-    attempts = int(user.get("followup_attempts") or 0)
-    if not initial and attempts >= REMINDER_MAX_ATTEMPTS:
+    cadence = get_cadence()
+    attempts = 0 if initial else int(user.get("followup_attempts") or 0)
+    # тот же якорь, что и в restore_followups (выдача PDF): срок не сдвигается после рестарта
+    due = _followup_due(user, attempts, cadence)
+    if due is None:
         return
+    if last_sent is not None:
+        # предыдущий шаг ушёл с опозданием (простой, тихие часы, предохранитель) — следующий
+        # не раньше его собственной паузы после фактической отправки, без залпа «догоняющих»
+        due = max(due, cadence.adjust_quiet(last_sent + cadence.step(attempts).delay, _user_tz(user)))
+    now = _now()
+    if due <= now:
+        due = cadence.adjust_quiet(now + timedelta(seconds=10), _user_tz(user))
+    get_followup_dispatcher().schedule(chat_id, due, attempts)
 
-    if initial:
-        start_from = datetime.now(TZ) + timedelta(days=REMINDER_INTERVAL_DAYS)
-    else:
-        start_from = datetime.now(TZ) + timedelta(days=REMINDER_INTERVAL_DAYS)
-
-    scheduler.add_job(
-        func=async_followup_job,
-        trigger=DateTrigger(run_date=start_from),
-        args=[chat_id],
-        id=f"followup_{chat_id}_{attempts+1}",
-        replace_existing=True,
-        misfire_grace_time=3600
-    )
+def _session_has_breaker(bot) -> bool:
+    session = getattr(bot, "session", None)
+    return any(isinstance(m, TelegramBreakerMiddleware) for m in getattr(session, "middleware", ()))
 
-async def async_followup_job(chat_id: int):
+async def async_followup_job(chat_id: int, bot: Bot | None = None):
     user = get_user(chat_id)
     if not user:
         return
+    cadence = get_cadence()
     attempts = int(user.get("followup_attempts") or 0)
-    if attempts >= REMINDER_MAX_ATTEMPTS:
+    step = cadence.step(attempts)
+    if step is None:
         return
 
     # условие: не было ответа с момента file_sent
@@ -421,49 +962,145 @@ async def async_followup_job(chat_id: int):
     if not file_sent_at:
         return
     try:
-        file_sent_dt = datetime.fromisoformat(file_sent_at)
-        last_interaction_dt = datetime.fromisoformat(last_interaction) if last_interaction else None
+        file_sent_dt = _parse_ts(file_sent_at)
+        last_interaction_dt = _parse_ts(last_interaction) if last_interaction else None
     except Exception:
         return
 
     if last_interaction_dt and last_interaction_dt > file_sent_dt:
         return  # пользователь что-то писал после отправки файла
 
-    # отправим follow-up
+    # отправим follow-up на языке пользователя
+    lang = _user_lang(user)
+    own_bot = bot is None
     try:
-        bot = Bot(BOT_TOKEN)
-        await bot.send_message(
-            chat_id,
-            TEMPLATES["followup"],
-            reply_markup=followup_keyboard()
-        )
-        await bot.session.close()
+        if own_bot:
+            bot = Bot(get_settings().bot_token)
+        text, markup = _followup_text(lang, step.template), followup_keyboard(lang)
+        if _session_has_breaker(bot):
+            # сессия (общая сессия ботов-тенантов) уже идёт через предохранитель: второй слой
+            # занял бы единственную пробу half-open и засчитал отказ middleware как успех
+            await bot.send_message(chat_id, text, reply_markup=markup)
+        else:
+            await get_breaker("telegram").call(
+                bot.send_message, chat_id, text, reply_markup=markup, is_failure=telegram_failure,
+            )
+    except CircuitOpenError as e:
+        # Bot API недоступен — не тратим попытку, вернём напоминание в очередь после паузы
+        get_followup_dispatcher().schedule(chat_id, _now() + timedelta(seconds=max(e.retry_in, 1)), attempts)
+        return
     except Exception:
         logger.exception("Follow-up send failed")
         return
+    finally:
+        if own_bot and bot is not None:
+            await bot.session.close()
 
     attempts += 1
-    update_user_fields(chat_id, followup_attempts=attempts)
-    await gs_update_by_chat_id(chat_id, {"followup_attempts": attempts})
-    if attempts < REMINDER_MAX_ATTEMPTS:
-        schedule_followup(chat_id, initial=False)
+    update_user_fields(chat_id, sheet={"followup_attempts": attempts}, followup_attempts=attempts)
+    if attempts < cadence.max_attempts:
+        schedule_followup(chat_id, initial=False, last_sent=_now())
+
+async def _dispatch_followups(batch: list):
+    # одна сессия Bot на пачку (у бота-тенанта — его общий Bot), ограниченная параллельность отправки
+    tenant = current_tenant()
+    own_bot = tenant is None or tenant.bot is None
+    bot = Bot(get_settings().bot_token) if own_bot else tenant.bot
+    sem = asyncio.Semaphore(FOLLOWUP_CONCURRENCY)
+
+    async def _one(chat_id):
+        async with sem:
+            await async_followup_job(chat_id, bot=bot)
+
+    try:
+        await asyncio.gather(*(_one(chat_id) for chat_id, _ in batch))
+    finally:
+        if own_bot:
+            await bot.session.close()
+
+followup_dispatcher = FollowupDispatcher(followup_queue, _dispatch_followups, batch_size=FOLLOWUP_BATCH_SIZE)
+
+def get_followup_dispatcher() -> FollowupDispatcher:
+    return _scoped(
+        "followup_dispatcher",
+        lambda: FollowupDispatcher(FollowupQueue(), _dispatch_followups, batch_size=FOLLOWUP_BATCH_SIZE),
+    )
 
 # -------------------- Admin (MVP) --------------------
-@router.message(F.text.startswith("/update_pdf"))
 async def admin_update_pdf(message: Message):
-    if message.from_user.id != ADMIN_CHAT_ID:
+    if message.from_user.id != get_settings().admin_chat_id:
         return
-    parts = message.text.strip().split(maxsplit=1)
+    # /update_pdf <url> [lang|*] [segment]
+    parts = message.text.strip().split()
     if len(parts) < 2:
-        await message.reply("Использование: /update_pdf <url>")
+        await message.reply("Использование: /update_pdf <url> [ru|en|th|*] [сегмент]")
+        return
+    url = parts[1]
+    lang = parts[2].lower() if len(parts) > 2 else ANY_LANG
+    segment = parts[3] if len(parts) > 3 else DEFAULT_SEGMENT
+    if lang not in (ANY_LANG, *get_templates()):
+        await message.reply(f"Неизвестный язык: {lang}")
+        return
+    if lang == ANY_LANG and segment == DEFAULT_SEGMENT:
+        # сохраняется в таблице settings: переживает рестарт и видна другим процессам
+        get_runtime().set("pdf_url", url)
+    doc = get_catalog().publish(url, lang=lang, segment=segment)
+    status = ""
+    bot = getattr(message, "bot", None)
+    if bot is not None:
+        report = await prewarm_documents(bot, [doc])
+        status = " file_id закэширован." if report["uploaded"] else ""
+    await message.reply(f"PDF ссылка обновлена: {lang}/{segment} v{doc['version']}.{status}")
+
+async def admin_docs(message: Message):
+    if message.from_user.id != get_settings().admin_chat_id:
+        return
+    catalog = get_catalog()
+    lines = []
+    for doc in catalog.active():
+        if doc["file_id"]:
+            state = "✅ file_id"
+        elif doc["upload_error"]:
+            state = f"❌ {doc['upload_error'][:60]}"
+        else:
+            state = "⏳ не загружен"
+        lines.append(f"{doc['lang']}/{doc['segment']} v{doc['version']} — {state}\n{doc['url']}")
+    stats = catalog.stats()
+    lines.append(f"Отправок по file_id: {stats['hits']}, по URL: {stats['misses']}")
+    await message.reply("Документы:\n" + "\n".join(lines))
+
+async def admin_settings(message: Message):
+    if message.from_user.id != get_settings().admin_chat_id:
+        return
+    lines = [f"{key} = {value}" for key, value in get_runtime().all().items()]
+    await message.reply("Текущие настройки:\n" + "\n".join(lines))
+
+async def admin_set(message: Message):
+    if message.from_user.id != get_settings().admin_chat_id:
+        return
+    parts = message.text.strip().split(maxsplit=2)
+    if len(parts) < 3:
+        await message.reply("Использование: /set <ключ> <значение>")
+        return
+    key, raw = parts[1], parts[2].strip()
+    if key == "followup_cadence" and raw:
+        try:
+            Cadence.from_config(raw)
+        except Exception as e:
+            await message.reply(f"Некорректная каденция: {e}")
+            return
+    try:
+        value = get_runtime().set(key, raw)
+    except KeyError:
+        await message.reply(f"Неизвестный ключ. Доступны: {', '.join(RUNTIME_KEYS)}")
+        return
+    except ValueError:
+        await message.reply(f"Некорректное значение для {key}: {raw}")
         return
-    global PDF_URL
-    PDF_URL = parts[1].strip()
-    await message.reply("PDF ссылка обновлена.")
+    await message.reply(f"{key} = {value}")
 
-@router.message(F.text.startswith("/force_followup"))
 async def admin_force_followup(message: Message):
-    if message.from_user.id != ADMIN_CHAT_ID:
+    if message.from_user.id != get_settings().admin_chat_id:
         return
     parts = message.text.strip().split(maxsplit=1)
     if len(parts) < 2 or not parts[1].isdigit():
@@ -474,14 +1111,13 @@ async def admin_force_followup(message: Message):
     await message.reply(f"Follow-up поставлен для {chat_id}")
 
 # -------------------- Доп. админ-команды --------------------
-@router.message(F.text.startswith("/export_leads"))
 async def admin_export_leads(message: Message):
-    if message.from_user.id != ADMIN_CHAT_ID:
+    if message.from_user.id != get_settings().admin_chat_id:
         return
     # простой CSV-экспорт текущей таблицы users из SQLite
     import csv
     from io import StringIO
-    conn = sqlite3.connect(DB_PATH)
+    conn = sqlite3.connect(get_settings().db_path)
     cur = conn.execute("SELECT chat_id, username, first_name, last_interaction, subscribed, last_message, file_sent_at, followup_attempts, manager_contacted FROM users")
     rows = cur.fetchall()
     conn.close()
@@ -492,9 +1128,8 @@ async def admin_export_leads(message: Message):
     buf.seek(0)
     await message.answer_document(document=("leads.csv", buf.getvalue()))
 
-@router.message(F.text.startswith("/manager_contacted"))
 async def admin_manager_contacted(message: Message):
-    if message.from_user.id != ADMIN_CHAT_ID:
+    if message.from_user.id != get_settings().admin_chat_id:
         return
     parts = message.text.strip().split(maxsplit=2)
     if len(parts) < 2 or not parts[1].isdigit():
@@ -504,121 +1139,864 @@ async def admin_manager_contacted(message: Message):
     state = True
     if len(parts) >= 3:
         state = parts[2].lower() == "on"
-    update_user_fields(chat_id, manager_contacted=1 if state else 0)
-    await gs_update_by_chat_id(chat_id, {"manager_contacted": state})
+    update_user_fields(chat_id, sheet={"manager_contacted": state}, manager_contacted=1 if state else 0)
     await message.reply(f"manager_contacted={'on' if state else 'off'} для {chat_id}")
 
-@router.message(F.text.startswith("/health"))
+async def admin_reconcile(message: Message):
+    if message.from_user.id != get_settings().admin_chat_id:
+        return
+    # /reconcile dry — только отчёт о расхождениях, без записи
+    dry_run = message.text.strip().split()[-1].lower() == "dry"
+    report = await reconcile_sheet(dry_run=dry_run)
+    if report is None:
+        await message.reply("Сверка не удалась, подробности в логах.")
+        return
+    title = "Расхождения (без записи):" if dry_run else "Сверка выполнена:"
+    await message.reply(f"{title}\n{format_reconcile_report(report)}")
+
 async def admin_health(message: Message):
-    if message.from_user.id != ADMIN_CHAT_ID:
+    if message.from_user.id != get_settings().admin_chat_id:
         return
     try:
-        bot = Bot(BOT_TOKEN)
+        bot = Bot(get_settings().bot_token)
         me = await bot.get_me()
         await bot.session.close()
-        await message.reply(f"OK: @{me.username}")
+        status = f"OK: @{me.username}"
     except Exception as e:
-        await message.reply(f"Health error: {e}")
+        status = f"Health error: {e}"
+    await message.reply(f"{status}\n{breakers_report()}\n{loop_report()}")
+
+# -------------------- Диагностика цикла событий --------------------
+PROFILE_DEFAULT_SECONDS = 10
+_loop_monitor: LoopLagMonitor | None = None
+
+def get_loop_monitor() -> LoopLagMonitor:
+    global _loop_monitor
+    if _loop_monitor is None:
+        _loop_monitor = LoopLagMonitor(threshold=get_settings().loop_lag_threshold or 0.25)
+    return _loop_monitor
+
+def loop_report() -> str:
+    s = get_loop_monitor().stats()
+    line = f"Цикл событий: задержка {s['lag_ms']} мс, p99 {s['p99_ms']} мс, макс {s['max_ms']} мс, зависаний {s['stalls']}"
+    if s["last_stall"]:
+        last = s["last_stall"]
+        line += f"\nПоследнее: {last['at']}, {last['blocked_ms']} мс в {last['task']}"
+    return line
+
+async def admin_profile(message: Message):
+    cfg = get_settings()
+    if message.from_user.id != cfg.admin_chat_id:
+        return
+    # /profile [секунды] — семплирующий профиль всего процесса, collapsed stacks для flamegraph/speedscope
+    parts = message.text.strip().split()
+    seconds = int(parts[1]) if len(parts) > 1 and parts[1].isdigit() else PROFILE_DEFAULT_SECONDS
+    seconds = max(1, min(seconds, cfg.profile_max_seconds))
+    await message.reply(f"Снимаю профиль {seconds} с…")
+    stacks, samples = await asyncio.to_thread(sample_stacks, seconds)
+    top = "\n".join(f"{count} — {frame}" for frame, count in top_frames(stacks))
+    caption = f"Профиль {seconds} с, {samples} срезов\n{loop_report()}\n\nЧаще всего:\n{top}"
+    await message.answer_document(
+        BufferedInputFile(format_collapsed(stacks).encode("utf-8"), filename=f"profile-{_now():%Y%m%d-%H%M%S}.collapsed"),
+        caption=caption[:1024],
+    )
+
+# -------------------- Память --------------------
+memory_tracker = MemoryTracker()
+_memory_alerted: set[str] = set()
+# боты режима TENANTS (create_tenants_app); пусто — один бот
+_tenants: list[Tenant] = []
+
+def _bot_gauges() -> dict:
+    # счётчики одного бота (в режиме TENANTS — вызывается в контексте каждого)
+    queue = get_followup_dispatcher().queue.stats()
+    sheets_client, dashboard = _peek("_sheets_client"), _peek("_dashboard")
+    return {
+        "followup_queue": queue["pending"],
+        "followup_heap": queue["heap"],
+        "chat_slots": get_chat_serializer().stats()["chats"],
+        "sheets_inflight_reads": sheets_client.stats()["inflight_reads"] if sheets_client is not None else 0,
+        "dashboard_cache_kb": round(dashboard.cache_bytes() / 1024, 1) if dashboard is not None else 0,
+    }
+
+def memory_gauges() -> dict:
+    # счётчики подсистем, которые могут копить память; обход кучи (сессии) — не чаще раза в час
+    gauges = {
+        "rss_mb": round(rss_bytes() / 1024 / 1024, 1),
+        "scheduler_jobs": len(_scheduler.get_jobs()) if _scheduler is not None else 0,
+        "client_sessions": open_client_sessions(),
+    }
+    # у ботов-тенантов очереди, лимиты по чатам и клиенты свои — суммируем по всем
+    per_bot = [tenant.bind(_bot_gauges)() for tenant in _tenants] if _tenants else [_bot_gauges()]
+    for name in per_bot[0]:
+        gauges[name] = round(sum(bot[name] for bot in per_bot), 1)
+    gauges.update({
+        "recent_errors": len(recent_errors.records),
+        "tracemalloc": memory_tracker.tracing,
+    })
+    try:
+        gauges.update(executor_stats(asyncio.get_running_loop()))
+    except RuntimeError:
+        pass
+    return gauges
+
+def _memory_thresholds() -> dict:
+    cfg = get_settings()
+    return {
+        "rss_mb": cfg.memory_alert_rss_mb,
+        "scheduler_jobs": cfg.memory_alert_scheduler_jobs,
+        "client_sessions": cfg.memory_alert_client_sessions,
+        "executor_queue": cfg.memory_alert_executor_queue,
+    }
+
+def format_memory_gauges(gauges: dict) -> str:
+    return "\n".join(f"{name}: {value}" for name, value in gauges.items())
+
+async def async_memory_check(bot: Bot | None = None) -> list[str]:
+    # уведомляем один раз на превышение; повторно — после возврата ниже порога
+    global _memory_alerted
+    gauges = memory_gauges()
+    problems = crossed(gauges, _memory_thresholds())
+    names = {p.split(" ", 1)[0] for p in problems}
+    fresh = [p for p in problems if p.split(" ", 1)[0] not in _memory_alerted]
+    _memory_alerted = names
+    logger.info(f"Memory: {gauges}")
+    cfg = get_settings()
+    if fresh and cfg.admin_chat_id:
+        logger.warning(f"Memory thresholds crossed: {fresh}")
+        if bot is None and _tenants:
+            # в режиме TENANTS общего токена может не быть — пишем через первого бота
+            bot = _tenants[0].bot
+        own_bot = bot is None
+        try:
+            if own_bot:
+                bot = Bot(cfg.bot_token)
+            await bot.send_message(cfg.admin_chat_id, "Память: превышены пороги\n" + "\n".join(fresh))
+        except Exception:
+            logger.exception("Memory alert failed")
+        finally:
+            if own_bot and bot is not None:
+                await bot.session.close()
+    return fresh
+
+def schedule_memory_check():
+    get_scheduler().add_job(async_memory_check, "interval", minutes=60, id="memory", replace_existing=True)
+
+async def admin_memory(message: Message):
+    if message.from_user.id != get_settings().admin_chat_id:
+        return
+    # /memory — счётчики и разница снимков tracemalloc; /memory stop — выключить трассировку
+    arg = message.text.strip().split()[-1].lower()
+    if arg == "stop":
+        memory_tracker.stop()
+        await message.reply("tracemalloc выключен.")
+        return
+    gauges = memory_gauges()
+    report = memory_tracker.report()
+    await message.reply(f"{format_memory_gauges(gauges)}\n\n{report}"[:4000])
+
+async def admin_dbstats(message: Message):
+    if message.from_user.id != get_settings().admin_chat_id:
+        return
+    stats = await asyncio.to_thread(db_stats, get_settings().db_path)
+    lines = [
+        f"Размер: {stats['size_bytes'] / 1024 / 1024:.1f} МБ "
+        f"({stats['page_count']} стр. × {stats['page_size']} Б, свободно {stats['freelist_count']})",
+        f"auto_vacuum: {stats['auto_vacuum']}, лидов: {stats['users']}",
+    ]
+    report = get_retention_report()
+    if report:
+        lines.append(format_retention_report(report))
+    await message.reply("\n".join(lines))
+
+SEGMENT_SAMPLE = 10
+
+def format_segment_counts(index: SegmentIndex) -> str:
+    counts = index.counts()
+    lines = [f"Лидов в индексе: {len(index)}"]
+    lines += [f"{name}: {count}" for name, count in counts.items()]
+    return "\n".join(lines)
+
+async def admin_segments(message: Message):
+    # /segments — размеры всех сегментов; /segments en & subscribed & !manager_contacted — аудитория;
+    # /segments rebuild — перечитать индекс из БД
+    if message.from_user.id != get_settings().admin_chat_id:
+        return
+    index = get_segment_index()
+    parts = message.text.strip().split(maxsplit=1)
+    if len(parts) == 1:
+        await message.reply(format_segment_counts(index))
+        return
+    if parts[1] == "rebuild":
+        # лиды, загруженные в БД мимо бота (python botApp.py import), попадают в индекс только так
+        await message.reply(format_segment_counts(await rebuild_segments()))
+        return
+    started = time.perf_counter()
+    try:
+        mask = index.query(parts[1])
+    except ValueError as e:
+        await message.reply(f"{e}\nСегменты: all, ru/en/th, subscribed, pdf, manager_contacted, attempts:N, segment:<имя>")
+        return
+    count = mask.bit_count()
+    elapsed_us = (time.perf_counter() - started) * 1e6
+    sample = [str(chat_id) for chat_id in itertools.islice(index.iter_chat_ids(mask), SEGMENT_SAMPLE)]
+    await message.reply(
+        f"{parts[1]}: {count} из {len(index)} ({elapsed_us:.0f} мкс)"
+        + (f"\n{', '.join(sample)}{' …' if count > len(sample) else ''}" if sample else "")
+    )
+
+async def admin_snapshot(message: Message):
+    if message.from_user.id != get_settings().admin_chat_id:
+        return
+    if not get_settings().snapshot_dir:
+        await message.reply("Снимки выключены: задайте SNAPSHOT_DIR.")
+        return
+    report = await async_snapshot()
+    await message.reply(format_snapshot_report(report) if report else "Снимок не удался, подробности в логах.")
+
+async def admin_funnel(message: Message):
+    # /funnel — сколько запросов к Bot API стоит лид; /funnel reset — начать счёт заново
+    if message.from_user.id != get_settings().admin_chat_id:
+        return
+    meter = get_funnel_meter()
+    if message.text.strip().split()[1:2] == ["reset"]:
+        meter.reset()
+        await message.reply("Счётчики воронки сброшены.")
+        return
+    mode = "компактная" if funnel_compact() else "классическая"
+    await message.reply(f"Воронка: {mode}\n{format_funnel(meter.stats())}")
 
-@router.message(F.text.startswith("/chat_id"))
 async def admin_chat_id(message: Message):
     await message.reply(f"Ваш chat_id: {message.chat.id}")
 
+# -------------------- Маршрутизация сообщений --------------------
+# Одна точка входа для текстовых сообщений: команды админа проверяются раньше
+# ключевых слов и fallback-а (раньше catch-all перехватывал их первым).
+MESSAGE_COMMANDS = {
+    "update_pdf": admin_update_pdf,
+    "settings": admin_settings,
+    "set": admin_set,
+    "force_followup": admin_force_followup,
+    "export_leads": admin_export_leads,
+    "manager_contacted": admin_manager_contacted,
+    "reconcile": admin_reconcile,
+    "health": admin_health,
+    "chat_id": admin_chat_id,
+    "docs": admin_docs,
+    "dbstats": admin_dbstats,
+    "profile": admin_profile,
+    "memory": admin_memory,
+    "snapshot": admin_snapshot,
+    "segments": admin_segments,
+    "funnel": admin_funnel,
+}
+
+intent_classifier = IntentClassifier(
+    commands=MESSAGE_COMMANDS,
+    keywords={"project": ["project", "proekt", "โปรเจกต์", "โปรเจค", "โครงการ"]},
+    prefixes={"project": ["проект"]},
+)
+
+@router.message()
+async def on_message(message: Message, bot: Bot):
+    intent = intent_classifier.classify(message.text)
+    if intent.kind == "command":
+        return await MESSAGE_COMMANDS[intent.name](message)
+    if intent.kind == "keyword" and intent.name == "project":
+        return await on_project(message, bot)
+    return await on_any_message(message)
+
+def _add_job(func, trigger, job_id: str, **kwargs):
+    # в режиме нескольких ботов задача выполняется в контексте своего бота, id — с его именем
+    tenant = current_tenant()
+    if tenant is not None:
+        func, job_id = tenant.bind(func), f"{tenant.name}:{job_id}"
+    get_scheduler().add_job(func, trigger, id=job_id, replace_existing=True, **kwargs)
+
 # Health-check раз в 60 минут
 def schedule_healthcheck():
-    scheduler.add_job(async_healthcheck, "interval", minutes=60, id="healthcheck", replace_existing=True)
+    _add_job(async_healthcheck, "interval", "healthcheck", minutes=60)
+
+# Сверка SQLite ↔ Sheets одним батчем
+def schedule_reconcile():
+    minutes = get_settings().reconcile_interval_minutes
+    if minutes <= 0:
+        return
+    _add_job(reconcile_sheet, "interval", "reconcile", minutes=minutes)
+
+# -------------------- Хранение данных --------------------
+last_retention_report: dict | None = None
+
+def get_retention_report() -> dict | None:
+    tenant = current_tenant()
+    return tenant.state.get("last_retention_report") if tenant is not None else last_retention_report
+
+def format_retention_report(report: dict) -> str:
+    return (
+        f"Архивировано: {report['archived']} (активность до {report['cutoff'][:10] or '—'}), "
+        f"удалено версий документов: {report['documents_pruned']}\n"
+        f"Освобождено страниц: {report['pages_freed']}, размер: "
+        f"{report['size_before'] / 1024 / 1024:.1f} → {report['size_after'] / 1024 / 1024:.1f} МБ, "
+        f"{report['seconds']} с"
+    )
+
+async def async_retention() -> dict | None:
+    global last_retention_report
+    cfg = get_settings()
+    # при RETENTION_MONTHS=0 никого не архивируем (пустая граница), но vacuum и ANALYZE выполняем
+    months = cfg.retention_months
+    cutoff = (_now() - timedelta(days=30 * months)).isoformat() if months > 0 else ""
+    try:
+        report = await asyncio.to_thread(
+            run_retention, cfg.db_path, cfg.archive_db_path or archive_path_for(cfg.db_path),
+            cutoff, cfg.retention_batch,
+        )
+    except Exception:
+        logger.exception("Retention failed")
+        return None
+    tenant = current_tenant()
+    if tenant is not None:
+        tenant.state["last_retention_report"] = report
+    else:
+        last_retention_report = report
+    logger.info(f"Retention: {report}")
+    # архивированные лиды уходят из сегментов
+    await rebuild_segments()
+    return report
+
+# Архив, vacuum и ANALYZE — ночью, когда лидов почти нет
+def schedule_retention():
+    _add_job(async_retention, "cron", "retention", hour=get_settings().retention_hour, minute=0)
+
+# -------------------- Снимки для аналитики --------------------
+# Аналитика читает колоночные файлы SNAPSHOT_DIR/date=YYYY-MM-DD/, а не рабочую БД бота
+def format_snapshot_report(report: dict) -> str:
+    return (
+        f"Снимок {report['day']}: {report['rows']} лидов, {report['size_bytes'] / 1024:.0f} КБ, "
+        f"{report['seconds']} с\n{report['path']}"
+    )
+
+async def async_snapshot() -> dict | None:
+    cfg = get_settings()
+    if not cfg.snapshot_dir:
+        return None
+    day = _now().date().isoformat()
+    try:
+        report = await asyncio.to_thread(
+            export_snapshot, cfg.db_path, cfg.snapshot_dir, day, cfg.snapshot_format, cfg.snapshot_chunk,
+        )
+        report["pruned"] = await asyncio.to_thread(prune_snapshots, cfg.snapshot_dir, cfg.snapshot_keep_days)
+    except Exception:
+        logger.exception("Snapshot failed")
+        return None
+    logger.info(f"Snapshot: {report}")
+    return report
+
+# Снимок — раз в сутки в SNAPSHOT_HOUR (до ночного архива, пока активные лиды ещё в users)
+def schedule_snapshot():
+    cfg = get_settings()
+    if cfg.snapshot_dir:
+        _add_job(async_snapshot, "cron", "snapshot", hour=cfg.snapshot_hour, minute=0)
 
 async def async_healthcheck():
+    # get_me и чтение одной ячейки Sheets идут через предохранители — проверка заодно их пробует
+    cfg = get_settings()
+    errors = []
+    me = None
     try:
-        bot = Bot(BOT_TOKEN)
-        me = await bot.get_me()
-        await bot.session.close()
-        # Sheets быстрый ping
-        await gs_update_by_chat_id(ADMIN_CHAT_ID, {"last_interaction": datetime.now(TZ).isoformat()})
-        logger.info(f"Health OK: @{me.username}")
+        bot = Bot(cfg.bot_token)
+        try:
+            me = await get_breaker("telegram").call(bot.get_me, is_failure=telegram_failure)
+        finally:
+            await bot.session.close()
     except Exception as e:
-        logger.exception("Health-check failed")
-        if ADMIN_CHAT_ID:
-            try:
-                bot = Bot(BOT_TOKEN)
-                await bot.send_message(ADMIN_CHAT_ID, f"Ошибка в боте: {e}")
-                await bot.session.close()
-            except Exception:
-                pass
+        errors.append(f"Telegram: {e}")
+    try:
+        await get_sheets_client().get_values(_ws_range("A1"))
+    except Exception as e:
+        errors.append(f"Sheets: {e}")
+    report = breakers_report()
+    if not errors and all(get_breaker(name).state != "open" for name in BREAKER_NAMES):
+        logger.info(f"Health OK: @{me.username}\n{report}")
+        return
+    logger.warning(f"Health-check failed: {'; '.join(errors) or 'circuit open'}\n{report}")
+    if cfg.admin_chat_id:
+        try:
+            bot = Bot(cfg.bot_token)
+            await bot.send_message(cfg.admin_chat_id, "Ошибка в боте:\n" + "\n".join(errors) + f"\n{report}")
+            await bot.session.close()
+        except Exception:
+            pass
 
 # -------------------- Restore follow-ups on start --------------------
+# просроченные за время простоя напоминания раскладываем на окно, а не шлём разом
+FOLLOWUP_RESTORE_SPREAD_SECONDS = 600
+
+def _init_followup_checkpoint(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS followup_checkpoint (
+            chat_id INTEGER PRIMARY KEY,
+            due_ts REAL,
+            step INTEGER
+        )
+    """)
+
+def checkpoint_followups() -> int:
+    # снимок очереди при остановке: после рестарта сроки восстанавливаются как были
+    items = [(int(key), ts, int(step or 0)) for key, ts, step in get_followup_dispatcher().queue.items()]
+    conn = sqlite3.connect(get_settings().db_path)
+    _init_followup_checkpoint(conn)
+    with conn:
+        conn.execute("DELETE FROM followup_checkpoint")
+        conn.executemany("INSERT INTO followup_checkpoint (chat_id, due_ts, step) VALUES (?, ?, ?)", items)
+    conn.close()
+    logger.info(f"Follow-up checkpoint saved: {len(items)}")
+    return len(items)
+
 def restore_followups():
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cur = conn.execute("SELECT chat_id, file_sent_at, followup_attempts FROM users WHERE file_sent_at IS NOT NULL")
-        rows = cur.fetchall()
+        conn = sqlite3.connect(get_settings().db_path)
+        conn.row_factory = sqlite3.Row
+        _init_followup_checkpoint(conn)
+        cur = conn.execute("SELECT chat_id, file_sent_at, followup_attempts, tz FROM users WHERE file_sent_at IS NOT NULL")
+        rows = [dict(r) for r in cur.fetchall()]
+        checkpoint = {r["chat_id"]: (r["due_ts"], r["step"]) for r in conn.execute("SELECT * FROM followup_checkpoint")}
+        with conn:
+            conn.execute("DELETE FROM followup_checkpoint")
         conn.close()
     except Exception:
+        logger.exception("Restore follow-ups failed")
         return
-    now = datetime.now(TZ)
-    for chat_id, file_sent_at, attempts in rows:
+    cadence = get_cadence()
+    now = _now()
+    items, overdue = [], []
+    for user in rows:
         try:
-            if attempts is None:
-                attempts = 0
-            attempts = int(attempts)
-            if attempts >= REMINDER_MAX_ATTEMPTS:
+            chat_id = int(user["chat_id"])
+            attempts = int(user.get("followup_attempts") or 0)
+            due = _followup_due(user, attempts, cadence)
+            if due is None:
                 continue
-            sent_dt = datetime.fromisoformat(file_sent_at)
-            next_dt = sent_dt + timedelta(days=REMINDER_INTERVAL_DAYS * (attempts + 1))
-            run_date = now + timedelta(seconds=10) if next_dt <= now else next_dt
-            scheduler.add_job(
-                func=async_followup_job,
-                trigger=DateTrigger(run_date=run_date),
-                args=[int(chat_id)],
-                id=f"followup_{chat_id}_{attempts+1}",
-                replace_existing=True,
-                misfire_grace_time=3600
-            )
-        except Exception:
+            saved = checkpoint.get(chat_id)
+            # чекпоинт берём, только если он про тот же шаг, что и в users
+            if saved and saved[1] == attempts:
+                due = datetime.fromtimestamp(saved[0], tz=now.tzinfo)
+            if due <= now:
+                overdue.append((due, chat_id, attempts, _user_tz(user)))
+            else:
+                items.append((chat_id, due, attempts))
+        except Exception as e:
+            logger.warning(f"Restore follow-up skipped for {user.get('chat_id')}: {e}")
             continue
+    if overdue:
+        # тихие часы применяем к началу окна, а не к каждому сроку,
+        # иначе все просроченные схлопнутся в одну минуту
+        overdue.sort(key=lambda item: item[0])
+        spacing = min(1.0, FOLLOWUP_RESTORE_SPREAD_SECONDS / len(overdue))
+        for i, (_, chat_id, attempts, tz) in enumerate(overdue):
+            start = cadence.adjust_quiet(now + timedelta(seconds=10), tz)
+            items.append((chat_id, start + timedelta(seconds=i * spacing), attempts))
+    get_followup_dispatcher().queue.load(items)
+    logger.info(f"Follow-ups restored: {len(items)} (overdue: {len(overdue)}, from checkpoint: {len(checkpoint)})")
+
+# -------------------- Дашборд --------------------
+_dashboard: Dashboard | None = None
+
+def _dashboard_summary() -> dict:
+    conn = sqlite3.connect(get_settings().db_path)
+    # воронка одним проходом по users
+    funnel = conn.execute("""
+        SELECT COUNT(*),
+               COALESCE(SUM(subscribed = 1), 0),
+               COALESCE(SUM(file_sent_at IS NOT NULL), 0),
+               COALESCE(SUM(followup_attempts > 0), 0),
+               COALESCE(SUM(manager_contacted = 1), 0)
+        FROM users
+    """).fetchone()
+    attempts = conn.execute(
+        "SELECT followup_attempts, COUNT(*) FROM users WHERE file_sent_at IS NOT NULL GROUP BY followup_attempts"
+    ).fetchall()
+    langs = conn.execute("SELECT COALESCE(lang, '?'), COUNT(*) FROM users GROUP BY 1").fetchall()
+    conn.close()
+    docs = get_catalog().stats()
+    sent = docs["hits"] + docs["misses"]
+    return {
+        "funnel": dict(zip(("leads", "subscribed", "project_requested", "followup_sent", "manager_contacted"), funnel)),
+        "followup_attempts": {str(a or 0): n for a, n in attempts},
+        "languages": dict(langs),
+        "followup_queue": len(get_followup_dispatcher().queue),
+        "sheets": {
+            "outbox_pending": get_outbox_drainer().outbox.pending(),
+            "outbox_failing": get_outbox_drainer().failing,
+            "outbox_parked": get_outbox_drainer().outbox.parked(),
+        },
+        "cache": {
+            "documents": {**docs, "hit_rate": round(docs["hits"] / sent, 3) if sent else None},
+        },
+        "recent_errors": recent_errors.view(getattr(current_tenant(), "name", None)),
+    }
+
+def _dashboard_runtime() -> dict:
+    # меняется каждые доли секунды — отдельно от сводки и её ETag (/dashboard/runtime)
+    return {
+        "loop": get_loop_monitor().stats(),
+        "api_calls": get_funnel_meter().stats(),
+        "sheets_client": get_sheets_client().stats(),
+    }
+
+def _dashboard_leads(after: int, limit: int) -> list[dict]:
+    conn = sqlite3.connect(get_settings().db_path)
+    conn.row_factory = sqlite3.Row
+    rows = conn.execute("""
+        SELECT chat_id, username, first_name, lang, subscribed, last_message, last_interaction,
+               file_sent_at, followup_attempts, manager_contacted
+        FROM users WHERE chat_id > ? ORDER BY chat_id LIMIT ?
+    """, (after, limit)).fetchall()
+    conn.close()
+    return [dict(r) for r in rows]
+
+def _new_dashboard() -> Dashboard:
+    cfg = get_settings()
+    summary, leads, runtime = _dashboard_summary, _dashboard_leads, _dashboard_runtime
+    tenant = current_tenant()
+    if tenant is not None:
+        # маршруты aiohttp выполняются вне контекста бота — данные собираем в контексте тенанта
+        summary, leads, runtime = tenant.bind(summary), tenant.bind(leads), tenant.bind(runtime)
+    return Dashboard(summary, leads, cfg.dashboard_token, ttl=cfg.dashboard_cache_seconds, collect_runtime=runtime)
+
+def get_dashboard() -> Dashboard:
+    return _scoped("_dashboard", _new_dashboard)
+
+async def run_dashboard_server(tenants: list[Tenant] | None = None):
+    # в режиме polling своего HTTP-сервера нет — поднимаем маленький только для дашборда
+    from aiohttp import web
+    cfg = get_settings()
+    app = web.Application()
+    for _, target_cfg, dashboard, prefix in _webhook_targets(None, tenants):
+        if target_cfg.dashboard_token:
+            dashboard.add_routes(app, prefix=prefix)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host=cfg.webapp_host, port=cfg.webapp_port).start()
+    logger.info("Dashboard on %s:%s/dashboard", cfg.webapp_host, cfg.webapp_port)
+    return runner
+
+# -------------------- Lifecycle --------------------
+inflight = InflightTracker()
+_chat_serializer: ChatSerializer | None = None
+
+def get_chat_serializer() -> ChatSerializer:
+    return _scoped("_chat_serializer", lambda: ChatSerializer(get_settings().handler_concurrency))
+
+async def _serialize_by_chat(handler, event, data):
+    # лимит параллельности и очереди по чатам — свои у каждого бота
+    return await get_chat_serializer()(handler, event, data)
+
+async def _stop_followups(remaining: float):
+    await get_followup_dispatcher().stop()
+    checkpoint_followups()
+
+async def _stop_outbox(remaining: float):
+    await get_outbox_drainer().stop(flush_timeout=min(remaining, get_settings().sheets_drain_timeout))
+
+async def _close_sheets(remaining: float):
+    await get_sheets_client().close()
+
+async def _stop_scheduler(remaining: float):
+    scheduler = get_scheduler()
+    if scheduler.running:
+        scheduler.shutdown(wait=False)
+
+def build_lifecycle(bot: Bot) -> Lifecycle:
+    # порядок важен: сначала дожидаемся хендлеров (они ставят записи в Sheets
+    # и фоллоу-апы), потом сохраняем очередь, доливаем Sheets и закрываем сессию
+    lifecycle = Lifecycle(get_settings().shutdown_timeout)
+    lifecycle.add_step("handlers", inflight.wait_idle)
+    lifecycle.add_step("followups", _stop_followups)
+    lifecycle.add_step("outbox", _stop_outbox)
+    lifecycle.add_step("sheets", _close_sheets)
+    lifecycle.add_step("scheduler", _stop_scheduler)
+    lifecycle.add_step("loop_monitor", lambda remaining: get_loop_monitor().stop())
+    lifecycle.add_step("bot_session", lambda remaining: bot.session.close())
+    return lifecycle
 
 # -------------------- Entry --------------------
-async def main():
-    if not BOT_TOKEN or not CHANNEL_ID or not GSHEET_ID:
+def create_app() -> tuple[Bot, Dispatcher]:
+    # фабрика приложения: всё тяжёлое — здесь, а не при импорте модуля
+    setup_logging()
+    cfg = get_settings()
+    if not cfg.bot_token or not cfg.channel_id or not cfg.gsheet_id:
         raise RuntimeError("Заполните BOT_TOKEN, CHANNEL_ID, GSHEET_ID и GOOGLE_SERVICE_JSON")
 
     init_db()
+    bot = Bot(cfg.bot_token)
+    # все вызовы Bot API основного бота — через предохранитель telegram
+    bot.session.middleware(TelegramBreakerMiddleware(get_breaker("telegram")))
+    bot.session.middleware(count_api_calls)
+    dp = _new_dispatcher()
+
+    schedule_healthcheck()
+    schedule_reconcile()
+    schedule_retention()
+    schedule_snapshot()
+    _start_process_checks()
+    return bot, dp
+
+def _new_dispatcher(tenants: list[Tenant] | None = None) -> Dispatcher:
     dp = Dispatcher()
+    if tenants:
+        # первым: дальше весь апдейт обрабатывается в контексте бота, который его получил
+        dp.update.outer_middleware(TenantMiddleware(tenants))
+    dp.update.outer_middleware(inflight)
+    # после TenantMiddleware: счётчик вызовов — того бота, которому пришёл апдейт
+    dp.update.outer_middleware(_meter_funnel)
+    # после inflight: ждущие своей очереди апдейты тоже учитываются при остановке
+    dp.update.outer_middleware(_serialize_by_chat)
     dp.include_router(router)
+    return dp
+
+def _start_process_checks():
+    # проверки памяти — на процесс, а не на бота
+    cfg = get_settings()
+    schedule_memory_check()
+    if cfg.tracemalloc_frames > 0:
+        memory_tracker.frames = cfg.tracemalloc_frames
+        memory_tracker.start()
 
+# -------------------- Несколько ботов --------------------
+# TENANTS: несколько брендированных ботов в одном процессе. Общие — цикл событий, планировщик,
+# HTTP-пулы Telegram и Sheets, монитор цикла; свои у каждого — настройки, шаблоны, файл БД,
+# очередь фоллоу-апов, журнал Sheets, предохранители и лимит параллельности по чатам.
+def _setup_tenant(tenant: Tenant, session):
+    cfg = get_settings()
+    if not cfg.channel_id or not cfg.gsheet_id:
+        raise RuntimeError(f"Бот {tenant.name}: заполните CHANNEL_ID и GSHEET_ID")
+    init_db()
+    tenant.bot = Bot(cfg.bot_token, session=session)
     schedule_healthcheck()
-    scheduler.start()
+    schedule_reconcile()
+    schedule_retention()
+    schedule_snapshot()
+
+def create_tenants_app() -> tuple[list[Tenant], Dispatcher]:
+    global _tenants
+    from aiogram.client.session.aiohttp import AiohttpSession
+    setup_logging()
+    cfg = get_settings()
+    tenants = load_tenants(cfg.tenants, cfg, TEMPLATES)
+    if not tenants:
+        raise RuntimeError("TENANTS: нет ни одного бота")
+    # одна HTTP-сессия на всех ботов; предохранитель — того бота, в контексте которого вызов
+    session = AiohttpSession()
+    session.middleware(TelegramBreakerMiddleware(lambda: get_breaker("telegram")))
+    session.middleware(count_api_calls)
+    for tenant in tenants:
+        tenant.bind(_setup_tenant)(tenant, session)
+    dp = _new_dispatcher(tenants)
+    _tenants = tenants
+    _start_process_checks()
+    logger.info("Tenants: %s", ", ".join(tenant.name for tenant in tenants))
+    return tenants, dp
+
+def _start_tenant(tenant: Tenant) -> asyncio.Task:
+    # задачи создаются в контексте тенанта и наследуют его
     restore_followups()
+    get_followup_dispatcher().start()
+    get_outbox_drainer().start()
+    return asyncio.create_task(prewarm_documents(tenant.bot), name=f"docs-prewarm-{tenant.name}")
 
-    bot = Bot(BOT_TOKEN)
+async def _close_shared_sheets(remaining: float):
+    global _shared_sheets_session
+    if _shared_sheets_session is not None:
+        await _shared_sheets_session.close()
+        _shared_sheets_session = None
 
-    # long-polling по умолчанию
-    if not WEBHOOK_URL:
-        await dp.start_polling(bot)
-        return
+def build_tenants_lifecycle(tenants: list[Tenant]) -> Lifecycle:
+    # тот же порядок, что в build_lifecycle: фоллоу-апы и журнал — по каждому боту
+    lifecycle = Lifecycle(get_settings().shutdown_timeout)
+    lifecycle.add_step("handlers", inflight.wait_idle)
+    for tenant in tenants:
+        lifecycle.add_step(f"{tenant.name}:followups", tenant.bind(_stop_followups))
+        lifecycle.add_step(f"{tenant.name}:outbox", tenant.bind(_stop_outbox))
+    lifecycle.add_step("sheets", _close_shared_sheets)
+    lifecycle.add_step("scheduler", _stop_scheduler)
+    lifecycle.add_step("loop_monitor", lambda remaining: get_loop_monitor().stop())
+    lifecycle.add_step("bot_session", lambda remaining: tenants[0].bot.session.close())
+    return lifecycle
+
+def _webhook_targets(bot: Bot | None, tenants: list[Tenant] | None) -> list[tuple]:
+    # (бот, его настройки, его дашборд, префикс дашборда)
+    if not tenants:
+        return [(bot, get_settings(), get_dashboard(), "/dashboard")]
+    return [
+        (tenant.bot, tenant.settings, tenant.bind(get_dashboard)(), f"/dashboard/{tenant.name}")
+        for tenant in tenants
+    ]
+
+def build_webhook_app(dp: Dispatcher, targets: list[tuple]):
+    from aiohttp import web
+    from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
 
-    # webhook-режим
     async def on_startup(app: web.Application):
-        try:
-            await bot.set_webhook(url=WEBHOOK_URL, secret_token=WEBHOOK_SECRET, drop_pending_updates=True)
-            logger.info("Webhook set: %s", WEBHOOK_URL)
-        except Exception as e:
-            logger.exception("Failed to set webhook: %s", e)
+        for target_bot, target_cfg, _, _ in targets:
+            try:
+                # апдейты, накопившиеся за время деплоя, не выбрасываем;
+                # chat_member Telegram присылает, только если он явно указан в allowed_updates
+                await target_bot.set_webhook(
+                    url=target_cfg.webhook_url,
+                    secret_token=target_cfg.webhook_secret,
+                    drop_pending_updates=False,
+                    allowed_updates=dp.resolve_used_update_types(),
+                )
+                logger.info("Webhook set: %s", target_cfg.webhook_url)
+            except Exception as e:
+                logger.exception("Failed to set webhook: %s", e)
 
     async def on_shutdown(app: web.Application):
+        for target_bot, _, _, _ in targets:
+            try:
+                await target_bot.delete_webhook(drop_pending_updates=False)
+            except Exception:
+                pass
+
+    app = web.Application()
+    for target_bot, target_cfg, dashboard, prefix in targets:
+        # с WEBHOOK_REPLY апдейт обрабатывается до ответа Telegram — иначе ответить методом в теле
+        # вебхука нельзя; без него — в фоне, чтобы долгие хендлеры (/profile, загрузка PDF)
+        # не держали запрос Telegram открытым
+        SimpleRequestHandler(
+            dispatcher=dp, bot=target_bot, secret_token=target_cfg.webhook_secret,
+            handle_in_background=not target_cfg.webhook_reply,
+        ).register(app, path=target_cfg.webhook_path)
+        if target_cfg.dashboard_token:
+            dashboard.add_routes(app, prefix=prefix)
+    setup_application(app, dp)
+    # хуки aiohttp, а не kwargs setup_application: те уходят в workflow data и не вызываются
+    app.on_startup.append(on_startup)
+    app.on_shutdown.append(on_shutdown)
+    return app
+
+async def run_webhook(bot: Bot | None, dp: Dispatcher, tenants: list[Tenant] | None = None):
+    import signal
+    from aiohttp import web
+    cfg = get_settings()
+    targets = _webhook_targets(bot, tenants)
+    app = build_webhook_app(dp, targets)
+    logger.info("Starting webhook app on %s:%s %s", cfg.webapp_host, cfg.webapp_port,
+                ", ".join(target[1].webhook_path for target in targets))
+    # web.run_app нельзя вызывать из уже запущенного цикла — поднимаем через runner
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, host=cfg.webapp_host, port=cfg.webapp_port)
+    await site.start()
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
         try:
-            await bot.delete_webhook(drop_pending_updates=False)
-        except Exception:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:
             pass
+    try:
+        await stop.wait()
+    finally:
+        # перестаём принимать запросы; дальше — общий lifecycle в main()
+        await runner.cleanup()
 
-    app = web.Application()
-    SimpleRequestHandler(dispatcher=dp, bot=bot, secret_token=WEBHOOK_SECRET).register(app, path=WEBHOOK_PATH)
-    setup_application(app, dp, on_startup=on_startup, on_shutdown=on_shutdown)
-    logger.info("Starting webhook app on %s:%s %s", WEBAPP_HOST, WEBAPP_PORT, WEBHOOK_PATH)
-    web.run_app(app, host=WEBAPP_HOST, port=WEBAPP_PORT)
+async def main():
+    if get_settings().tenants:
+        return await main_tenants()
+    bot, dp = create_app()
+    await rebuild_segments()
+    get_scheduler().start()
+    restore_followups()
+    get_followup_dispatcher().start()
+    get_outbox_drainer().start()
+    if get_settings().loop_lag_threshold > 0:
+        get_loop_monitor().start()
+    # file_id брошюр загружаем в фоне, не задерживая приём апдейтов
+    prewarm = asyncio.create_task(prewarm_documents(bot), name="docs-prewarm")
+    lifecycle = build_lifecycle(bot)
+    dashboard_runner = None
+
+    try:
+        if not get_settings().webhook_url:
+            if get_settings().dashboard_token:
+                dashboard_runner = await run_dashboard_server()
+            # long-polling по умолчанию; сессию закрываем сами после дослива
+            await dp.start_polling(bot, close_bot_session=False)
+        else:
+            await run_webhook(bot, dp)
+    finally:
+        prewarm.cancel()
+        if dashboard_runner is not None:
+            await dashboard_runner.cleanup()
+        await lifecycle.shutdown()
+
+async def main_tenants():
+    global _shared_sheets_session
+    import aiohttp
+    tenants, dp = create_tenants_app()
+    # общий пул соединений Sheets; лимит каждого бота — SHEETS_MAX_CONNECTIONS внутри клиента
+    _shared_sheets_session = aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(
+            limit=sum(tenant.settings.sheets_max_connections for tenant in tenants), keepalive_timeout=60,
+        ),
+        timeout=aiohttp.ClientTimeout(total=20.0),
+    )
+    get_scheduler().start()
+    for tenant in tenants:
+        await tenant.bind(rebuild_segments)()
+    prewarms = [tenant.bind(_start_tenant)(tenant) for tenant in tenants]
+    if get_settings().loop_lag_threshold > 0:
+        get_loop_monitor().start()
+    lifecycle = build_tenants_lifecycle(tenants)
+    dashboard_runner = None
+    try:
+        if not get_settings().webhook_url:
+            if any(tenant.settings.dashboard_token for tenant in tenants):
+                dashboard_runner = await run_dashboard_server(tenants)
+            await dp.start_polling(*(tenant.bot for tenant in tenants), close_bot_session=False)
+        else:
+            await run_webhook(None, dp, tenants)
+    finally:
+        for prewarm in prewarms:
+            prewarm.cancel()
+        if dashboard_runner is not None:
+            await dashboard_runner.cleanup()
+        await lifecycle.shutdown()
+
+# -------------------- Импорт лидов (CLI) --------------------
+async def _sheet_lead_values() -> list[list[str]]:
+    try:
+        return await get_sheets_client().get_values(_ws_range())
+    finally:
+        await get_sheets_client().close()
+
+def import_main(argv: list[str] | None = None) -> int:
+    # python botApp.py import leads.csv [--batch-size N]  |  python botApp.py import sheet
+    import argparse
+    from importer import import_leads, read_csv, rows_from_values, format_import_report
+
+    parser = argparse.ArgumentParser(prog="botApp.py import", description="Загрузка лидов в users")
+    parser.add_argument("source", help="путь к CSV или 'sheet' — текущая Google-таблица")
+    parser.add_argument("--batch-size", type=int, default=10000, help="строк в одной транзакции")
+    args = parser.parse_args(argv)
+
+    setup_logging()
+    init_db()
+    if args.source == "sheet":
+        header, rows = rows_from_values(asyncio.run(_sheet_lead_values()))
+    else:
+        header, rows = read_csv(args.source)
+    report = import_leads(header, rows, get_settings().db_path, batch_size=args.batch_size, tz=get_settings().tz)
+    print(format_import_report(report))
+    return 0
 
 if __name__ == "__main__":
+    if sys.argv[1:2] == ["import"]:
+        sys.exit(import_main(sys.argv[2:]))
     try:
         asyncio.run(main())
     except (KeyboardInterrupt, SystemExit):
-        pass
\ No newline at end of file
+        pass
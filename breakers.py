@@ -0,0 +1,167 @@
+import asyncio
+import logging
+import time
+from collections import deque
+
+logger = logging.getLogger("rome_estate_bot")
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(RuntimeError):
+    def __init__(self, name: str, retry_in: float):
+        super().__init__(f"{name} unavailable (circuit open, retry in {retry_in:.0f}s)")
+        self.name = name
+        self.retry_in = retry_in
+
+
+class CircuitBreaker:
+    # Предохранитель внешней зависимости. Считает исходы вызовов за скользящее окно window секунд;
+    # когда вызовов не меньше min_calls и доля ошибок достигла failure_rate — размыкается:
+    # следующие open_seconds вызовы отклоняются сразу, без ожидания таймаутов.
+    # Потом пропускается один пробный вызов (half-open): успех замыкает цепь, ошибка — снова пауза.
+    def __init__(self, name: str, failure_rate: float = 0.5, min_calls: int = 5,
+                 window: float = 60.0, open_seconds: float = 30.0, clock=time.monotonic):
+        self.name = name
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.window = window
+        self.open_seconds = open_seconds
+        self._clock = clock
+        self._calls: deque = deque()  # (ts, ok)
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._probe_at: float | None = None
+        self.opened = 0
+        self.rejected = 0
+        self.last_error = ""
+
+    @property
+    def state(self) -> str:
+        if self._state == OPEN and self._clock() - self._opened_at >= self.open_seconds:
+            self._state = HALF_OPEN
+            self._probe_at = None
+        return self._state
+
+    def retry_in(self) -> float:
+        if self.state != OPEN:
+            return 0.0
+        return max(self.open_seconds - (self._clock() - self._opened_at), 0.0)
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == CLOSED:
+            return True
+        if state == HALF_OPEN:
+            # один пробный вызов; зависший пробник не блокирует цепь дольше open_seconds
+            now = self._clock()
+            if self._probe_at is None or now - self._probe_at >= self.open_seconds:
+                self._probe_at = now
+                return True
+        self.rejected += 1
+        return False
+
+    def _trim(self, now: float):
+        while self._calls and now - self._calls[0][0] > self.window:
+            self._calls.popleft()
+
+    def _open(self, now: float):
+        self._state = OPEN
+        self._opened_at = now
+        self._probe_at = None
+        self.opened += 1
+        logger.warning(f"Circuit {self.name} opened for {self.open_seconds:.0f}s: {self.last_error}")
+
+    def record_success(self):
+        now = self._clock()
+        if self.state == HALF_OPEN:
+            self._state = CLOSED
+            self._calls.clear()
+            self._probe_at = None
+            logger.info(f"Circuit {self.name} closed")
+            return
+        self._calls.append((now, True))
+        self._trim(now)
+
+    def record_failure(self, error: BaseException | str = ""):
+        now = self._clock()
+        self.last_error = str(error)[:200]
+        if self.state == HALF_OPEN:
+            self._open(now)
+            return
+        self._calls.append((now, False))
+        self._trim(now)
+        failures = sum(1 for _, ok in self._calls if not ok)
+        if self._state == CLOSED and len(self._calls) >= self.min_calls \
+                and failures / len(self._calls) >= self.failure_rate:
+            self._open(now)
+
+    async def call(self, fn, *args, is_failure=None, **kwargs):
+        # is_failure(exc) -> bool: ошибки, которые не говорят о недоступности
+        # зависимости (например, 400 или заблокировавший бота пользователь), цепь не размыкают
+        if not self.allow():
+            raise CircuitOpenError(self.name, self.retry_in())
+        try:
+            result = await fn(*args, **kwargs)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            if is_failure is None or is_failure(e):
+                self.record_failure(e)
+            else:
+                self.record_success()
+            raise
+        self.record_success()
+        return result
+
+    def snapshot(self) -> dict:
+        now = self._clock()
+        self._trim(now)
+        failures = sum(1 for _, ok in self._calls if not ok)
+        return {
+            "state": self.state,
+            "calls": len(self._calls),
+            "failures": failures,
+            "retry_in": round(self.retry_in(), 1),
+            "opened": self.opened,
+            "rejected": self.rejected,
+            "last_error": self.last_error,
+        }
+
+
+def format_breakers(breakers) -> str:
+    marks = {CLOSED: "🟢", HALF_OPEN: "🟡", OPEN: "🔴"}
+    lines = []
+    for breaker in breakers:
+        s = breaker.snapshot()
+        line = f"{marks[s['state']]} {breaker.name}: {s['state']}, ошибок {s['failures']}/{s['calls']}"
+        if s["state"] == OPEN:
+            line += f", повтор через {s['retry_in']:.0f} с"
+        if s["rejected"]:
+            line += f", отклонено {s['rejected']}"
+        lines.append(line)
+    return "\n".join(lines)
+
+
+def telegram_failure(e: BaseException) -> bool:
+    # недоступность Bot API: сеть, таймаут, 5xx; 4xx (бот заблокирован, неверный chat_id) — не она
+    from aiogram.exceptions import TelegramNetworkError, TelegramServerError
+
+    return isinstance(e, (TelegramNetworkError, TelegramServerError, asyncio.TimeoutError, OSError))
+
+
+class TelegramBreakerMiddleware:
+    # Middleware сессии aiogram: все вызовы Bot API основного бота идут через предохранитель.
+    # getUpdates пропускается без проверки — polling сам повторяет запросы и служит пробой.
+    # breaker может быть функцией без аргументов: общая сессия нескольких ботов берёт
+    # предохранитель того бота, в контексте которого идёт вызов.
+    def __init__(self, breaker):
+        self.breaker = breaker
+
+    async def __call__(self, make_request, bot, method):
+        if type(method).__name__ == "GetUpdates":
+            return await make_request(bot, method)
+        breaker = self.breaker() if callable(self.breaker) else self.breaker
+        return await breaker.call(make_request, bot, method, is_failure=telegram_failure)
@@ -0,0 +1,77 @@
+import asyncio
+import logging
+
+from aiogram import BaseMiddleware
+
+logger = logging.getLogger("rome_estate_bot")
+
+
+class _ChatSlot:
+    __slots__ = ("lock", "users")
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.users = 0  # апдейты чата: выполняющийся + ждущие
+
+
+class ChatSerializer(BaseMiddleware):
+    # Внешний middleware на update: апдейты разных чатов обрабатываются параллельно
+    # (не больше limit одновременно), апдейты одного чата — строго по очереди.
+    # asyncio.Lock отдаёт блокировку в порядке ожидания, а задачи апдейтов создаются
+    # в порядке получения — порядок внутри чата сохраняется. Слот чата удаляется,
+    # как только у чата не осталось апдейтов, поэтому словарь не растёт.
+    def __init__(self, limit: int = 16):
+        self.limit = limit
+        self._semaphore = asyncio.Semaphore(limit) if limit > 0 else None
+        self._slots: dict[int, _ChatSlot] = {}
+        self.running = 0
+        self.max_waiting = 0
+
+    @staticmethod
+    def chat_key(data: dict) -> int | None:
+        # пользователь важнее чата: события канала (chat_member) относятся к конкретному лиду
+        user = data.get("event_from_user")
+        if user is not None:
+            return user.id
+        chat = data.get("event_chat")
+        return chat.id if chat is not None else None
+
+    def stats(self) -> dict:
+        return {
+            "limit": self.limit,
+            "running": self.running,
+            "chats": len(self._slots),
+            "waiting": max(sum(slot.users for slot in self._slots.values()) - self.running, 0),
+            "max_waiting": self.max_waiting,
+        }
+
+    async def __call__(self, handler, event, data):
+        key = self.chat_key(data)
+        if key is None:
+            return await self._run(handler, event, data)
+        slot = self._slots.get(key)
+        if slot is None:
+            slot = self._slots[key] = _ChatSlot()
+        slot.users += 1
+        self.max_waiting = max(self.max_waiting, slot.users - 1)
+        try:
+            # сначала очередь чата, потом общий лимит: ждущие своей очереди не занимают слоты
+            async with slot.lock:
+                return await self._run(handler, event, data)
+        finally:
+            slot.users -= 1
+            if slot.users == 0:
+                self._slots.pop(key, None)
+
+    async def _run(self, handler, event, data):
+        if self._semaphore is None:
+            return await self._call(handler, event, data)
+        async with self._semaphore:
+            return await self._call(handler, event, data)
+
+    async def _call(self, handler, event, data):
+        self.running += 1
+        try:
+            return await handler(event, data)
+        finally:
+            self.running -= 1
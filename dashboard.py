@@ -0,0 +1,150 @@
+import asyncio
+import hashlib
+import hmac
+import json
+import logging
+import time
+from collections import deque
+from datetime import datetime
+
+# aiohttp.web импортируется только при подключении маршрутов (см. add_routes)
+
+LEADS_PAGE_MAX = 200
+
+
+class RecentErrors(logging.Handler):
+    # последние предупреждения и ошибки бота — для дашборда, без похода в логи.
+    # scope() помечает запись (бот-тенант): дашборд бота видит только свои записи
+    def __init__(self, maxlen: int = 50, scope=None):
+        super().__init__(level=logging.WARNING)
+        self.records: deque = deque(maxlen=maxlen)
+        self.total = 0
+        self.scope = scope or (lambda: None)
+        self._totals: dict = {}
+
+    def emit(self, record: logging.LogRecord):
+        try:
+            scope = self.scope()
+            self.records.append((scope, {
+                "ts": datetime.fromtimestamp(record.created).isoformat(timespec="seconds"),
+                "level": record.levelname,
+                "message": record.getMessage()[:300],
+            }))
+            self.total += 1
+            self._totals[scope] = self._totals.get(scope, 0) + 1
+        except Exception:
+            self.handleError(record)
+
+    def view(self, scope=None, limit: int = 20) -> dict:
+        # без scope — все записи процесса; со scope — только записи этого бота
+        if scope is None:
+            return {"total": self.total, "items": [item for _, item in self.records][-limit:]}
+        items = [item for owner, item in self.records if owner == scope]
+        return {"total": self._totals.get(scope, 0), "items": items[-limit:]}
+
+
+def _etag(data) -> str:
+    raw = json.dumps(data, ensure_ascii=False, sort_keys=True, default=str).encode("utf-8")
+    return '"' + hashlib.sha1(raw).hexdigest()[:20] + '"'
+
+
+class Dashboard:
+    # Read-only JSON для отдела продаж. Сводка считается не чаще раза в ttl секунд
+    # и отдаётся готовыми байтами; по If-None-Match отвечаем 304 без тела.
+    # Быстро меняющиеся счётчики процесса (задержка цикла, вызовы API) в сводку не входят —
+    # иначе ETag менялся бы при каждом пересчёте; они отдаются отдельно, без кэша.
+    def __init__(self, collect_summary, fetch_leads, token: str, ttl: float = 30.0, clock=None, collect_runtime=None):
+        self.collect_summary = collect_summary  # () -> dict, синхронная (SQLite)
+        self.fetch_leads = fetch_leads          # (after, limit) -> list[dict]
+        self.collect_runtime = collect_runtime  # () -> dict, дешёвая (память процесса)
+        self.token = token
+        self.ttl = ttl
+        self._clock = clock or time.monotonic
+        self._summary: tuple[bytes, str] | None = None
+        self._summary_at: float | None = None
+        self._lock = asyncio.Lock()
+        self.computed = 0
+        self.hits = 0
+        self.not_modified = 0
+
+    def cache_bytes(self) -> int:
+        return len(self._summary[0]) if self._summary else 0
+
+    def authorized(self, headers, query) -> bool:
+        if not self.token:
+            return False
+        auth = headers.get("Authorization", "")
+        supplied = auth[7:] if auth.startswith("Bearer ") else headers.get("X-Dashboard-Token") or query.get("token", "")
+        return hmac.compare_digest(supplied.encode(), self.token.encode())
+
+    async def summary(self) -> tuple[bytes, str]:
+        async with self._lock:
+            now = self._clock()
+            if self._summary is not None and now - self._summary_at < self.ttl:
+                self.hits += 1
+                return self._summary
+            data = await asyncio.to_thread(self.collect_summary)
+            etag = _etag(data)
+            # время расчёта не входит в ETag: неизменившиеся данные — тот же ответ
+            if self._summary is None or self._summary[1] != etag:
+                body = json.dumps(
+                    {"generated_at": datetime.now().isoformat(timespec="seconds"), **data},
+                    ensure_ascii=False, default=str,
+                ).encode("utf-8")
+                self._summary = (body, etag)
+            self._summary_at = now
+            self.computed += 1
+            return self._summary
+
+    def runtime(self) -> bytes:
+        data = {
+            "generated_at": datetime.now().isoformat(timespec="seconds"),
+            **(self.collect_runtime() if self.collect_runtime else {}),
+            "dashboard": {"computed": self.computed, "hits": self.hits, "not_modified": self.not_modified},
+        }
+        return json.dumps(data, ensure_ascii=False, default=str).encode("utf-8")
+
+    async def leads(self, after: int, limit: int) -> tuple[bytes, str]:
+        # keyset-пагинация по chat_id: WHERE chat_id > after ORDER BY chat_id LIMIT n
+        limit = max(1, min(limit, LEADS_PAGE_MAX))
+        items = await asyncio.to_thread(self.fetch_leads, after, limit)
+        data = {
+            "items": items,
+            "next_after": items[-1]["chat_id"] if len(items) == limit else None,
+        }
+        return json.dumps(data, ensure_ascii=False, default=str).encode("utf-8"), _etag(data)
+
+    def add_routes(self, app, prefix: str = "/dashboard"):
+        from aiohttp import web
+
+        def respond(request, body: bytes, etag: str):
+            headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+            if etag in request.headers.get("If-None-Match", ""):
+                self.not_modified += 1
+                return web.Response(status=304, headers=headers)
+            return web.Response(body=body, content_type="application/json", headers=headers)
+
+        async def summary(request):
+            if not self.authorized(request.headers, request.query):
+                raise web.HTTPUnauthorized()
+            return respond(request, *await self.summary())
+
+        async def runtime(request):
+            if not self.authorized(request.headers, request.query):
+                raise web.HTTPUnauthorized()
+            return web.Response(body=self.runtime(), content_type="application/json",
+                                headers={"Cache-Control": "no-store"})
+
+        async def leads(request):
+            if not self.authorized(request.headers, request.query):
+                raise web.HTTPUnauthorized()
+            try:
+                after = int(request.query.get("after", 0))
+                limit = int(request.query.get("limit", 50))
+            except ValueError:
+                raise web.HTTPBadRequest(text="after/limit must be integers")
+            return respond(request, *await self.leads(after, limit))
+
+        app.router.add_get(f"{prefix}/summary", summary)
+        app.router.add_get(f"{prefix}/runtime", runtime)
+        app.router.add_get(f"{prefix}/leads", leads)
@@ -0,0 +1,133 @@
+import logging
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+logger = logging.getLogger("rome_estate_bot")
+
+ANY_LANG = "*"
+DEFAULT_SEGMENT = "default"
+DEFAULT_FILENAME = "RomeEstate_30_Projects.pdf"
+
+
+class DocumentCatalog:
+    # Каталог брошюр в SQLite: версия на пару (язык, сегмент), активна последняя.
+    # file_id Telegram хранится рядом с URL — повторная отправка идёт одним
+    # лёгким вызовом без скачивания файла серверами Telegram.
+    def __init__(self, db_path: str, refresh_seconds: float = 5.0):
+        self.db_path = db_path
+        self.refresh_seconds = refresh_seconds
+        self._active: dict[tuple[str, str], dict] = {}
+        self._loaded_at: float | None = None
+        self._lock = threading.Lock()
+        # отправки по file_id / по URL (холодный кэш)
+        self.hits = 0
+        self.misses = 0
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path)
+        conn.row_factory = sqlite3.Row
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS documents (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                lang TEXT NOT NULL,
+                segment TEXT NOT NULL,
+                version INTEGER NOT NULL,
+                url TEXT NOT NULL,
+                filename TEXT NOT NULL,
+                file_id TEXT,
+                upload_error TEXT,
+                active INTEGER DEFAULT 1,
+                created_at TEXT,
+                uploaded_at TEXT
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_documents_active ON documents (lang, segment, active)")
+        return conn
+
+    def ensure_schema(self, seed_url: str | None = None):
+        # пустой каталог заполняем общей ссылкой (PDF_URL) для всех языков
+        conn = self._connect()
+        empty = conn.execute("SELECT COUNT(*) FROM documents").fetchone()[0] == 0
+        conn.commit()
+        conn.close()
+        if empty and seed_url:
+            self.publish(seed_url)
+
+    def _invalidate(self):
+        with self._lock:
+            self._loaded_at = None
+
+    def _load(self):
+        with self._lock:
+            if self._loaded_at is not None and time.monotonic() - self._loaded_at <= self.refresh_seconds:
+                return self._active
+            conn = self._connect()
+            rows = conn.execute("SELECT * FROM documents WHERE active = 1").fetchall()
+            conn.close()
+            self._active = {(r["lang"], r["segment"]): dict(r) for r in rows}
+            self._loaded_at = time.monotonic()
+            return self._active
+
+    def resolve(self, lang: str | None, segment: str | None = None) -> dict | None:
+        # точное совпадение -> язык без сегмента -> общий для сегмента -> общий
+        active = self._load()
+        lang = lang or ANY_LANG
+        segment = segment or DEFAULT_SEGMENT
+        for key in ((lang, segment), (lang, DEFAULT_SEGMENT), (ANY_LANG, segment), (ANY_LANG, DEFAULT_SEGMENT)):
+            doc = active.get(key)
+            if doc is not None:
+                return doc
+        return None
+
+    def active(self) -> list[dict]:
+        return sorted(self._load().values(), key=lambda d: (d["lang"], d["segment"]))
+
+    def publish(self, url: str, lang: str = ANY_LANG, segment: str = DEFAULT_SEGMENT,
+                filename: str = DEFAULT_FILENAME) -> dict:
+        conn = self._connect()
+        try:
+            current = conn.execute(
+                "SELECT * FROM documents WHERE lang = ? AND segment = ? AND active = 1",
+                (lang, segment),
+            ).fetchone()
+            if current is not None and current["url"] == url:
+                # та же ссылка — новая версия не нужна, file_id остаётся валидным
+                return dict(current)
+            version = conn.execute(
+                "SELECT COALESCE(MAX(version), 0) + 1 FROM documents WHERE lang = ? AND segment = ?",
+                (lang, segment),
+            ).fetchone()[0]
+            conn.execute("UPDATE documents SET active = 0 WHERE lang = ? AND segment = ?", (lang, segment))
+            cur = conn.execute(
+                "INSERT INTO documents (lang, segment, version, url, filename, active, created_at) "
+                "VALUES (?, ?, ?, ?, ?, 1, ?)",
+                (lang, segment, version, url, filename, datetime.now().isoformat()),
+            )
+            conn.commit()
+            doc = dict(conn.execute("SELECT * FROM documents WHERE id = ?", (cur.lastrowid,)).fetchone())
+        finally:
+            conn.close()
+        self._invalidate()
+        logger.info(f"Document published: {lang}/{segment} v{doc['version']} {url}")
+        return doc
+
+    def set_file_id(self, doc_id: int, file_id: str | None, error: str | None = None):
+        conn = self._connect()
+        conn.execute(
+            "UPDATE documents SET file_id = ?, upload_error = ?, uploaded_at = ? WHERE id = ?",
+            (file_id, error, datetime.now().isoformat() if file_id else None, doc_id),
+        )
+        conn.commit()
+        conn.close()
+        self._invalidate()
+
+    def stats(self) -> dict:
+        docs = self.active()
+        return {
+            "documents": len(docs),
+            "cached": sum(1 for d in docs if d["file_id"]),
+            "hits": self.hits,
+            "misses": self.misses,
+        }
@@ -0,0 +1,208 @@
+import asyncio
+import heapq
+import itertools
+import json
+import logging
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
+
+logger = logging.getLogger("rome_estate_bot")
+
+
+# -------------------- Каденция (описание последовательности) --------------------
+@dataclass(frozen=True)
+class CadenceStep:
+    delay: timedelta            # от предыдущего шага (для первого — от выдачи PDF)
+    template: str = "followup"  # ключ в TEMPLATES[lang]
+
+
+@dataclass(frozen=True)
+class Cadence:
+    steps: tuple[CadenceStep, ...]
+    # тихие часы в локальном времени лида: [quiet_start, quiet_end)
+    quiet_start: int = 21
+    quiet_end: int = 9
+
+    @classmethod
+    def uniform(cls, interval_days: int, attempts: int, template: str = "followup") -> "Cadence":
+        step = CadenceStep(delay=timedelta(days=interval_days), template=template)
+        return cls(steps=(step,) * max(attempts, 0))
+
+    @classmethod
+    def from_config(cls, data) -> "Cadence":
+        # {"steps": [{"delay_hours": 48, "template": "followup"}, ...], "quiet_hours": [21, 9]}
+        if isinstance(data, str):
+            data = json.loads(data)
+        steps = tuple(
+            CadenceStep(
+                delay=timedelta(days=s.get("delay_days", 0), hours=s.get("delay_hours", 0)),
+                template=s.get("template", "followup"),
+            )
+            for s in data["steps"]
+        )
+        quiet = data.get("quiet_hours") or [cls.quiet_start, cls.quiet_end]
+        return cls(steps=steps, quiet_start=int(quiet[0]), quiet_end=int(quiet[1]))
+
+    @property
+    def max_attempts(self) -> int:
+        return len(self.steps)
+
+    def step(self, index: int) -> CadenceStep | None:
+        return self.steps[index] if 0 <= index < len(self.steps) else None
+
+    def due_at(self, anchor: datetime, index: int) -> datetime:
+        # время шага index, отсчитанное от anchor (момента выдачи PDF)
+        return anchor + sum((s.delay for s in self.steps[: index + 1]), timedelta())
+
+    def in_quiet_hours(self, hour: int) -> bool:
+        start, end = self.quiet_start, self.quiet_end
+        if start == end:
+            return False
+        if start < end:
+            return start <= hour < end
+        return hour >= start or hour < end
+
+    def adjust_quiet(self, when: datetime, tz: ZoneInfo) -> datetime:
+        # переносим отправку из тихих часов на их окончание по времени лида
+        local = when.astimezone(tz)
+        if not self.in_quiet_hours(local.hour):
+            return when
+        moved = local.replace(hour=self.quiet_end, minute=0, second=0, microsecond=0)
+        if moved <= local:
+            moved += timedelta(days=1)
+        return moved
+
+
+# -------------------- Очередь (min-heap по времени) --------------------
+class FollowupQueue:
+    # Куча (due_ts, seq, key) с ленивым удалением: push/перенос — O(log n),
+    # выборка созревших — O(k log n). Для одного key актуальна последняя запись.
+    def __init__(self):
+        self._heap: list[tuple[float, int, object]] = []
+        self._entries: dict = {}  # key -> (due_ts, seq, payload)
+        self._seq = itertools.count()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key) -> bool:
+        return key in self._entries
+
+    def stats(self) -> dict:
+        # heap больше pending на число ещё не вычищенных устаревших записей
+        return {"pending": len(self._entries), "heap": len(self._heap)}
+
+    def push(self, key, due: datetime, payload=None):
+        ts = due.timestamp()
+        seq = next(self._seq)
+        self._entries[key] = (ts, seq, payload)
+        heapq.heappush(self._heap, (ts, seq, key))
+        self._compact_if_needed()
+
+    def load(self, items):
+        # массовая загрузка при старте: heapify за O(n)
+        for key, due, payload in items:
+            self._entries[key] = (due.timestamp(), next(self._seq), payload)
+        self._heap = [(ts, seq, key) for key, (ts, seq, _) in self._entries.items()]
+        heapq.heapify(self._heap)
+
+    def remove(self, key):
+        self._entries.pop(key, None)
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        ts, _, payload = entry
+        return datetime.fromtimestamp(ts, tz=timezone.utc), payload
+
+    def _is_live(self, ts: float, seq: int, key) -> bool:
+        entry = self._entries.get(key)
+        return entry is not None and entry[1] == seq
+
+    def _drop_stale_head(self):
+        while self._heap and not self._is_live(*self._heap[0]):
+            heapq.heappop(self._heap)
+
+    def _compact_if_needed(self):
+        # устаревших записей в куче не больше, чем живых
+        if len(self._heap) > 2 * len(self._entries) + 64:
+            self._heap = [item for item in self._heap if self._is_live(*item)]
+            heapq.heapify(self._heap)
+
+    def next_due_ts(self) -> float | None:
+        self._drop_stale_head()
+        return self._heap[0][0] if self._heap else None
+
+    def pop_due(self, now_ts: float, limit: int = 100) -> list:
+        batch = []
+        while len(batch) < limit:
+            self._drop_stale_head()
+            if not self._heap or self._heap[0][0] > now_ts:
+                break
+            _, _, key = heapq.heappop(self._heap)
+            _, _, payload = self._entries.pop(key)
+            batch.append((key, payload))
+        return batch
+
+    def items(self):
+        for key, (ts, _, payload) in self._entries.items():
+            yield key, ts, payload
+
+
+class FollowupDispatcher:
+    # Одна фоновая задача спит до ближайшего срока и отправляет созревшие пачками.
+    def __init__(self, queue: FollowupQueue, handler, batch_size: int = 100, clock=None):
+        self.queue = queue
+        self.handler = handler  # async handler(batch: list[(key, payload)])
+        self.batch_size = batch_size
+        self._clock = clock or time.time
+        self._wakeup = asyncio.Event()
+        self._task: asyncio.Task | None = None
+        self.dispatched = 0
+
+    def schedule(self, key, due: datetime, payload=None):
+        head = self.queue.next_due_ts()
+        self.queue.push(key, due, payload)
+        if head is None or due.timestamp() < head:
+            self._wakeup.set()
+
+    async def run_once(self) -> int:
+        sent = 0
+        while True:
+            batch = self.queue.pop_due(self._clock(), self.batch_size)
+            if not batch:
+                return sent
+            try:
+                await self.handler(batch)
+            except Exception:
+                logger.exception("Follow-up batch failed")
+            sent += len(batch)
+            self.dispatched += len(batch)
+
+    async def _loop(self):
+        while True:
+            await self.run_once()
+            head = self.queue.next_due_ts()
+            timeout = None if head is None else max(0.0, head - self._clock())
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._loop(), name="followup-dispatcher")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
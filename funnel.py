@@ -0,0 +1,85 @@
+from collections import Counter
+from contextvars import ContextVar
+
+from aiogram.methods import TelegramMethod
+
+# счётчик воронки, в которой сейчас обрабатывается апдейт; вне апдейтов (фоновые задачи) — None
+_active: ContextVar["FunnelMeter | None"] = ContextVar("funnel_meter", default=None)
+
+
+class FunnelMeter:
+    # Вызовы Bot API, сделанные при обработке апдейтов лидов (без фоновых задач и команд админа):
+    # исходящие запросы по методам и ответы, ушедшие в теле вебхука. Делим на входы в воронку (/start)
+    # и на конверсии (отправленная брошюра) — видно, во сколько запросов обходится лид.
+    def __init__(self):
+        self.calls: Counter = Counter()
+        self.inline: Counter = Counter()
+        self.entries = 0
+        self.conversions = 0
+
+    def reset(self):
+        self.calls.clear()
+        self.inline.clear()
+        self.entries = 0
+        self.conversions = 0
+
+    def record(self, method: str, inline: bool = False):
+        (self.inline if inline else self.calls)[method] += 1
+
+    async def __call__(self, handler, event, data, skip: bool = False):
+        # внешний middleware на update; skip — апдейт не считается (например, от админа)
+        if skip:
+            return await handler(event, data)
+        token = _active.set(self)
+        try:
+            result = await handler(event, data)
+        finally:
+            _active.reset(token)
+        if isinstance(result, TelegramMethod):
+            self.record(type(result).__name__, inline=True)
+        return result
+
+    def stats(self) -> dict:
+        calls = sum(self.calls.values())
+        return {
+            "calls": calls,
+            "inline": sum(self.inline.values()),
+            "entries": self.entries,
+            "conversions": self.conversions,
+            "calls_per_entry": round(calls / self.entries, 2) if self.entries else None,
+            "calls_per_conversion": round(calls / self.conversions, 2) if self.conversions else None,
+            "by_method": dict(self.calls.most_common()),
+        }
+
+
+def mark_entry():
+    # вход в воронку (/start) — только в учитываемом апдейте
+    meter = _active.get()
+    if meter is not None:
+        meter.entries += 1
+
+
+def mark_conversion():
+    # конверсия — брошюра отправлена
+    meter = _active.get()
+    if meter is not None:
+        meter.conversions += 1
+
+
+async def count_api_calls(make_request, bot, method):
+    # middleware сессии aiogram: исходящий запрос засчитывается воронке текущего апдейта
+    meter = _active.get()
+    if meter is not None:
+        meter.record(type(method).__name__)
+    return await make_request(bot, method)
+
+
+def format_funnel(stats: dict) -> str:
+    lines = [
+        f"Входов в воронку: {stats['entries']}, конверсий: {stats['conversions']}",
+        f"Запросов к Bot API: {stats['calls']} (+{stats['inline']} в ответе вебхука)",
+        f"На вход: {stats['calls_per_entry'] if stats['calls_per_entry'] is not None else '—'}, "
+        f"на конверсию: {stats['calls_per_conversion'] if stats['calls_per_conversion'] is not None else '—'}",
+    ]
+    lines += [f"  {method}: {count}" for method, count in stats["by_method"].items()]
+    return "\n".join(lines)
@@ -0,0 +1,156 @@
+import csv
+import itertools
+import logging
+import sqlite3
+import time
+from datetime import datetime, timezone, tzinfo
+
+logger = logging.getLogger("rome_estate_bot")
+
+# колонки users, которые можно загрузить; в источнике допускаются и имена колонок таблицы
+IMPORT_COLUMNS = (
+    "chat_id", "username", "first_name", "subscribed", "last_message", "last_interaction",
+    "file_sent_at", "followup_attempts", "manager_contacted", "lang", "tz", "segment",
+)
+ALIASES = {"file_sent": "file_sent_at"}
+BOOL_COLUMNS = {"subscribed", "manager_contacted"}
+INT_COLUMNS = {"followup_attempts"}
+TIMESTAMP_COLUMNS = {"last_interaction", "file_sent_at"}
+TRUE_VALUES = {"1", "true", "yes", "y", "on", "да"}
+
+
+def read_csv(path: str):
+    # (заголовок, итератор строк) — построчно, без загрузки файла в память
+    f = open(path, newline="", encoding="utf-8-sig")
+    reader = csv.reader(f)
+    header = next(reader, [])
+
+    def rows():
+        with f:
+            yield from reader
+
+    return header, rows()
+
+
+def rows_from_values(values: list[list[str]]):
+    # результат values.get из Sheets: первая строка — заголовок
+    return (values[0] if values else []), iter(values[1:])
+
+
+def _str(value: str):
+    value = value.strip()
+    return value or None
+
+
+def _bool(value: str):
+    value = value.strip()
+    return (1 if value.lower() in TRUE_VALUES else 0) if value else None
+
+
+def _int(value: str):
+    value = value.strip()
+    return int(float(value)) if value else None
+
+
+def _timestamp(tz: tzinfo):
+    # время — ISO с поясом, как пишет бот; время без пояса — в поясе бота, нераспознанное — пропускаем
+    def conv(value: str):
+        value = value.strip()
+        if not value:
+            return None
+        try:
+            dt = datetime.fromisoformat(value)
+        except ValueError:
+            return None
+        return (dt.replace(tzinfo=tz) if dt.tzinfo is None else dt).isoformat()
+    return conv
+
+
+def _plan(header: list[str], tz: tzinfo = timezone.utc) -> list[tuple[str, int, object]]:
+    # какие колонки users есть в источнике (по имени в users или в таблице) и чем их приводить
+    index = {}
+    for i, name in enumerate(h.strip() for h in header):
+        index.setdefault(ALIASES.get(name, name), i)
+    if "chat_id" not in index:
+        raise ValueError("В источнике нет колонки chat_id")
+    plan = []
+    for column in IMPORT_COLUMNS:
+        if column in index:
+            if column in TIMESTAMP_COLUMNS:
+                conv = _timestamp(tz)
+            else:
+                conv = _bool if column in BOOL_COLUMNS else _int if column in INT_COLUMNS else _str
+            plan.append((column, index[column], conv))
+    return plan
+
+
+def _tuples(rows, plan, stats: dict):
+    width = max(i for _, i, _ in plan) + 1
+    fields = [(i, conv) for _, i, conv in plan[1:]]
+    chat_idx = plan[0][1]
+    for row in rows:
+        stats["read"] += 1
+        if len(row) < width:
+            row = row + [""] * (width - len(row))
+        try:
+            yield (int(row[chat_idx]), *[conv(row[i]) for i, conv in fields])
+        except (ValueError, TypeError):
+            stats["skipped"] += 1
+
+
+def import_leads(header: list[str], rows, db_path: str, batch_size: int = 10000, tz: tzinfo = timezone.utc) -> dict:
+    # Одно соединение, executemany пачками по batch_size в отдельных транзакциях.
+    # На время загрузки — WAL и synchronous=OFF (synchronous действует только на это соединение),
+    # после — прежний journal_mode файла: он сохраняется в БД и касается работающего бота.
+    # Пустые значения источника не затирают то, что уже есть в БД; время без пояса — в поясе tz.
+    stats = {"read": 0, "skipped": 0, "inserted": 0, "updated": 0, "batches": 0}
+    plan = _plan(header, tz)
+    columns = [column for column, _, _ in plan]
+    assignments = ", ".join(f"{c}=COALESCE(excluded.{c}, users.{c})" for c in columns[1:])
+    sql = (
+        f"INSERT INTO users ({', '.join(columns)}) VALUES ({', '.join('?' for _ in columns)}) "
+        f"ON CONFLICT(chat_id) DO UPDATE SET {assignments}"
+    )
+    started = time.perf_counter()
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    try:
+        journal_mode = conn.execute("PRAGMA journal_mode").fetchone()[0]
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=OFF")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        before = conn.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+        it = _tuples(rows, plan, stats)
+        while True:
+            batch = list(itertools.islice(it, batch_size))
+            if not batch:
+                break
+            conn.execute("BEGIN")
+            conn.executemany(sql, batch)
+            conn.execute("COMMIT")
+            stats["batches"] += 1
+            if stats["batches"] % 50 == 0:
+                logger.info(f"Import: {stats['read']} rows read")
+        after = conn.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        if journal_mode.lower() != "wal":
+            try:
+                conn.execute(f"PRAGMA journal_mode={journal_mode}")
+            except sqlite3.OperationalError as e:
+                # выйти из WAL нельзя, пока файл открыт другим соединением (работающий бот)
+                logger.warning(f"Import: journal_mode stays WAL, restore to {journal_mode} failed: {e}")
+    finally:
+        conn.close()
+    loaded = stats["read"] - stats["skipped"]
+    stats["inserted"] = after - before
+    stats["updated"] = loaded - stats["inserted"]
+    stats["seconds"] = round(time.perf_counter() - started, 3)
+    stats["rows_per_second"] = int(loaded / stats["seconds"]) if stats["seconds"] else loaded
+    return stats
+
+
+def format_import_report(stats: dict) -> str:
+    return (
+        f"Прочитано: {stats['read']}, пропущено: {stats['skipped']}\n"
+        f"Добавлено: {stats['inserted']}, обновлено: {stats['updated']}\n"
+        f"Пачек: {stats['batches']}, время: {stats['seconds']} с, {stats['rows_per_second']} строк/с"
+    )
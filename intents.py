@@ -0,0 +1,92 @@
+from dataclasses import dataclass
+
+# Латиница и кириллица с одинаковым начертанием (после casefold)
+_LAT = "aceopxykmthb"
+_CYR = "асеорхукмтнв"
+_LAT_TO_CYR = str.maketrans(_LAT, _CYR)
+_CYR_TO_LAT = str.maketrans(_CYR, _LAT)
+
+_END = object()
+
+
+def _script_counts(word: str) -> tuple[int, int]:
+    cyr = lat = 0
+    for ch in word:
+        if "а" <= ch <= "я" or ch == "ё":
+            cyr += 1
+        elif "a" <= ch <= "z":
+            lat += 1
+    return cyr, lat
+
+
+def normalize(text: str) -> str:
+    # регистр, лишние пробелы и смешанные алфавиты в одном слове:
+    # похожие буквы приводим к алфавиту, которого в слове больше
+    words = []
+    for word in text.casefold().split():
+        cyr, lat = _script_counts(word)
+        if cyr and lat:
+            word = word.translate(_LAT_TO_CYR if cyr >= lat else _CYR_TO_LAT)
+        words.append(word)
+    return " ".join(words)
+
+
+@dataclass(frozen=True)
+class Intent:
+    kind: str       # "command" | "keyword" | "text"
+    name: str = ""  # команда без "/" или имя ключевого слова
+    args: str = ""
+
+
+TEXT = Intent("text")
+
+
+class IntentClassifier:
+    # Один проход нормализации на сообщение, дальше — словарь команд
+    # и префиксное дерево ключевых слов вместо цепочки фильтров.
+    def __init__(self, commands, keywords: dict[str, list[str]], prefixes: dict[str, list[str]] | None = None):
+        self.commands = {c.lower() for c in commands}
+        self._trie: dict = {}
+        for name, words in keywords.items():
+            for word in words:
+                self._add(normalize(word), name, prefix=False)
+        for name, words in (prefixes or {}).items():
+            for word in words:
+                self._add(normalize(word), name, prefix=True)
+
+    def _add(self, word: str, name: str, prefix: bool):
+        node = self._trie
+        for ch in word:
+            node = node.setdefault(ch, {})
+        node[_END] = (name, prefix)
+
+    def _match_keyword(self, text: str) -> str | None:
+        node = self._trie
+        for i, ch in enumerate(text):
+            node = node.get(ch)
+            if node is None:
+                return None
+            end = node.get(_END)
+            if end is None:
+                continue
+            name, prefix = end
+            rest = text[i + 1:]
+            # для основ (prefix) допускаем окончание из букв: «проекта», «проекты»
+            if not rest or (prefix and rest.replace("_", "").isalnum()):
+                return name
+        return None
+
+    def classify(self, text: str | None) -> Intent:
+        if not text:
+            return TEXT
+        stripped = text.strip()
+        if stripped.startswith("/"):
+            head, _, args = stripped.partition(" ")
+            name = head[1:].split("@", 1)[0].lower()
+            if name in self.commands:
+                return Intent("command", name, args.strip())
+            return TEXT
+        name = self._match_keyword(normalize(stripped))
+        if name is not None:
+            return Intent("keyword", name)
+        return TEXT
@@ -0,0 +1,70 @@
+import asyncio
+import logging
+import time
+
+from aiogram import BaseMiddleware
+
+logger = logging.getLogger("rome_estate_bot")
+
+
+class InflightTracker(BaseMiddleware):
+    # Внешний middleware на update: считает хендлеры, которые ещё выполняются,
+    # чтобы при остановке дождаться их, а не обрывать на полуслове.
+    def __init__(self):
+        self.active = 0
+        self.handled = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+
+    async def __call__(self, handler, event, data):
+        self.active += 1
+        self._idle.clear()
+        try:
+            return await handler(event, data)
+        finally:
+            self.active -= 1
+            self.handled += 1
+            if self.active == 0:
+                self._idle.set()
+
+    async def wait_idle(self, timeout: float) -> bool:
+        if self.active == 0:
+            return True
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout=timeout)
+            return True
+        except asyncio.TimeoutError:
+            logger.warning("Shutdown: %s handlers still running after %.1fs", self.active, timeout)
+            return False
+
+
+class Lifecycle:
+    # Упорядоченные шаги остановки с общим дедлайном. Каждый шаг получает
+    # оставшееся время; даже после дедлайна шаг запускается с min_step секундами,
+    # чтобы дешёвые, но важные шаги (чекпоинт, закрытие сессии) не пропускались.
+    def __init__(self, deadline: float, min_step: float = 1.0):
+        self.deadline = deadline
+        self.min_step = min_step
+        self._steps: list[tuple[str, object]] = []
+        self.report: dict[str, str] = {}
+
+    def add_step(self, name: str, fn):
+        # fn(remaining_seconds) -> awaitable
+        self._steps.append((name, fn))
+
+    async def shutdown(self) -> dict:
+        started = time.monotonic()
+        for name, fn in self._steps:
+            remaining = max(self.deadline - (time.monotonic() - started), self.min_step)
+            step_started = time.monotonic()
+            try:
+                await asyncio.wait_for(fn(remaining), timeout=remaining)
+                self.report[name] = f"ok {time.monotonic() - step_started:.2f}s"
+            except asyncio.TimeoutError:
+                self.report[name] = "timeout"
+                logger.warning("Shutdown step %s timed out", name)
+            except Exception as e:
+                self.report[name] = f"error: {e}"
+                logger.exception("Shutdown step %s failed", name)
+        logger.info("Shutdown finished in %.2fs: %s", time.monotonic() - started, self.report)
+        return self.report
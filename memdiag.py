@@ -0,0 +1,99 @@
+import gc
+import logging
+import os
+import resource
+import sys
+import tracemalloc
+
+logger = logging.getLogger("rome_estate_bot")
+
+
+def rss_bytes() -> int:
+    # текущий RSS из /proc (Linux, контейнер); иначе пиковый из getrusage
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+def open_client_sessions() -> int:
+    # незакрытые aiohttp.ClientSession (в том числе сессии Bot): обход кучи, вызывать нечасто
+    aiohttp = sys.modules.get("aiohttp")
+    if aiohttp is None:
+        return 0
+    return sum(1 for obj in gc.get_objects() if isinstance(obj, aiohttp.ClientSession) and not obj.closed)
+
+
+def executor_stats(loop) -> dict:
+    # пул потоков по умолчанию (asyncio.to_thread): очередь задач и число потоков
+    executor = getattr(loop, "_default_executor", None)
+    if executor is None:
+        return {"executor_queue": 0, "executor_threads": 0}
+    return {
+        "executor_queue": executor._work_queue.qsize(),
+        "executor_threads": len(executor._threads),
+    }
+
+
+def crossed(gauges: dict, thresholds: dict) -> list[str]:
+    # превышенные пороги; порог 0 — не проверять
+    return [
+        f"{name} = {gauges[name]} (порог {limit})"
+        for name, limit in thresholds.items()
+        if limit and gauges.get(name, 0) > limit
+    ]
+
+
+class MemoryTracker:
+    # Снимки tracemalloc по запросу: каждый отчёт — разница с предыдущим снимком
+    # по строкам кода (где выросло больше всего). Трассировка замедляет аллокации,
+    # поэтому включается только командой или настройкой.
+    def __init__(self, frames: int = 10):
+        self.frames = frames
+        self._previous: tracemalloc.Snapshot | None = None
+
+    @property
+    def tracing(self) -> bool:
+        return tracemalloc.is_tracing()
+
+    def start(self):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+        self._previous = self._snapshot()
+
+    def stop(self):
+        self._previous = None
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+    def _snapshot(self) -> tracemalloc.Snapshot:
+        return tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            tracemalloc.Filter(False, "<unknown>"),
+        ))
+
+    def report(self, limit: int = 10) -> str:
+        if not tracemalloc.is_tracing():
+            self.start()
+            return "tracemalloc включён, снят базовый снимок. Повторите команду позже — будет разница."
+        snapshot = self._snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        lines = [f"Отслеживается: {current / 1024 / 1024:.1f} МБ (пик {peak / 1024 / 1024:.1f} МБ)"]
+        if self._previous is not None:
+            lines.append("Рост с прошлого снимка:")
+            for stat in snapshot.compare_to(self._previous, "lineno")[:limit]:
+                frame = stat.traceback[0]
+                lines.append(
+                    f"{stat.size_diff / 1024:+.1f} КБ ({stat.count_diff:+d}) "
+                    f"{os.path.basename(frame.filename)}:{frame.lineno}"
+                )
+        else:
+            lines.append("Больше всего памяти:")
+            for stat in snapshot.statistics("lineno")[:limit]:
+                frame = stat.traceback[0]
+                lines.append(f"{stat.size / 1024:.1f} КБ ({stat.count}) {os.path.basename(frame.filename)}:{frame.lineno}")
+        self._previous = snapshot
+        return "\n".join(lines)
@@ -0,0 +1,241 @@
+import asyncio
+import json
+import logging
+import sqlite3
+from dataclasses import dataclass
+from datetime import datetime
+
+logger = logging.getLogger("rome_estate_bot")
+
+
+@dataclass(frozen=True)
+class OutboxItem:
+    id: int
+    chat_id: int
+    values: dict    # колонка таблицы -> значение (уже в виде строки для Sheets)
+    revision: int   # растёт при каждом слиянии; подтверждаем только отправленную ревизию
+    attempts: int = 0
+
+
+class SheetsOutbox:
+    # Журнал записей в Google Sheets в SQLite. Запись делается в той же транзакции,
+    # что и изменение users, поэтому при недоступной таблице ничего не теряется.
+    # Для одного chat_id держим одну строку: новые значения вливаются в неё
+    # (компакция), и после простоя отправляется не вся история, а итоговое состояние.
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+
+    @staticmethod
+    def init(conn: sqlite3.Connection):
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS sheets_outbox (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                chat_id INTEGER NOT NULL UNIQUE,
+                payload TEXT NOT NULL,
+                revision INTEGER DEFAULT 0,
+                attempts INTEGER DEFAULT 0,
+                last_error TEXT,
+                created_at TEXT,
+                dead INTEGER DEFAULT 0
+            )
+        """)
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(sheets_outbox)")}
+        if "dead" not in columns:
+            conn.execute("ALTER TABLE sheets_outbox ADD COLUMN dead INTEGER DEFAULT 0")
+
+    def journal(self, conn: sqlite3.Connection, chat_id: int, values: dict):
+        # вызывается внутри транзакции вызывающего; commit — на его стороне
+        row = conn.execute("SELECT payload FROM sheets_outbox WHERE chat_id=?", (chat_id,)).fetchone()
+        if row is None:
+            conn.execute(
+                "INSERT INTO sheets_outbox (chat_id, payload, created_at) VALUES (?, ?, ?)",
+                (chat_id, json.dumps(values, ensure_ascii=False), datetime.now().isoformat()),
+            )
+            return
+        merged = json.loads(row[0])
+        merged.update(values)
+        # отложенная строка с новыми значениями получает ещё один шанс
+        conn.execute(
+            "UPDATE sheets_outbox SET payload=?, revision=revision+1, dead=0, attempts=0 WHERE chat_id=?",
+            (json.dumps(merged, ensure_ascii=False), chat_id),
+        )
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path)
+        self.init(conn)
+        return conn
+
+    def batch(self, limit: int) -> list[OutboxItem]:
+        conn = self._connect()
+        rows = conn.execute(
+            "SELECT id, chat_id, payload, revision, attempts FROM sheets_outbox WHERE dead=0 ORDER BY id LIMIT ?",
+            (limit,),
+        ).fetchall()
+        conn.close()
+        return [OutboxItem(r[0], r[1], json.loads(r[2]), r[3], r[4] or 0) for r in rows]
+
+    def ack(self, items: list[OutboxItem]):
+        # строки, в которые успели влиться новые значения, остаются в журнале
+        conn = self._connect()
+        conn.executemany(
+            "DELETE FROM sheets_outbox WHERE id=? AND revision=?",
+            [(item.id, item.revision) for item in items],
+        )
+        conn.commit()
+        conn.close()
+
+    def fail(self, items: list[OutboxItem], error: str):
+        conn = self._connect()
+        conn.executemany(
+            "UPDATE sheets_outbox SET attempts=attempts+1, last_error=? WHERE id=?",
+            [(error[:200], item.id) for item in items],
+        )
+        conn.commit()
+        conn.close()
+
+    def park(self, items: list[OutboxItem], error: str):
+        # dead letter: строка больше не отправляется и не держит очередь; таблицу по БД
+        # потом выправит сверка (reconcile), новая запись того же лида снимает отметку
+        conn = self._connect()
+        conn.executemany(
+            "UPDATE sheets_outbox SET dead=1, last_error=? WHERE id=? AND revision=?",
+            [(error[:200], item.id, item.revision) for item in items],
+        )
+        conn.commit()
+        conn.close()
+
+    def pending(self) -> int:
+        conn = self._connect()
+        count = conn.execute("SELECT COUNT(*) FROM sheets_outbox WHERE dead=0").fetchone()[0]
+        conn.close()
+        return count
+
+    def parked(self) -> int:
+        conn = self._connect()
+        count = conn.execute("SELECT COUNT(*) FROM sheets_outbox WHERE dead=1").fetchone()[0]
+        conn.close()
+        return count
+
+
+class OutboxDrainer:
+    # Фоновая задача: отправляет журнал пачками по порядку. Пока таблица
+    # недоступна — экспоненциальная пауза, новые записи её не прерывают.
+    # Отклонённые запросы (retryable(e) -> False) не повторяются: пачка отправляется
+    # по одной строке, и откладываются только строки, которые сами вызывают ошибку;
+    # строки, не ушедшие за max_attempts попыток, тоже откладываются. on_parked(items, error)
+    # — уведомление об отложенных строках.
+    def __init__(self, outbox: SheetsOutbox, apply, batch_size: int = 200,
+                 interval: float = 5.0, max_backoff: float = 300.0, max_attempts: int = 20,
+                 retryable=None, on_parked=None):
+        self.outbox = outbox
+        self.apply = apply  # async apply(items: list[OutboxItem])
+        self.batch_size = batch_size
+        self.interval = interval
+        self.max_backoff = max_backoff
+        self.max_attempts = max_attempts
+        self.retryable = retryable or (lambda e: True)
+        self.on_parked = on_parked
+        self._wakeup = asyncio.Event()
+        self._task: asyncio.Task | None = None
+        self.failing = False
+        self.sent = 0
+
+    def notify(self):
+        if not self.failing:
+            self._wakeup.set()
+
+    async def run_once(self) -> int:
+        sent = 0
+        while True:
+            items = self.outbox.batch(self.batch_size)
+            if not items:
+                return sent
+            try:
+                await self.apply(items)
+            except Exception as e:
+                if not self.retryable(e):
+                    sent += await self._isolate(items, e)
+                    continue
+                self.outbox.fail(items, str(e))
+                worn = [item for item in items if item.attempts + 1 >= self.max_attempts]
+                if worn:
+                    await self._park(worn, f"{self.max_attempts} попыток, последняя: {e}")
+                raise
+            self.outbox.ack(items)
+            sent += len(items)
+            self.sent += len(items)
+
+    async def _isolate(self, items: list[OutboxItem], error: Exception) -> int:
+        # пачка отклонена целиком: ищем строки, из-за которых, по одной
+        if len(items) == 1:
+            await self._park(items, str(error))
+            return 0
+        sent = 0
+        poisoned = []
+        for item in items:
+            try:
+                await self.apply([item])
+            except Exception as e:
+                if self.retryable(e):
+                    self.outbox.fail([item], str(e))
+                    raise
+                poisoned.append((item, e))
+                continue
+            self.outbox.ack([item])
+            sent += 1
+            self.sent += 1
+        if poisoned:
+            await self._park([item for item, _ in poisoned], str(poisoned[0][1]))
+        return sent
+
+    async def _park(self, items: list[OutboxItem], error: str):
+        self.outbox.park(items, error)
+        logger.error(f"Sheets outbox: parked {[item.chat_id for item in items]}: {error}")
+        if self.on_parked is not None:
+            try:
+                await self.on_parked(items, error)
+            except Exception:
+                logger.exception("Sheets outbox: parked alert failed")
+
+    async def _loop(self):
+        delay = self.interval
+        while True:
+            # до отправки: notify(), пришедший пока летит пачка, разбудит следующий круг
+            self._wakeup.clear()
+            try:
+                await self.run_once()
+                if self.failing:
+                    logger.info("Sheets outbox: table reachable again")
+                self.failing = False
+                delay = self.interval
+            except Exception as e:
+                delay = min(delay * 2, self.max_backoff) if self.failing else self.interval
+                self.failing = True
+                logger.warning(f"Sheets outbox: {self.outbox.pending()} pending, retry in {delay:.0f}s: {e}")
+            if self.failing:
+                await asyncio.sleep(delay)
+                continue
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._loop(), name="sheets-outbox")
+
+    async def stop(self, flush_timeout: float = 0.0):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if flush_timeout > 0 and not self.failing:
+            # последняя попытка; что не успели — останется в журнале до следующего старта
+            try:
+                await asyncio.wait_for(self.run_once(), timeout=flush_timeout)
+            except Exception as e:
+                logger.warning(f"Sheets outbox flush on shutdown incomplete: {e!r}")
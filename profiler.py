@@ -0,0 +1,163 @@
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter, deque
+
+logger = logging.getLogger("rome_estate_bot")
+
+STACK_DEPTH = 20
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})"
+
+
+def format_stack(frame, depth: int = STACK_DEPTH) -> str:
+    # от внешнего вызова к внутреннему, последние depth кадров
+    frames = []
+    while frame is not None:
+        frames.append(_frame_label(frame))
+        frame = frame.f_back
+    return "\n".join(f"  {label}" for label in reversed(frames[:depth]))
+
+
+class LoopLagMonitor:
+    # Задержка цикла событий: задача в цикле спит interval и меряет, насколько проснулась позже.
+    # Сторожевой поток видит зависание, пока оно идёт: если цикл не отмечался дольше threshold,
+    # он снимает стек потока цикла (sys._current_frames) и пишет его в лог вместе с текущей задачей.
+    def __init__(self, threshold: float = 0.25, interval: float = 0.1, history: int = 600):
+        self.threshold = threshold
+        self.interval = interval
+        self._lags: deque = deque(maxlen=history)
+        self._beat = time.monotonic()
+        self._reported_beat = 0.0
+        self._loop = None
+        self._loop_thread_id = None
+        self._task: asyncio.Task | None = None
+        self._thread: threading.Thread | None = None
+        self._stop = threading.Event()
+        self.max_lag = 0.0
+        self.stalls = 0
+        self.last_stall: dict | None = None
+
+    def stats(self) -> dict:
+        lags = sorted(self._lags)
+        p99 = lags[min(int(len(lags) * 0.99), len(lags) - 1)] if lags else 0.0
+        return {
+            "lag_ms": round((self._lags[-1] if self._lags else 0.0) * 1000, 1),
+            "p99_ms": round(p99 * 1000, 1),
+            "max_ms": round(self.max_lag * 1000, 1),
+            "stalls": self.stalls,
+            "last_stall": {k: v for k, v in self.last_stall.items() if k != "stack"} if self.last_stall else None,
+        }
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            self._beat = time.monotonic()
+            await asyncio.sleep(self.interval)
+            lag = max(loop.time() - started - self.interval, 0.0)
+            self._lags.append(lag)
+            self.max_lag = max(self.max_lag, lag)
+
+    def _current_task_name(self) -> str:
+        try:
+            task = asyncio.current_task(self._loop)
+        except Exception:
+            task = None
+        if task is None:
+            return "-"
+        coro = task.get_coro()
+        return f"{task.get_name()} ({getattr(coro, '__qualname__', coro)})"
+
+    def check(self):
+        # один шаг сторожа; вынесен отдельно для тестов
+        beat = self._beat
+        stalled = time.monotonic() - beat
+        if stalled < self.threshold or beat == self._reported_beat:
+            return None
+        self._reported_beat = beat
+        frame = sys._current_frames().get(self._loop_thread_id)
+        self.stalls += 1
+        self.last_stall = {
+            "at": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "blocked_ms": round(stalled * 1000),
+            "task": self._current_task_name(),
+            "stack": format_stack(frame) if frame is not None else "",
+        }
+        logger.warning(
+            f"Event loop blocked for {stalled:.3f}s in {self.last_stall['task']}:\n{self.last_stall['stack']}"
+        )
+        return self.last_stall
+
+    def _watch(self):
+        while not self._stop.wait(self.interval / 2):
+            try:
+                self.check()
+            except Exception:
+                logger.exception("Loop lag watchdog failed")
+
+    def start(self):
+        if self._task is not None and not self._task.done():
+            return
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._beat = time.monotonic()
+        self._stop.clear()
+        self._task = asyncio.create_task(self._run(), name="loop-lag-monitor")
+        self._thread = threading.Thread(target=self._watch, name="loop-lag-watchdog", daemon=True)
+        self._thread.start()
+
+    async def stop(self):
+        self._stop.set()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self._thread = None
+
+
+def sample_stacks(seconds: float, interval: float = 0.005) -> tuple[Counter, int]:
+    # Семплирующий профайлер всего процесса: каждые interval секунд снимаем стеки всех потоков
+    # (кроме своего). Блокирующий — запускать через asyncio.to_thread.
+    own = threading.get_ident()
+    names = {t.ident: t.name for t in threading.enumerate()}
+    stacks: Counter = Counter()
+    samples = 0
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own:
+                continue
+            frames = []
+            while frame is not None:
+                frames.append(_frame_label(frame))
+                frame = frame.f_back
+            thread = names.get(thread_id) or str(thread_id)
+            stacks[";".join([thread, *reversed(frames)])] += 1
+        samples += 1
+        time.sleep(interval)
+    return stacks, samples
+
+
+def format_collapsed(stacks: Counter) -> str:
+    # collapsed stacks ("кадр;кадр;кадр N") — вход для flamegraph.pl и speedscope
+    return "\n".join(f"{stack} {count}" for stack, count in stacks.most_common()) + "\n"
+
+
+def top_frames(stacks: Counter, limit: int = 5) -> list[tuple[str, int]]:
+    # самые частые верхние кадры (где процесс проводил время), без ожидания в селекторе
+    leaf: Counter = Counter()
+    for stack, count in stacks.items():
+        frame = stack.rsplit(";", 1)[-1]
+        if not frame.startswith(("select (", "wait (", "_worker (")):
+            leaf[frame] += count
+    return leaf.most_common(limit)
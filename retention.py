@@ -0,0 +1,140 @@
+import logging
+import os
+import sqlite3
+import time
+
+logger = logging.getLogger("rome_estate_bot")
+
+
+def archive_path_for(db_path: str) -> str:
+    root, ext = os.path.splitext(db_path)
+    return f"{root}_archive{ext or '.db'}"
+
+
+def db_stats(db_path: str) -> dict:
+    conn = sqlite3.connect(db_path)
+    try:
+        page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+        page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+        freelist = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        auto_vacuum = conn.execute("PRAGMA auto_vacuum").fetchone()[0]
+        users = conn.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+    finally:
+        conn.close()
+    return {
+        "size_bytes": page_size * page_count,
+        "page_size": page_size,
+        "page_count": page_count,
+        "freelist_count": freelist,
+        "auto_vacuum": {0: "none", 1: "full", 2: "incremental"}.get(auto_vacuum, auto_vacuum),
+        "users": users,
+    }
+
+
+def _sync_archive_table(conn: sqlite3.Connection):
+    # архив повторяет колонки users (+ archived_at); новые колонки users доезжают сами
+    conn.execute("CREATE TABLE IF NOT EXISTS archive.users_archive (chat_id INTEGER PRIMARY KEY, archived_at TEXT)")
+    have = {row[1] for row in conn.execute("PRAGMA archive.table_info(users_archive)")}
+    for _, name, col_type, *_ in conn.execute("PRAGMA main.table_info(users)").fetchall():
+        if name not in have:
+            conn.execute(f"ALTER TABLE archive.users_archive ADD COLUMN {name} {col_type}")
+
+
+def archive_inactive(db_path: str, archive_path: str, cutoff: str, batch_size: int = 1000) -> int:
+    # Лиды без активности с cutoff (ISO-строка) переезжают в отдельный файл пачками:
+    # короткие транзакции не держат блокировку БД, пока бот работает.
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    moved = 0
+    try:
+        conn.execute("ATTACH DATABASE ? AS archive", (archive_path,))
+        _sync_archive_table(conn)
+        cols = ", ".join(row[1] for row in conn.execute("PRAGMA main.table_info(users)"))
+        has_checkpoint = conn.execute(
+            "SELECT 1 FROM main.sqlite_master WHERE type='table' AND name='followup_checkpoint'"
+        ).fetchone() is not None
+        while True:
+            conn.execute("BEGIN IMMEDIATE")
+            ids = [row[0] for row in conn.execute(
+                "SELECT chat_id FROM main.users WHERE COALESCE(last_interaction, file_sent_at) < ? "
+                "ORDER BY chat_id LIMIT ?",
+                (cutoff, batch_size),
+            )]
+            if not ids:
+                conn.execute("COMMIT")
+                break
+            marks = ", ".join("?" for _ in ids)
+            conn.execute(
+                f"INSERT OR REPLACE INTO archive.users_archive ({cols}, archived_at) "
+                f"SELECT {cols}, datetime('now') FROM main.users WHERE chat_id IN ({marks})",
+                ids,
+            )
+            conn.execute(f"DELETE FROM main.users WHERE chat_id IN ({marks})", ids)
+            # служебные записи этих лидов больше не нужны
+            if has_checkpoint:
+                conn.execute(f"DELETE FROM main.followup_checkpoint WHERE chat_id IN ({marks})", ids)
+            conn.execute("COMMIT")
+            moved += len(ids)
+        conn.execute("DETACH DATABASE archive")
+    finally:
+        conn.close()
+    return moved
+
+
+def prune_documents(db_path: str, keep_versions: int = 3) -> int:
+    # старые неактивные версии брошюр: оставляем keep_versions последних на (язык, сегмент)
+    conn = sqlite3.connect(db_path)
+    try:
+        cur = conn.execute("""
+            DELETE FROM documents WHERE active = 0 AND id IN (
+                SELECT id FROM (
+                    SELECT id, ROW_NUMBER() OVER (PARTITION BY lang, segment ORDER BY version DESC) AS rn
+                    FROM documents
+                ) WHERE rn > ?
+            )
+        """, (keep_versions,))
+        conn.commit()
+        return cur.rowcount
+    finally:
+        conn.close()
+
+
+def compact(db_path: str, max_pages: int = 2000) -> dict:
+    # incremental vacuum возвращает свободные страницы файлу порциями;
+    # на старой БД auto_vacuum включается один раз полным VACUUM
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    try:
+        converted = False
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            conn.execute("VACUUM")
+            converted = True
+        # свежая статистика для планировщика запросов; до vacuum — перезапись sqlite_stat1 тоже оставляет свободные страницы
+        conn.execute("ANALYZE")
+        free_before = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        # прагма освобождает по странице на шаг, а execute() делает только первый шаг
+        conn.executescript(f"PRAGMA incremental_vacuum({int(max_pages)});")
+        free_after = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    finally:
+        conn.close()
+    return {"converted": converted, "pages_freed": free_before - free_after}
+
+
+def run_retention(db_path: str, archive_path: str, cutoff: str,
+                  batch_size: int = 1000, vacuum_pages: int = 2000) -> dict:
+    started = time.perf_counter()
+    before = db_stats(db_path)
+    archived = archive_inactive(db_path, archive_path, cutoff, batch_size)
+    pruned = prune_documents(db_path)
+    vacuum = compact(db_path, vacuum_pages)
+    after = db_stats(db_path)
+    return {
+        "cutoff": cutoff,
+        "archived": archived,
+        "documents_pruned": pruned,
+        **vacuum,
+        "size_before": before["size_bytes"],
+        "size_after": after["size_bytes"],
+        "freelist_after": after["freelist_count"],
+        "users_after": after["users"],
+        "seconds": round(time.perf_counter() - started, 3),
+    }
@@ -0,0 +1,218 @@
+import re
+import sqlite3
+
+# Колонки users, по которым строятся сегменты: колонка -> имя сегмента для значения.
+# У многозначных (язык, сегмент, число фоллоу-апов) один лид — ровно в одном сегменте семейства.
+FAMILIES = {
+    "lang": "lang:",
+    "segment": "segment:",
+    "followup_attempts": "attempts:",
+    "subscribed": "subscribed",
+    "file_sent_at": "pdf",
+    "manager_contacted": "manager_contacted",
+}
+ALIASES = {"file_sent": "pdf", "manager": "manager_contacted", "sub": "subscribed"}
+
+_TOKEN = re.compile(r"\s*(?:(?P<op>[()&|!~∧∨¬])|(?P<name>[\w:.\-]+))")
+
+
+def _mask_of(ordinals: list[int], size: int) -> int:
+    bits = bytearray((size + 7) // 8)
+    for ordinal in ordinals:
+        bits[ordinal >> 3] |= 1 << (ordinal & 7)
+    return int.from_bytes(bits, "little")
+
+
+class SegmentIndex:
+    # Сегменты лидов в памяти: по битовой маске (int) на сегмент, бит — порядковый номер лида.
+    # Подсчёт и пересечения — побитовые операции над целыми, без обращения к SQLite.
+    # Строится из users при старте, дальше обновляется из update_user_fields/upsert_user.
+    def __init__(self, default_lang: str = "ru"):
+        self.default_lang = default_lang
+        self._ordinal: dict[int, int] = {}
+        self._chat_ids: list[int] = []
+        self._sets: dict[str, int] = {}
+        self._all = 0
+        self.loaded = False
+        self._pending: list | None = None
+
+    def __len__(self) -> int:
+        return len(self._chat_ids)
+
+    def _name(self, column: str, value) -> str | None:
+        family = FAMILIES[column]
+        if column == "lang":
+            return family + (value or self.default_lang)
+        if column == "followup_attempts":
+            return family + str(int(value or 0))
+        if column == "segment":
+            return family + value if value else None
+        return family if value else None
+
+    def _set(self, column: str, bit: int, value):
+        family = FAMILIES[column]
+        for name, mask in self._sets.items():
+            if (name == family or (family.endswith(":") and name.startswith(family))) and mask & bit:
+                self._sets[name] = mask ^ bit
+        name = self._name(column, value)
+        if name is not None:
+            self._sets[name] = self._sets.get(name, 0) | bit
+
+    def _bit(self, chat_id: int) -> int:
+        ordinal = self._ordinal.get(chat_id)
+        if ordinal is None:
+            ordinal = self._ordinal[chat_id] = len(self._chat_ids)
+            self._chat_ids.append(chat_id)
+            bit = 1 << ordinal
+            self._all |= bit
+            self._set("lang", bit, None)
+            self._set("followup_attempts", bit, 0)
+            return bit
+        return 1 << ordinal
+
+    def add(self, chat_id: int):
+        # новый лид (upsert_user): язык по умолчанию, 0 фоллоу-апов
+        if self._pending is not None:
+            self._pending.append((chat_id, {}))
+        self._bit(chat_id)
+
+    def update(self, chat_id: int, fields: dict):
+        if self._pending is not None:
+            self._pending.append((chat_id, fields))
+        tracked = [column for column in fields if column in FAMILIES]
+        if not tracked:
+            return
+        bit = self._bit(chat_id)
+        for column in tracked:
+            self._set(column, bit, fields[column])
+
+    def load(self, rows):
+        # rows: словари с chat_id и колонками FAMILIES (чего нет — значение по умолчанию).
+        # Номера собираются списками и превращаются в маски один раз: OR по одному биту
+        # в большое целое на каждую строку дал бы квадратичное время.
+        members: dict[str, list[int]] = {}
+        for row in rows:
+            chat_id = row["chat_id"]
+            if chat_id in self._ordinal:
+                self.update(chat_id, {column: row.get(column) for column in FAMILIES})
+                continue
+            ordinal = self._ordinal[chat_id] = len(self._chat_ids)
+            self._chat_ids.append(chat_id)
+            for column in FAMILIES:
+                name = self._name(column, row.get(column))
+                if name is not None:
+                    members.setdefault(name, []).append(ordinal)
+        size = len(self._chat_ids)
+        for name, ordinals in members.items():
+            self._sets[name] = self._sets.get(name, 0) | _mask_of(ordinals, size)
+        self._all = (1 << size) - 1
+        self.loaded = True
+        return self
+
+    @classmethod
+    def from_db(cls, db_path: str, default_lang: str = "ru", lang_of=None) -> "SegmentIndex":
+        # lang_of(row) — язык лида, если он хранится не только в колонке lang
+        index = cls(default_lang)
+        conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+        conn.row_factory = sqlite3.Row
+        try:
+            columns = ", ".join(["chat_id", "last_message", *FAMILIES])
+            rows = (dict(row) for row in conn.execute(f"SELECT {columns} FROM users ORDER BY chat_id"))
+            if lang_of is not None:
+                rows = ({**row, "lang": lang_of(row)} for row in rows)
+            index.load(rows)
+        finally:
+            conn.close()
+        return index
+
+    def begin_rebuild(self):
+        # изменения, пришедшие пока новый индекс строится в потоке, потом применяются к нему
+        self._pending = []
+
+    def finish_rebuild(self, fresh: "SegmentIndex | None"):
+        pending, self._pending = self._pending or [], None
+        if fresh is None:
+            return
+        for chat_id, fields in pending:
+            if fields:
+                fresh.update(chat_id, fields)
+            else:
+                fresh.add(chat_id)
+        self._ordinal, self._chat_ids, self._sets, self._all = fresh._ordinal, fresh._chat_ids, fresh._sets, fresh._all
+        self.loaded = True
+
+    def counts(self) -> dict[str, int]:
+        return {name: mask.bit_count() for name, mask in sorted(self._sets.items()) if mask}
+
+    def mask(self, name: str) -> int:
+        name = ALIASES.get(name, name)
+        if name == "all":
+            return self._all
+        if ":" not in name and name not in FAMILIES.values() and len(name) == 2 and name.isalpha():
+            # голый код языка: en, ru, th
+            name = f"lang:{name}"
+        family = name.split(":", 1)[0] + ":" if ":" in name else name
+        if family not in FAMILIES.values():
+            raise ValueError(f"Неизвестный сегмент: {name}")
+        return self._sets.get(name, 0)
+
+    def query(self, expr: str) -> int:
+        # en & subscribed & !manager_contacted; | — или, ! ~ ¬ — не, ∧ ∨ — то же, скобки
+        tokens = []
+        pos = 0
+        expr = expr.strip()
+        while pos < len(expr):
+            m = _TOKEN.match(expr, pos)
+            if m is None:
+                raise ValueError(f"Не разобрать выражение с позиции {pos}: {expr[pos:]!r}")
+            tokens.append(m.group("op") or m.group("name"))
+            pos = m.end()
+            while pos < len(expr) and expr[pos].isspace():
+                pos += 1
+        if not tokens:
+            raise ValueError("Пустое выражение")
+        mask, rest = self._or(tokens)
+        if rest:
+            raise ValueError(f"Лишнее в выражении: {' '.join(rest)}")
+        return mask
+
+    def _or(self, tokens):
+        mask, tokens = self._and(tokens)
+        while tokens and tokens[0] in ("|", "∨"):
+            right, tokens = self._and(tokens[1:])
+            mask |= right
+        return mask, tokens
+
+    def _and(self, tokens):
+        mask, tokens = self._not(tokens)
+        while tokens and tokens[0] in ("&", "∧"):
+            right, tokens = self._not(tokens[1:])
+            mask &= right
+        return mask, tokens
+
+    def _not(self, tokens):
+        if not tokens:
+            raise ValueError("Выражение оборвано")
+        head, rest = tokens[0], tokens[1:]
+        if head in ("!", "~", "¬"):
+            mask, rest = self._not(rest)
+            return self._all & ~mask, rest
+        if head == "(":
+            mask, rest = self._or(rest)
+            if not rest or rest[0] != ")":
+                raise ValueError("Не закрыта скобка")
+            return mask, rest[1:]
+        if head in ("&", "|", ")", "∧", "∨"):
+            raise ValueError(f"Ожидался сегмент, а не {head!r}")
+        return self.mask(head), rest
+
+    def count(self, expr: str) -> int:
+        return self.query(expr).bit_count()
+
+    def iter_chat_ids(self, mask: int):
+        # chat_id лидов маски по порядку номеров; строка битов строится один раз
+        bits = bin(mask)[:1:-1]
+        pos = bits.find("1")
+        while pos != -1:
+            yield self._chat_ids[pos]
+            pos = bits.find("1", pos + 1)
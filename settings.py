@@ -0,0 +1,254 @@
+import os
+import sqlite3
+import logging
+import threading
+import time
+from dataclasses import dataclass, fields
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+logger = logging.getLogger("rome_estate_bot")
+
+
+# -------------------- Загрузка окружения --------------------
+def load_env_file(path: str = "environment.ini"):
+    if not os.path.exists(path):
+        return
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            for raw in f:
+                line = raw.strip()
+                if not line or line.startswith("#"):
+                    continue
+                # убираем инлайн-комментарии
+                if "#" in line:
+                    line = line.split("#", 1)[0].strip()
+                if "=" not in line:
+                    continue
+                key, value = line.split("=", 1)
+                key = key.strip()
+                value = value.strip().strip('"').strip("'")
+                if key and value and key not in os.environ:
+                    os.environ[key] = value
+    except Exception:
+        # не критично для запуска, просто логируем позже если чего-то не хватает
+        pass
+
+
+# -------------------- Статический конфиг --------------------
+@dataclass(frozen=True)
+class Settings:
+    # имя переменной окружения = имя поля в верхнем регистре
+    timezone: str = "Europe/Amsterdam"
+    # часовой пояс лида по выбранному языку — для тихих часов фоллоу-апов, пока пояс не известен точнее
+    # (импорт); язык без пояса — TIMEZONE. Формат: ru=Europe/Moscow,th=Asia/Bangkok
+    lang_timezones: str = "ru=Europe/Moscow,th=Asia/Bangkok"
+
+    bot_token: str = ""
+    admin_chat_id: int = 0
+
+    # Канал: НУЖЕН NUMERIC chat_id (например -1001234567890), а не t.me/...
+    channel_id: int = 0
+    channel_link: str = "https://t.me/rome_estate_channel"
+    manager_contact: str = "https://t.me/manager_telegram_or_site"
+
+    # значения по умолчанию для настроек, меняемых из админки (см. RuntimeSettings)
+    pdf_url: str = "https://drive.google.com/uc?id=DRIVE_FILE_ID&export=download"
+    reminder_interval_days: int = 2
+    reminder_max_attempts: int = 3
+    # JSON-описание последовательности напоминаний (см. followups.Cadence.from_config)
+    followup_cadence: str = ""
+    # чат для предзагрузки брошюр (получение file_id); 0 — ADMIN_CHAT_ID
+    docs_cache_chat_id: int = 0
+
+    gsheet_id: str = "GOOGLE_SHEET_ID"
+    gsheet_worksheet: str = "Leads"
+    google_service_json: str = ""  # путь к файлу, либо JSON строка
+
+    # Webhook (опционально)
+    webhook_url: str = ""  # например, https://your.domain.com/telegram/webhook
+    webhook_path: str = "/telegram/webhook"
+    webhook_secret: str = ""
+    webapp_host: str = "0.0.0.0"
+    webapp_port: int = 8080
+    # 1 — последний ответ хендлера возвращать в теле ответа на вебхук (без отдельного запроса к API)
+    webhook_reply: int = 0
+    # 1 — воронка с минимумом вызовов Telegram: результат проверки подписки правкой сообщения на месте
+    # (без «проверяем подписку»), брошюра с текстом в подписи одним сообщением
+    funnel_compact: int = 0
+
+    # Несколько брендированных ботов в одном процессе: путь к JSON-файлу или JSON-строка
+    # [{"name": "milan", "bot_token": "...", "channel_id": "...", ...}, ...]; пусто — один бот
+    tenants: str = ""
+
+    # Дашборд (read-only JSON на том же HTTP-сервере); пустой токен — выключен
+    dashboard_token: str = ""
+    dashboard_cache_seconds: float = 30.0
+
+    # Google Sheets: соединений в пуле aiohttp, время на дослив журнала при остановке
+    sheets_max_connections: int = 4
+    sheets_drain_timeout: float = 15.0
+    # сколько записей журнала (sheets_outbox) отправлять одной пачкой
+    sheets_outbox_batch: int = 200
+    # после стольких неудачных попыток строка журнала откладывается (dead letter) и админ получает уведомление;
+    # отклонённые таблицей запросы (4xx, кроме 429) откладываются сразу
+    sheets_outbox_max_attempts: int = 20
+    # Сверка SQLite ↔ Sheets (0 — отключить периодическую задачу)
+    reconcile_interval_minutes: int = 360
+    # сколько апдейтов разных чатов обрабатывать одновременно (внутри чата — по очереди); 0 — без лимита
+    handler_concurrency: int = 16
+    # Предохранители Telegram / Sheets / Drive: при доле ошибок BREAKER_FAILURE_RATE за окно
+    # (не меньше BREAKER_MIN_CALLS вызовов) зависимость BREAKER_OPEN_SECONDS не вызывается, затем проба
+    breaker_failure_rate: float = 0.5
+    breaker_min_calls: int = 5
+    breaker_window_seconds: float = 60.0
+    breaker_open_seconds: float = 30.0
+    # задержка цикла событий, после которой в лог пишется стек зависшего кода (0 — без мониторинга)
+    loop_lag_threshold: float = 0.25
+    # предел длительности /profile, секунд
+    profile_max_seconds: int = 60
+    # Память: tracemalloc с запуска (кадров в трассировке, 0 — только по /memory) и пороги ежечасной
+    # проверки с уведомлением админу (0 — не проверять)
+    tracemalloc_frames: int = 0
+    memory_alert_rss_mb: int = 512
+    memory_alert_scheduler_jobs: int = 1000
+    memory_alert_client_sessions: int = 10
+    memory_alert_executor_queue: int = 100
+    # общий дедлайн на остановку: хендлеры, очередь фоллоу-апов, Sheets, сессия
+    shutdown_timeout: float = 25.0
+
+    db_path: str = "bot.db"
+    # Хранение: лиды без активности дольше RETENTION_MONTHS переносятся в архив (0 — не переносить),
+    # затем incremental vacuum и ANALYZE — раз в сутки в RETENTION_HOUR по TIMEZONE
+    retention_months: int = 12
+    retention_hour: int = 4
+    retention_batch: int = 1000
+    archive_db_path: str = ""  # по умолчанию <db>_archive.db рядом с основной БД
+    # Колоночные снимки users для аналитики (нужен pyarrow): каталог (пусто — выключено), формат
+    # parquet или arrow, час выгрузки по TIMEZONE, сколько дней хранить (0 — все), строк в пачке чтения
+    snapshot_dir: str = ""
+    snapshot_format: str = "parquet"
+    snapshot_hour: int = 3
+    snapshot_keep_days: int = 30
+    snapshot_chunk: int = 10000
+
+    @property
+    def tz(self) -> ZoneInfo:
+        return ZoneInfo(self.timezone)
+
+    @property
+    def lang_tz(self) -> dict[str, str]:
+        pairs = (item.split("=", 1) for item in self.lang_timezones.split(",") if "=" in item)
+        return {lang.strip(): tz.strip() for lang, tz in pairs if tz.strip()}
+
+    @classmethod
+    def from_env(cls, env=None) -> "Settings":
+        env = os.environ if env is None else env
+        values = {}
+        for f in fields(cls):
+            raw = env.get(f.name.upper())
+            if raw is None or raw == "":
+                continue
+            caster = f.type if f.type in (int, float) else str
+            try:
+                values[f.name] = caster(raw)
+            except ValueError:
+                raise RuntimeError(f"Некорректное значение {f.name.upper()}={raw!r}")
+        return cls(**values)
+
+
+# -------------------- Настройки из админки --------------------
+# ключ -> тип; значения живут в таблице settings и переживают рестарт
+RUNTIME_KEYS = {
+    "pdf_url": str,
+    "reminder_interval_days": int,
+    "reminder_max_attempts": int,
+    "followup_cadence": str,
+}
+
+
+class RuntimeSettings:
+    # Кэш поверх таблицы settings. В своём процессе изменения видны сразу,
+    # изменения из других процессов подтягиваются не реже refresh_seconds.
+    def __init__(self, db_path: str, defaults: dict, refresh_seconds: float = 5.0):
+        self.db_path = db_path
+        self.defaults = dict(defaults)
+        self.refresh_seconds = refresh_seconds
+        self._values: dict = {}
+        self._loaded_at: float | None = None
+        self._listeners: list = []
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS settings (
+                key TEXT PRIMARY KEY,
+                value TEXT,
+                updated_at TEXT
+            )
+        """)
+        return conn
+
+    def _cast(self, key: str, value):
+        if key not in RUNTIME_KEYS:
+            raise KeyError(key)
+        return RUNTIME_KEYS[key](value)
+
+    def _reload(self):
+        conn = self._connect()
+        rows = conn.execute("SELECT key, value FROM settings").fetchall()
+        conn.close()
+        values = {}
+        for key, value in rows:
+            try:
+                values[key] = self._cast(key, value)
+            except (KeyError, ValueError):
+                logger.warning(f"Ignoring runtime setting {key}={value!r}")
+        changed = {}
+        if self._loaded_at is not None:
+            for k in set(values) | set(self._values):
+                if values.get(k) != self._values.get(k):
+                    changed[k] = values.get(k, self.defaults.get(k))
+        self._values = values
+        self._loaded_at = time.monotonic()
+        return changed
+
+    def get(self, key: str):
+        changed = {}
+        with self._lock:
+            if self._loaded_at is None or time.monotonic() - self._loaded_at > self.refresh_seconds:
+                changed = self._reload()
+            value = self._values.get(key, self.defaults.get(key))
+        # изменения, сделанные другим процессом
+        for k, v in changed.items():
+            self._notify(k, v)
+        return value
+
+    def all(self) -> dict:
+        return {key: self.get(key) for key in RUNTIME_KEYS}
+
+    def set(self, key: str, value):
+        value = self._cast(key, value)
+        with self._lock:
+            conn = self._connect()
+            conn.execute(
+                "INSERT OR REPLACE INTO settings (key, value, updated_at) VALUES (?, ?, ?)",
+                (key, str(value), datetime.now().isoformat()),
+            )
+            conn.commit()
+            conn.close()
+            self._values[key] = value
+        self._notify(key, value)
+        return value
+
+    def subscribe(self, callback):
+        # callback(key, value) — вызывается при каждом изменении
+        self._listeners.append(callback)
+
+    def _notify(self, key: str, value):
+        for callback in list(self._listeners):
+            try:
+                callback(key, value)
+            except Exception:
+                logger.exception("Runtime settings listener failed")
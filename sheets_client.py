@@ -0,0 +1,198 @@
+import asyncio
+import logging
+import time
+from urllib.parse import quote
+
+# aiohttp и google.auth импортируются при первом запросе, а не при импорте модуля
+
+logger = logging.getLogger("rome_estate_bot")
+
+SHEETS_API = "https://sheets.googleapis.com/v4/spreadsheets"
+SHEETS_SCOPE = "https://www.googleapis.com/auth/spreadsheets"
+
+
+class SheetsError(RuntimeError):
+    def __init__(self, status: int, message: str):
+        super().__init__(f"Sheets API {status}: {message}")
+        self.status = status
+
+
+def rowcol_to_a1(row: int, col: int) -> str:
+    letters = ""
+    while col:
+        col, rem = divmod(col - 1, 26)
+        letters = chr(65 + rem) + letters
+    return f"{letters}{row}"
+
+
+def sheets_failure(e: BaseException) -> bool:
+    # сеть, таймаут, 429 и 5xx — API недоступен; прочие 4xx — ошибка запроса, сервис отвечает
+    if isinstance(e, SheetsError):
+        return e.status == 429 or e.status >= 500
+    return isinstance(e, (asyncio.TimeoutError, OSError)) or type(e).__module__.startswith("aiohttp")
+
+
+class StaticToken:
+    # готовый токен (тесты, локальный эмулятор)
+    def __init__(self, token: str):
+        self.token = token
+
+    async def get(self, session) -> str:
+        return self.token
+
+    def invalidate(self):
+        pass
+
+
+class ServiceAccountToken:
+    # OAuth2 для сервисного аккаунта без google-auth транспорта: подписываем JWT
+    # (google.auth.crypt) и меняем его на access token через ту же aiohttp-сессию.
+    # Одновременные запросы ждут одного обмена, токен живёт до истечения минус минута.
+    def __init__(self, load_info, scopes=(SHEETS_SCOPE,), clock=time.time):
+        self.load_info = load_info  # () -> dict (JSON сервисного аккаунта)
+        self.scopes = scopes
+        self._clock = clock
+        self._token: str | None = None
+        self._expires_at = 0.0
+        self._lock = asyncio.Lock()
+        self.refreshed = 0
+
+    def _assertion(self, info: dict) -> str:
+        from google.auth import crypt, jwt
+
+        now = int(self._clock())
+        signer = crypt.RSASigner.from_service_account_info(info)
+        payload = {
+            "iss": info["client_email"],
+            "scope": " ".join(self.scopes),
+            "aud": info["token_uri"],
+            "iat": now,
+            "exp": now + 3600,
+        }
+        token = jwt.encode(signer, payload)
+        return token.decode() if isinstance(token, bytes) else token
+
+    async def get(self, session) -> str:
+        async with self._lock:
+            if self._token and self._clock() < self._expires_at - 60:
+                return self._token
+            info = self.load_info()
+            form = {
+                "grant_type": "urn:ietf:params:oauth:grant-type:jwt-bearer",
+                "assertion": self._assertion(info),
+            }
+            async with session.post(info["token_uri"], data=form) as resp:
+                data = await resp.json(content_type=None)
+                if resp.status != 200:
+                    raise SheetsError(resp.status, data.get("error_description") or data.get("error") or "token")
+            self._token = data["access_token"]
+            self._expires_at = self._clock() + int(data.get("expires_in", 3600))
+            self.refreshed += 1
+            return self._token
+
+    def invalidate(self):
+        self._token = None
+
+
+class AsyncSheetsClient:
+    # Sheets API v4 поверх aiohttp: одна сессия с пулом keep-alive соединений,
+    # пакетные values:batchUpdate / values:append, одинаковые одновременные чтения
+    # склеиваются в один запрос.
+    def __init__(self, spreadsheet_id: str, token, base_url: str = SHEETS_API,
+                 max_connections: int = 4, timeout: float = 20.0, breaker=None, session=None):
+        self.spreadsheet_id = spreadsheet_id
+        self.token = token
+        self.breaker = breaker  # CircuitBreaker: при недоступном API запросы отклоняются сразу
+        self.base_url = base_url.rstrip("/")
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self._session = session
+        # чужая (общая для нескольких ботов) сессия: не закрываем, а свой лимит соединений держим семафором
+        self._owns_session = session is None
+        self._slots = asyncio.Semaphore(max_connections) if session is not None else None
+        self._inflight: dict[str, asyncio.Future] = {}
+        self.requests = 0
+        self.coalesced = 0
+        self.errors = 0
+
+    def stats(self) -> dict:
+        return {
+            "requests": self.requests,
+            "coalesced": self.coalesced,
+            "errors": self.errors,
+            "inflight_reads": len(self._inflight),
+        }
+
+    def _get_session(self):
+        if self._owns_session and (self._session is None or self._session.closed):
+            import aiohttp
+
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.max_connections, keepalive_timeout=60),
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+            )
+        return self._session
+
+    def _url(self, path: str) -> str:
+        return f"{self.base_url}/{self.spreadsheet_id}/{path}"
+
+    async def _request(self, method: str, path: str, params: dict | None = None, body: dict | None = None) -> dict:
+        if self.breaker is not None:
+            return await self.breaker.call(self._send, method, path, params, body, is_failure=sheets_failure)
+        return await self._send(method, path, params, body)
+
+    async def _send(self, method: str, path: str, params: dict | None, body: dict | None) -> dict:
+        if self._slots is None:
+            return await self._send_once(method, path, params, body)
+        async with self._slots:
+            return await self._send_once(method, path, params, body)
+
+    async def _send_once(self, method: str, path: str, params: dict | None, body: dict | None) -> dict:
+        session = self._get_session()
+        for attempt in range(2):
+            headers = {"Authorization": f"Bearer {await self.token.get(session)}"}
+            async with session.request(method, self._url(path), params=params, json=body, headers=headers) as resp:
+                self.requests += 1
+                if resp.status == 401 and attempt == 0:
+                    # токен отозван или истёк раньше срока — получаем новый и повторяем
+                    self.token.invalidate()
+                    continue
+                data = await resp.json(content_type=None) if resp.status != 204 else {}
+                if resp.status >= 400:
+                    self.errors += 1
+                    message = (data or {}).get("error", {}) if isinstance(data, dict) else {}
+                    raise SheetsError(resp.status, message.get("message", "") if isinstance(message, dict) else str(message))
+                return data or {}
+        raise SheetsError(401, "unauthorized")
+
+    async def _coalesce(self, key: str, factory):
+        fut = self._inflight.get(key)
+        if fut is not None:
+            self.coalesced += 1
+            return await asyncio.shield(fut)
+        fut = asyncio.ensure_future(factory())
+        self._inflight[key] = fut
+        fut.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return await asyncio.shield(fut)
+
+    async def get_values(self, a1_range: str) -> list[list[str]]:
+        path = "values/" + quote(a1_range, safe="")
+        data = await self._coalesce(path, lambda: self._request("GET", path))
+        return data.get("values", [])
+
+    async def batch_update(self, data: list[dict], value_input_option: str = "USER_ENTERED") -> dict:
+        # data: [{"range": "'Leads'!E2", "values": [["True"]]}, ...] — один HTTP-запрос
+        body = {"valueInputOption": value_input_option, "data": data}
+        return await self._request("POST", "values:batchUpdate", body=body)
+
+    async def append(self, a1_range: str, rows: list[list[str]], value_input_option: str = "USER_ENTERED") -> dict:
+        path = "values/" + quote(a1_range, safe="") + ":append"
+        params = {"valueInputOption": value_input_option, "insertDataOption": "INSERT_ROWS"}
+        return await self._request("POST", path, params=params, body={"values": rows})
+
+    async def close(self):
+        if not self._owns_session:
+            return
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
@@ -0,0 +1,171 @@
+import logging
+import os
+import shutil
+import sqlite3
+import time
+from datetime import datetime, timezone
+
+logger = logging.getLogger("rome_estate_bot")
+
+FORMATS = {"parquet": "users.parquet", "arrow": "users.arrow"}
+# повторяющиеся значения: в файле хранятся словарём и индексами
+DICTIONARY_COLUMNS = ("lang", "tz", "segment", "status")
+PARTITION_PREFIX = "date="
+
+
+def lead_status(subscribed, file_sent_at, manager_contacted) -> str:
+    # стадия воронки лида — вычисляется при выгрузке, в users её нет
+    if manager_contacted:
+        return "manager"
+    if file_sent_at:
+        return "file_sent"
+    if subscribed:
+        return "subscribed"
+    return "new"
+
+
+def _timestamp(value):
+    if not value:
+        return None
+    try:
+        dt = datetime.fromisoformat(value)
+    except ValueError:
+        return None
+    return dt.replace(tzinfo=timezone.utc) if dt.tzinfo is None else dt.astimezone(timezone.utc)
+
+
+class _Dictionary:
+    # Общий словарь колонки на весь файл: новые значения дописываются в конец,
+    # поэтому пачки пишутся как дельты словаря (и Parquet, и Arrow IPC)
+    def __init__(self):
+        self.index: dict = {}
+        self.values: list = []
+
+    def encode(self, pa, column):
+        indices = []
+        for value in column:
+            if value is None:
+                indices.append(None)
+                continue
+            idx = self.index.get(value)
+            if idx is None:
+                idx = self.index[value] = len(self.values)
+                self.values.append(value)
+            indices.append(idx)
+        return pa.DictionaryArray.from_arrays(pa.array(indices, pa.int32()), pa.array(self.values, pa.string()))
+
+
+def _schema(pa, columns: list[str]):
+    ts = pa.timestamp("us", tz="UTC")
+    known = {
+        "chat_id": pa.int64(),
+        "subscribed": pa.bool_(),
+        "followup_attempts": pa.int32(),
+        "manager_contacted": pa.bool_(),
+        "last_interaction": ts,
+        "file_sent_at": ts,
+    }
+    fields = []
+    for name in [*columns, "status"]:
+        if name in DICTIONARY_COLUMNS:
+            fields.append(pa.field(name, pa.dictionary(pa.int32(), pa.string())))
+        else:
+            fields.append(pa.field(name, known.get(name, pa.string())))
+    return pa.schema(fields)
+
+
+def _batch(pa, schema, columns: list[str], rows: list[tuple], dictionaries: dict):
+    data = dict(zip(columns, map(list, zip(*rows))))
+    data["status"] = [
+        lead_status(s, f, m) for s, f, m in zip(data["subscribed"], data["file_sent_at"], data["manager_contacted"])
+    ]
+    arrays = []
+    for field in schema:
+        values = data[field.name]
+        if field.name in dictionaries:
+            arrays.append(dictionaries[field.name].encode(pa, values))
+        elif pa.types.is_timestamp(field.type):
+            arrays.append(pa.array([_timestamp(v) for v in values], field.type))
+        elif pa.types.is_boolean(field.type):
+            arrays.append(pa.array([None if v is None else bool(v) for v in values], field.type))
+        elif pa.types.is_string(field.type):
+            arrays.append(pa.array([None if v is None else str(v) for v in values], field.type))
+        else:
+            arrays.append(pa.array(values, field.type))
+    return pa.record_batch(arrays, schema=schema)
+
+
+def _open_writer(path: str, schema, fmt: str):
+    import pyarrow.ipc as ipc
+    import pyarrow.parquet as pq
+
+    if fmt == "parquet":
+        return pq.ParquetWriter(path, schema, compression="zstd")
+    return ipc.new_file(path, schema, options=ipc.IpcWriteOptions(compression="zstd", emit_dictionary_deltas=True))
+
+
+def partition_dir(out_dir: str, day: str) -> str:
+    return os.path.join(out_dir, f"{PARTITION_PREFIX}{day}")
+
+
+def export_snapshot(db_path: str, out_dir: str, day: str, fmt: str = "parquet", chunk_size: int = 10000) -> dict:
+    # Снимок users в колоночный файл out_dir/date=<day>/users.<fmt> (разбиение по дням, как в Hive).
+    # Читаем соединением только для чтения короткими пачками по chat_id: между пачками блокировок
+    # нет, и запись бота не ждёт выгрузку. Файл пишется во временный и подменяется целиком.
+    try:
+        import pyarrow as pa
+    except ImportError:
+        raise RuntimeError("Для снимков нужен pyarrow: pip install pyarrow") from None
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown snapshot format {fmt!r}, expected one of {sorted(FORMATS)}")
+
+    started = time.monotonic()
+    target_dir = partition_dir(out_dir, day)
+    os.makedirs(target_dir, exist_ok=True)
+    path = os.path.join(target_dir, FORMATS[fmt])
+    tmp_path = f"{path}.tmp"
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    rows_total = 0
+    try:
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(users)")]
+        schema = _schema(pa, columns)
+        dictionaries = {name: _Dictionary() for name in DICTIONARY_COLUMNS if name in schema.names}
+        select = f"SELECT {', '.join(columns)} FROM users WHERE chat_id > ? ORDER BY chat_id LIMIT ?"
+        chat_id_idx = columns.index("chat_id")
+        writer = _open_writer(tmp_path, schema, fmt)
+        try:
+            last = -(2 ** 63)
+            while True:
+                rows = conn.execute(select, (last, chunk_size)).fetchall()
+                if not rows:
+                    break
+                writer.write_batch(_batch(pa, schema, columns, rows, dictionaries))
+                rows_total += len(rows)
+                last = rows[-1][chat_id_idx]
+        finally:
+            writer.close()
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    finally:
+        conn.close()
+    return {
+        "day": day,
+        "path": path,
+        "rows": rows_total,
+        "size_bytes": os.path.getsize(path),
+        "seconds": round(time.monotonic() - started, 2),
+    }
+
+
+def prune_snapshots(out_dir: str, keep_days: int) -> list[str]:
+    # оставляем keep_days последних дней (0 — хранить все)
+    if keep_days <= 0 or not os.path.isdir(out_dir):
+        return []
+    days = sorted(name for name in os.listdir(out_dir) if name.startswith(PARTITION_PREFIX))
+    removed = days[:-keep_days]
+    for name in removed:
+        shutil.rmtree(os.path.join(out_dir, name), ignore_errors=True)
+    return removed
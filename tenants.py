@@ -0,0 +1,136 @@
+import copy
+import functools
+import inspect
+import json
+import logging
+import os
+from contextvars import ContextVar
+
+from settings import Settings
+
+logger = logging.getLogger("rome_estate_bot")
+
+# текущий бот (тенант) для хендлера или фоновой задачи; None — обычный режим одного бота
+_current: ContextVar["Tenant | None"] = ContextVar("tenant", default=None)
+
+
+def current_tenant() -> "Tenant | None":
+    return _current.get()
+
+
+class Tenant:
+    # Один брендированный бот в общем процессе: свои настройки, БД, шаблоны и ленивые объекты
+    # (каталог, клиент Sheets, журнал, очередь фоллоу-апов, предохранители, лимиты по чатам).
+    # Код бота обращается к ним через get_*(): пока тенант установлен в контексте, они свои.
+    def __init__(self, name: str, settings: Settings, templates: dict | None = None):
+        self.name = name
+        self.settings = settings
+        self.templates = templates
+        self.state: dict = {}
+        self.bot = None
+
+    def __repr__(self) -> str:
+        return f"Tenant({self.name!r})"
+
+    def get(self, key: str, factory):
+        value = self.state.get(key)
+        if value is None:
+            value = self.state[key] = factory()
+        return value
+
+    def activate(self):
+        return _current.set(self)
+
+    @staticmethod
+    def deactivate(token):
+        _current.reset(token)
+
+    def bind(self, fn):
+        # fn (синхронная или async) будет выполняться в контексте этого тенанта —
+        # для задач планировщика, маршрутов дашборда и шагов остановки
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def run_async(*args, **kwargs):
+                token = self.activate()
+                try:
+                    return await fn(*args, **kwargs)
+                finally:
+                    self.deactivate(token)
+            return run_async
+
+        @functools.wraps(fn)
+        def run(*args, **kwargs):
+            token = self.activate()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self.deactivate(token)
+        return run
+
+
+class TenantMiddleware:
+    # Внешний middleware на update (первым): по боту, получившему апдейт, выставляет тенанта
+    def __init__(self, tenants: list[Tenant]):
+        self.by_bot_id = {tenant.bot.id: tenant for tenant in tenants}
+
+    async def __call__(self, handler, event, data):
+        tenant = self.by_bot_id.get(data["bot"].id)
+        if tenant is None:
+            return await handler(event, data)
+        token = tenant.activate()
+        try:
+            return await handler(event, data)
+        finally:
+            tenant.deactivate(token)
+
+
+def _merge_templates(base: dict, override: dict) -> dict:
+    merged = copy.deepcopy(base)
+    for lang, texts in override.items():
+        target = merged.setdefault(lang, {})
+        for key, value in texts.items():
+            if isinstance(value, dict) and isinstance(target.get(key), dict):
+                target[key] = {**target[key], **value}
+            else:
+                target[key] = value
+    return merged
+
+
+def load_tenants(source: str, base: Settings, base_templates: dict, env=None) -> list[Tenant]:
+    # source — путь к JSON-файлу или сама JSON-строка: [{"name": ..., "bot_token": ..., ...}, ...].
+    # Ключи — имена полей Settings (как переменные окружения, в нижнем регистре) плюс "templates".
+    # Чего нет в описании тенанта — берётся из общего окружения; БД и путь вебхука — свои по имени.
+    if os.path.isfile(source):
+        with open(source, "r", encoding="utf-8") as f:
+            items = json.load(f)
+    else:
+        items = json.loads(source)
+    env = dict(os.environ if env is None else env)
+    known = set(Settings.__dataclass_fields__) - {"tenants"}
+    root, ext = os.path.splitext(base.db_path)
+    tenants, names, paths = [], set(), set()
+    for item in items:
+        item = dict(item)
+        name = str(item.pop("name", "")).strip()
+        if not name or name in names:
+            raise ValueError(f"Tenant name must be unique and non-empty: {name!r}")
+        templates = item.pop("templates", None)
+        unknown = set(item) - known
+        if unknown:
+            raise ValueError(f"Tenant {name}: unknown settings {sorted(unknown)}")
+        item.setdefault("db_path", f"{root}_{name}{ext or '.db'}")
+        item.setdefault("webhook_path", f"{base.webhook_path.rstrip('/')}/{name}")
+        if base.snapshot_dir:
+            item.setdefault("snapshot_dir", os.path.join(base.snapshot_dir, name))
+        if base.webhook_url:
+            item.setdefault("webhook_url", f"{base.webhook_url.rstrip('/')}/{name}")
+        if not item.get("bot_token"):
+            raise ValueError(f"Tenant {name}: bot_token is required")
+        if item["db_path"] in paths:
+            raise ValueError(f"Tenant {name}: db_path {item['db_path']} is already used")
+        overrides = {key.upper(): str(value) for key, value in item.items()}
+        settings = Settings.from_env({**env, **overrides})
+        tenants.append(Tenant(name, settings, _merge_templates(base_templates, templates) if templates else None))
+        names.add(name)
+        paths.add(item["db_path"])
+    return tenants
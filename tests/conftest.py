@@ -1,4 +1,5 @@
 import os
+import re
 import sys
 
 # Добавляем корень проекта в PYTHONPATH, чтобы импортировать botApp
@@ -10,3 +11,170 @@ if PROJECT_ROOT not in sys.path:
 TEST_DB = os.path.join(os.path.dirname(__file__), "test.db")
 os.environ.setdefault("DB_PATH", TEST_DB)
 
+
+import pytest
+
+SHEET_HEADER = [
+    "chat_id", "username", "first_name", "date_joined", "subscribed",
+    "last_message", "file_sent", "followup_attempts", "manager_contacted",
+]
+_A1 = re.compile(r"^([A-Z]*)(\d*)(?::([A-Z]*)(\d*))?$")
+
+
+def _col(letters: str) -> int | None:
+    if not letters:
+        return None
+    n = 0
+    for ch in letters:
+        n = n * 26 + ord(ch) - 64
+    return n
+
+
+class FakeSheets:
+    # Минимальный Sheets API v4 в памяти: values.get, values:batchUpdate, values:append
+    def __init__(self, token: str = "test-token"):
+        self.token = token
+        self.sheets = {"Leads": [SHEET_HEADER[:]]}
+        self.calls: list[tuple[str, str]] = []
+        self.peers: set = set()
+        self.down = False
+        self.client = None
+
+    @property
+    def rows(self) -> list[list[str]]:
+        return self.sheets["Leads"]
+
+    def _parse(self, rng: str):
+        if rng.startswith("'"):
+            end = rng.index("'", 1)
+            title, rest = rng[1:end], rng[end + 1:]
+        else:
+            title, _, rest = rng.partition("!")
+            rest = "!" + rest if rest else ""
+        a1 = rest[1:] if rest.startswith("!") else rest
+        m = _A1.match(a1)
+        c1, r1, c2, r2 = m.group(1), m.group(2), m.group(3), m.group(4)
+        if m.group(3) is None:
+            # одна ячейка "E2" или пусто — весь лист
+            c2, r2 = c1, r1
+        return (
+            self.sheets.setdefault(title, []),
+            int(r1) if r1 else None, int(r2) if r2 else None,
+            _col(c1), _col(c2),
+        )
+
+    def _error(self, status: int, message: str):
+        from aiohttp import web
+        return web.json_response({"error": {"code": status, "message": message}}, status=status)
+
+    def _check(self, request, kind: str):
+        self.calls.append((request.method, kind))
+        self.peers.add(request.transport.get_extra_info("peername") if request.transport else None)
+        if self.down:
+            return self._error(503, "The service is currently unavailable.")
+        if request.headers.get("Authorization") != f"Bearer {self.token}":
+            return self._error(401, "Request had invalid authentication credentials.")
+        return None
+
+    async def _get(self, request):
+        from aiohttp import web
+        error = self._check(request, "get")
+        if error:
+            return error
+        grid, r1, r2, c1, c2 = self._parse(request.match_info["rng"])
+        rows = grid[(r1 or 1) - 1:(r2 or len(grid))]
+        values = [row[(c1 or 1) - 1:(c2 or len(row))] for row in rows]
+        while values and not any(values[-1]):
+            values.pop()
+        return web.json_response({"range": request.match_info["rng"], "values": values})
+
+    async def _batch_update(self, request):
+        from aiohttp import web
+        error = self._check(request, "batchUpdate")
+        if error:
+            return error
+        body = await request.json()
+        for item in body["data"]:
+            grid, r1, _, c1, _ = self._parse(item["range"])
+            while len(grid) < r1:
+                grid.append([])
+            row = grid[r1 - 1]
+            while len(row) < c1:
+                row.append("")
+            row[c1 - 1] = item["values"][0][0]
+        return web.json_response({"totalUpdatedCells": len(body["data"])})
+
+    async def _append(self, request):
+        from aiohttp import web
+        rng = request.match_info["rng"]
+        if not rng.endswith(":append"):
+            return self._error(404, "not found")
+        error = self._check(request, "append")
+        if error:
+            return error
+        grid = self._parse(rng[: -len(":append")])[0]
+        body = await request.json()
+        grid.extend([str(v) for v in row] for row in body["values"])
+        return web.json_response({"updates": {"updatedRows": len(body["values"])}})
+
+    def app(self):
+        from aiohttp import web
+        app = web.Application()
+        app.router.add_post("/v4/spreadsheets/{sid}/values:batchUpdate", self._batch_update)
+        app.router.add_get("/v4/spreadsheets/{sid}/values/{rng:.+}", self._get)
+        app.router.add_post("/v4/spreadsheets/{sid}/values/{rng:.+}", self._append)
+        return app
+
+
+@pytest.fixture(autouse=True)
+async def fake_sheets(monkeypatch):
+    # у каждого теста свой фейковый Sheets API на локальном порту:
+    # записи одного теста не попадают в проверки другого
+    import botApp
+    from aiohttp.test_utils import TestServer
+    from sheets_client import AsyncSheetsClient, StaticToken
+
+    fake = FakeSheets()
+    server = TestServer(fake.app())
+    await server.start_server()
+    fake.client = AsyncSheetsClient(
+        "test-sheet", StaticToken(fake.token), base_url=str(server.make_url("/v4/spreadsheets")),
+    )
+    monkeypatch.setattr(botApp, "_sheets_client", fake.client)
+    # предохранители тоже свои у каждого теста: ошибки одного теста не размыкают цепь в другом
+    monkeypatch.setattr(botApp, "_breakers", {})
+    monkeypatch.setattr(botApp, "_sheet_write_lock", None)
+    yield fake
+    await fake.client.close()
+    await server.close()
+
+
+# всё, что привязано к файлу БД, — создаётся заново для нового файла
+DB_BOUND = ("_runtime", "_catalog", "_outbox_drainer", "_segment_index")
+
+
+def use_db(monkeypatch, db_path: str, **settings):
+    import dataclasses
+
+    import botApp
+
+    monkeypatch.setattr(botApp, "_settings", dataclasses.replace(botApp.get_settings(), db_path=db_path, **settings))
+    for name in DB_BOUND:
+        monkeypatch.setattr(botApp, name, None)
+
+
+@pytest.fixture
+def db_settings():
+    # дополнительные настройки для isolated_db; модуль переопределяет фикстуру, если нужно
+    return {}
+
+
+@pytest.fixture
+def isolated_db(tmp_path, monkeypatch, db_settings):
+    # отдельная БД на тест: тяжёлые операции не трогают общую tests/test.db
+    import botApp
+
+    db_path = str(tmp_path / "bot.db")
+    use_db(monkeypatch, db_path, admin_chat_id=42, **db_settings)
+    botApp.init_db()
+    return db_path
@@ -0,0 +1,31 @@
+import json
+
+from benchmarks.compare import compare, load, main
+
+
+def write_run(path, medians):
+    path.write_text(json.dumps({"benchmarks": [
+        {"fullname": name, "stats": {"median": median, "mean": median}} for name, median in medians.items()
+    ]}), encoding="utf-8")
+    return str(path)
+
+
+def test_compare_statuses():
+    baseline = {"a": {"median": 1.0}, "b": {"median": 1.0}, "c": {"median": 1.0}, "gone": {"median": 1.0}}
+    current = {"a": {"median": 1.1}, "b": {"median": 1.5}, "c": {"median": 0.5}, "added": {"median": 1.0}}
+    rows = {row["name"]: row for row in compare(baseline, current, threshold=0.2)}
+    # +10% в пределах порога, +50% — регрессия
+    assert rows["a"]["status"] == "ok"
+    assert rows["b"]["status"] == "regression" and round(rows["b"]["change"], 2) == 0.5
+    assert rows["c"]["status"] == "faster"
+    assert rows["gone"]["status"] == "missing" and rows["added"]["status"] == "new"
+
+
+def test_main_exit_code(tmp_path, capsys):
+    baseline = write_run(tmp_path / "base.json", {"storage::get_user": 0.0001})
+    same = write_run(tmp_path / "same.json", {"storage::get_user": 0.000105})
+    slow = write_run(tmp_path / "slow.json", {"storage::get_user": 0.0002})
+    assert load(baseline) == {"storage::get_user": {"median": 0.0001, "mean": 0.0001}}
+    assert main([baseline, same]) == 0
+    assert main([baseline, slow, "--threshold", "0.5"]) == 1
+    assert "REGRESSION" in capsys.readouterr().out
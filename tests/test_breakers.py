@@ -0,0 +1,225 @@
+from datetime import datetime, timedelta
+
+import pytest
+from aiogram import Bot
+from aiogram.exceptions import TelegramForbiddenError, TelegramNetworkError
+from aiogram.methods import GetMe, GetUpdates
+
+import botApp
+from breakers import CircuitBreaker, CircuitOpenError, TelegramBreakerMiddleware
+from followups import FollowupQueue
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+async def _ok():
+    return "ok"
+
+
+async def _boom():
+    raise ConnectionError("down")
+
+
+@pytest.mark.asyncio
+async def test_breaker_opens_on_failure_rate_and_probes():
+    clock = Clock()
+    breaker = CircuitBreaker("dep", failure_rate=0.5, min_calls=4, window=60, open_seconds=30, clock=clock)
+
+    # 1 ошибка из 3 — мало вызовов, цепь замкнута
+    await breaker.call(_ok)
+    await breaker.call(_ok)
+    with pytest.raises(ConnectionError):
+        await breaker.call(_boom)
+    assert breaker.state == "closed"
+    # 2 из 4 — порог 50% достигнут
+    with pytest.raises(ConnectionError):
+        await breaker.call(_boom)
+    assert breaker.state == "open"
+
+    # разомкнута: вызов отклоняется сразу, функция не вызывается
+    called = []
+
+    async def tracked():
+        called.append(1)
+
+    with pytest.raises(CircuitOpenError) as err:
+        await breaker.call(tracked)
+    assert called == [] and err.value.retry_in == 30
+    assert breaker.snapshot()["rejected"] == 1
+
+    # после паузы — один пробный вызов; неудачная проба снова размыкает
+    clock.now += 30
+    assert breaker.state == "half_open"
+    assert breaker.allow() is True
+    assert breaker.allow() is False
+    breaker.record_failure("still down")
+    assert breaker.state == "open" and breaker.opened == 2
+
+    # удачная проба замыкает цепь и очищает окно
+    clock.now += 30
+    assert await breaker.call(_ok) == "ok"
+    assert breaker.state == "closed"
+    assert breaker.snapshot()["calls"] == 0
+
+
+@pytest.mark.asyncio
+async def test_old_failures_leave_window_and_client_errors_do_not_count():
+    clock = Clock()
+    breaker = CircuitBreaker("dep", failure_rate=0.5, min_calls=2, window=10, open_seconds=5, clock=clock)
+    with pytest.raises(ConnectionError):
+        await breaker.call(_boom)
+    clock.now += 11
+    await breaker.call(_ok)
+    assert breaker.state == "closed"
+
+    # ошибки запроса (is_failure=False) — зависимость отвечает, цепь не размыкается
+    for _ in range(5):
+        with pytest.raises(ValueError):
+            async def bad_request():
+                raise ValueError("400")
+            await breaker.call(bad_request, is_failure=lambda e: not isinstance(e, ValueError))
+    assert breaker.state == "closed"
+
+
+@pytest.mark.asyncio
+async def test_sheets_fail_fast_when_api_down(fake_sheets, isolated_db):
+    fake_sheets.client.breaker = botApp.get_breaker("sheets")
+    fake_sheets.down = True
+    for _ in range(5):
+        with pytest.raises(Exception):
+            await fake_sheets.client.get_values("'Leads'!A1")
+    assert botApp.get_breaker("sheets").state == "open"
+    calls = len(fake_sheets.calls)
+
+    # журнал не дёргает недоступный API: пачка возвращается в очередь без HTTP-запроса
+    botApp.update_user_fields(77, sheet={"subscribed": True})
+    drainer = botApp.get_outbox_drainer()
+    with pytest.raises(CircuitOpenError):
+        await drainer.run_once()
+    assert len(fake_sheets.calls) == calls
+    assert drainer.outbox.pending() >= 1
+    assert "🔴 sheets: open" in botApp.breakers_report()
+
+
+@pytest.mark.asyncio
+async def test_telegram_session_middleware():
+    breaker = CircuitBreaker("telegram", min_calls=2, failure_rate=0.5)
+    bot = Bot("42:TEST")
+    bot.session.middleware(TelegramBreakerMiddleware(breaker))
+    requests = []
+
+    async def make_request(bot, method, timeout=None):
+        requests.append(type(method).__name__)
+        if isinstance(method, GetMe):
+            raise TelegramNetworkError(method=method, message="timeout")
+        raise TelegramForbiddenError(method=method, message="bot was blocked by the user")
+
+    bot.session.make_request = make_request
+    # пользователь заблокировал бота — это не недоступность Bot API
+    for _ in range(3):
+        with pytest.raises(TelegramForbiddenError):
+            await bot.send_message(1, "hi")
+    assert breaker.state == "closed"
+
+    for _ in range(3):
+        with pytest.raises(TelegramNetworkError):
+            await bot.get_me()
+    assert breaker.state == "open"
+    with pytest.raises(CircuitOpenError):
+        await bot.get_me()
+    # getUpdates не отклоняется: polling сам служит пробой
+    with pytest.raises(TelegramForbiddenError):
+        await bot(GetUpdates())
+    assert requests.count("GetMe") == 3 and requests[-1] == "GetUpdates"
+    await bot.session.close()
+
+
+@pytest.mark.asyncio
+async def test_brochure_fast_fallback_when_drive_open(isolated_db):
+    drive = botApp.get_breaker("drive")
+    for _ in range(drive.min_calls):
+        drive.record_failure("drive timeout")
+    assert drive.state == "open"
+
+    class Dummy:
+        def __init__(self):
+            self.sent = []
+
+        async def answer(self, text, reply_markup=None):
+            self.sent.append(("text", text))
+
+        async def answer_document(self, document, **kwargs):
+            self.sent.append(("doc", document))
+
+    catalog = botApp.get_catalog()
+    default = catalog.resolve("*", "default")
+    catalog.set_file_id(default["id"], None)
+    doc = {"id": -1, "url": "http://drive/x.pdf", "filename": "x.pdf", "file_id": None}
+
+    # кэша нет — сразу контакт менеджера, без загрузки по ссылке
+    dummy = Dummy()
+    assert await botApp.send_brochure(dummy, doc) is False
+    assert dummy.sent[0][0] == "text" and "менеджер" in dummy.sent[0][1]
+
+    # базовая брошюра в кэше Telegram — отправляем её
+    catalog.set_file_id(default["id"], "cached-file-id")
+    dummy = Dummy()
+    await botApp.send_brochure(dummy, doc)
+    assert dummy.sent == [("doc", "cached-file-id")]
+    catalog.set_file_id(default["id"], None)
+
+
+@pytest.mark.asyncio
+async def test_followup_requeued_while_telegram_open(monkeypatch, isolated_db):
+    queue = FollowupQueue()
+    monkeypatch.setattr(botApp.followup_dispatcher, "queue", queue)
+    telegram = botApp.get_breaker("telegram")
+    for _ in range(telegram.min_calls):
+        telegram.record_failure("network")
+
+    class FakeBot:
+        async def send_message(self, *args, **kwargs):
+            raise AssertionError("Bot API не должен вызываться")
+
+    chat_id = 4242
+    botApp.upsert_user(chat_id, "t", "T")
+    sent_at = (datetime.now(botApp.TZ) - timedelta(days=3)).isoformat()
+    botApp.update_user_fields(chat_id, file_sent_at=sent_at, last_interaction=sent_at, followup_attempts=0)
+
+    await botApp.async_followup_job(chat_id, bot=FakeBot())
+    # попытка не потрачена, напоминание снова в очереди
+    assert botApp.get_user(chat_id)["followup_attempts"] == 0
+    assert chat_id in queue
+
+
+@pytest.mark.asyncio
+async def test_admin_health_shows_breakers(monkeypatch):
+    import dataclasses
+
+    monkeypatch.setattr(botApp, "_settings", dataclasses.replace(botApp.get_settings(), admin_chat_id=42))
+
+    class FakeBot:
+        session = type("S", (), {"close": staticmethod(lambda: _ok())})()
+
+        async def get_me(self):
+            return type("Me", (), {"username": "test_bot"})()
+
+    monkeypatch.setattr(botApp, "Bot", lambda token=None: FakeBot())
+    replies = []
+
+    class DummyMessage:
+        from_user = type("U", (), {"id": 42})()
+
+        async def reply(self, text):
+            replies.append(text)
+
+    await botApp.admin_health(DummyMessage())
+    assert replies[0].startswith("OK: @test_bot")
+    for name in botApp.BREAKER_NAMES:
+        assert f"🟢 {name}: closed" in replies[0]
@@ -0,0 +1,70 @@
+from types import SimpleNamespace as NS
+
+import pytest
+from aiogram import Dispatcher
+
+import botApp
+
+
+pytestmark = pytest.mark.usefixtures("isolated_db")
+
+
+def _event(user_id, status, chat_id=None, **extra):
+    chat_id = botApp.get_settings().channel_id if chat_id is None else chat_id
+    member = NS(status=status, user=NS(id=user_id), **extra)
+    return NS(chat=NS(id=chat_id), new_chat_member=member)
+
+
+class CountingBot:
+    def __init__(self, status="member"):
+        self.status = status
+        self.calls = 0
+
+    async def get_chat_member(self, chat_id, user_id):
+        self.calls += 1
+        return NS(status=self.status)
+
+
+def test_router_requests_chat_member_updates():
+    dp = Dispatcher()
+    dp.include_router(botApp.router)
+    assert "chat_member" in dp.resolve_used_update_types()
+
+
+@pytest.mark.asyncio
+async def test_events_maintain_flag_and_sheet():
+    botApp.upsert_user(10, "u", "f")
+    await botApp.on_channel_member(_event(10, "member"))
+    assert botApp.get_user(10)["subscribed"] == 1
+    await botApp.on_channel_member(_event(10, "restricted", is_member=True))
+    await botApp.on_channel_member(_event(10, "left"))
+    assert botApp.get_user(10)["subscribed"] == 0
+
+    items = botApp.get_outbox_drainer().outbox.batch(10)
+    assert [(i.chat_id, i.values) for i in items] == [(10, {"subscribed": "False"})]
+
+    # чужой чат и не-лиды игнорируются
+    await botApp.on_channel_member(_event(10, "member", chat_id=-100999))
+    await botApp.on_channel_member(_event(11, "member"))
+    assert botApp.get_user(10)["subscribed"] == 0
+    assert botApp.get_user(11) is None
+
+
+@pytest.mark.asyncio
+async def test_subscription_check_is_local_after_event():
+    botApp.upsert_user(20, "u", "f")
+    bot = CountingBot(status="member")
+    await botApp.on_channel_member(_event(20, "member"))
+    for _ in range(3):
+        assert await botApp.is_subscribed(bot, 20)
+    assert bot.calls == 0
+
+    # без отметки — один вызов API, дальше локально
+    botApp.upsert_user(21, "u", "f")
+    assert await botApp.is_subscribed(bot, 21)
+    assert await botApp.is_subscribed(bot, 21)
+    assert bot.calls == 1
+
+    # отписка по событию — следующая проверка снова спрашивает Telegram
+    await botApp.on_channel_member(_event(21, "kicked"))
+    assert not await botApp.is_subscribed(CountingBot(status="left"), 21)
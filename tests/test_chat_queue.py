@@ -0,0 +1,117 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from chat_queue import ChatSerializer
+
+
+def _data(user_id=None, chat_id=None):
+    data = {}
+    if user_id is not None:
+        data["event_from_user"] = SimpleNamespace(id=user_id)
+    if chat_id is not None:
+        data["event_chat"] = SimpleNamespace(id=chat_id)
+    return data
+
+
+@pytest.mark.asyncio
+async def test_same_chat_sequential_other_chats_parallel():
+    serializer = ChatSerializer(limit=10)
+    log = []
+    running = {"now": 0, "max": 0}
+
+    async def handler(event, data):
+        running["now"] += 1
+        running["max"] = max(running["max"], running["now"])
+        log.append(("start", event))
+        # медленный вызов (Sheets/Telegram) у первого апдейта чата
+        await asyncio.sleep(0.05 if event[1] == 0 else 0.001)
+        log.append(("end", event))
+        running["now"] -= 1
+        return event
+
+    tasks = [
+        asyncio.create_task(serializer(handler, (chat, n), _data(user_id=chat)))
+        for n in range(3) for chat in (1, 2, 3)
+    ]
+    results = await asyncio.gather(*tasks)
+    assert sorted(results) == sorted((chat, n) for n in range(3) for chat in (1, 2, 3))
+
+    # внутри чата: следующий апдейт стартует только после завершения предыдущего, в порядке получения
+    for chat in (1, 2, 3):
+        events = [(kind, n) for kind, (c, n) in log if c == chat]
+        assert events == [("start", 0), ("end", 0), ("start", 1), ("end", 1), ("start", 2), ("end", 2)]
+    # разные чаты — параллельно
+    assert running["max"] == 3
+    # слоты чатов освобождены
+    assert serializer.stats()["chats"] == 0
+    assert serializer.stats()["max_waiting"] == 2
+
+
+@pytest.mark.asyncio
+async def test_concurrency_limit_does_not_block_on_waiting_chats():
+    serializer = ChatSerializer(limit=2)
+    release = asyncio.Event()
+    started = []
+
+    async def handler(event, data):
+        started.append(event)
+        if event == "slow":
+            await release.wait()
+        return event
+
+    # два апдейта одного чата: второй ждёт очереди чата, но не занимает общий слот
+    slow = asyncio.create_task(serializer(handler, "slow", _data(user_id=1)))
+    queued = asyncio.create_task(serializer(handler, "queued", _data(user_id=1)))
+    other = asyncio.create_task(serializer(handler, "other", _data(user_id=2)))
+    await asyncio.sleep(0.01)
+    assert started == ["slow", "other"]
+    assert serializer.stats()["running"] == 1 and serializer.stats()["waiting"] == 1
+
+    release.set()
+    assert await asyncio.gather(slow, queued, other) == ["slow", "queued", "other"]
+
+
+@pytest.mark.asyncio
+async def test_limit_and_keyless_updates():
+    serializer = ChatSerializer(limit=2)
+    gate = asyncio.Event()
+    active = {"now": 0, "max": 0}
+
+    async def handler(event, data):
+        active["now"] += 1
+        active["max"] = max(active["max"], active["now"])
+        await gate.wait()
+        active["now"] -= 1
+
+    # апдейты без пользователя и чата тоже подчиняются общему лимиту
+    tasks = [asyncio.create_task(serializer(handler, i, _data(chat_id=i) if i % 2 else {})) for i in range(6)]
+    await asyncio.sleep(0.01)
+    assert active["now"] == 2
+    gate.set()
+    await asyncio.gather(*tasks)
+    assert active["max"] == 2
+
+
+@pytest.mark.asyncio
+async def test_handler_error_releases_chat():
+    serializer = ChatSerializer(limit=4)
+
+    async def failing(event, data):
+        raise RuntimeError("boom")
+
+    async def ok(event, data):
+        return "ok"
+
+    with pytest.raises(RuntimeError):
+        await serializer(failing, None, _data(user_id=5))
+    assert await serializer(ok, None, _data(user_id=5)) == "ok"
+    assert serializer.stats() == {"limit": 4, "running": 0, "chats": 0, "waiting": 0, "max_waiting": 0}
+
+
+def test_user_key_wins_over_channel():
+    # chat_member в канале: ключ — лид, а не канал, чтобы события разных лидов не вставали в одну очередь
+    assert ChatSerializer.chat_key(_data(user_id=7, chat_id=-100)) == 7
+    assert ChatSerializer.chat_key(_data(chat_id=-100)) == -100
+    assert ChatSerializer.chat_key({}) is None
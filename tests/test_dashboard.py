@@ -0,0 +1,118 @@
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+
+import botApp
+from dashboard import Dashboard
+
+TOKEN = "secret"
+
+
+@pytest.fixture(autouse=True)
+def leads(isolated_db):
+    for chat_id in range(1, 8):
+        botApp.upsert_user(chat_id, f"u{chat_id}", "f")
+    botApp.update_user_fields(2, subscribed=1, file_sent_at="2024-01-01T10:00:00", followup_attempts=1)
+    botApp.update_user_fields(3, subscribed=1, manager_contacted=1)
+
+
+async def _client(dashboard: Dashboard) -> TestClient:
+    app = web.Application()
+    dashboard.add_routes(app)
+    client = TestClient(TestServer(app))
+    await client.start_server()
+    return client
+
+
+@pytest.mark.asyncio
+async def test_summary_cached_with_etag():
+    dashboard = Dashboard(botApp._dashboard_summary, botApp._dashboard_leads, TOKEN, ttl=60)
+    client = await _client(dashboard)
+    try:
+        resp = await client.get("/dashboard/summary")
+        assert resp.status == 401
+
+        headers = {"Authorization": f"Bearer {TOKEN}"}
+        resp = await client.get("/dashboard/summary", headers=headers)
+        assert resp.status == 200
+        data = await resp.json()
+        assert data["funnel"] == {
+            "leads": 7, "subscribed": 2, "project_requested": 1, "followup_sent": 1, "manager_contacted": 1,
+        }
+        assert "outbox_pending" in data["sheets"]
+        etag = resp.headers["ETag"]
+
+        # повторные запросы в пределах ttl — из готовой сводки, без SQL
+        for _ in range(5):
+            resp = await client.get("/dashboard/summary", headers={**headers, "If-None-Match": etag})
+            assert resp.status == 304
+            assert await resp.read() == b""
+        assert dashboard.computed == 1
+        assert dashboard.not_modified == 5
+    finally:
+        await client.close()
+
+
+@pytest.mark.asyncio
+async def test_etag_stable_until_data_changes():
+    now = [0.0]
+    dashboard = Dashboard(botApp._dashboard_summary, botApp._dashboard_leads, TOKEN, ttl=10, clock=lambda: now[0])
+    body1, etag1 = await dashboard.summary()
+    now[0] = 11
+    body2, etag2 = await dashboard.summary()
+    # пересчитали, но данные те же — тот же ETag и то же тело
+    assert dashboard.computed == 2
+    assert (body1, etag1) == (body2, etag2)
+    botApp.update_user_fields(4, subscribed=1)
+    now[0] = 22
+    _, etag3 = await dashboard.summary()
+    assert etag3 != etag1
+
+
+@pytest.mark.asyncio
+async def test_runtime_stats_do_not_change_etag(monkeypatch):
+    lag = [1.0]
+
+    class Monitor:
+        def stats(self):
+            lag[0] += 1
+            return {"lag_ms": lag[0]}
+
+    monkeypatch.setattr(botApp, "get_loop_monitor", lambda: Monitor())
+    now = [0.0]
+    dashboard = Dashboard(botApp._dashboard_summary, botApp._dashboard_leads, TOKEN, ttl=10,
+                          clock=lambda: now[0], collect_runtime=botApp._dashboard_runtime)
+    _, etag1 = await dashboard.summary()
+    now[0] = 11
+    _, etag2 = await dashboard.summary()
+    # задержка цикла изменилась, данные — нет
+    assert etag1 == etag2
+    client = await _client(dashboard)
+    try:
+        resp = await client.get(f"/dashboard/runtime?token={TOKEN}")
+        assert resp.status == 200 and "ETag" not in resp.headers
+        data = await resp.json()
+        assert data["loop"]["lag_ms"] == lag[0]
+        assert data["dashboard"]["computed"] == 2 and "api_calls" in data and "sheets_client" in data
+    finally:
+        await client.close()
+
+
+@pytest.mark.asyncio
+async def test_leads_keyset_pagination():
+    dashboard = Dashboard(botApp._dashboard_summary, botApp._dashboard_leads, TOKEN)
+    client = await _client(dashboard)
+    try:
+        seen, after = [], 0
+        while after is not None:
+            resp = await client.get(f"/dashboard/leads?after={after}&limit=3&token={TOKEN}")
+            assert resp.status == 200
+            page = await resp.json()
+            seen += [item["chat_id"] for item in page["items"]]
+            after = page["next_after"]
+        assert seen == list(range(1, 8))
+
+        resp = await client.get(f"/dashboard/leads?after=x&token={TOKEN}")
+        assert resp.status == 400
+    finally:
+        await client.close()
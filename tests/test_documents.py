@@ -0,0 +1,115 @@
+import asyncio
+import dataclasses
+
+import pytest
+
+import botApp
+from documents import DocumentCatalog
+
+
+class Doc:
+    def __init__(self, file_id):
+        self.file_id = file_id
+
+
+class Sent:
+    def __init__(self, file_id, message_id=1):
+        self.document = Doc(file_id)
+        self.message_id = message_id
+
+
+class FakeBot:
+    def __init__(self):
+        self.uploads = []
+        self.deleted = []
+        self.active = 0
+        self.peak = 0
+
+    async def send_document(self, chat_id, document, **kwargs):
+        self.active += 1
+        self.peak = max(self.peak, self.active)
+        await asyncio.sleep(0.01)
+        self.active -= 1
+        self.uploads.append(document.url)
+        return Sent(f"fid:{document.url}", message_id=len(self.uploads))
+
+    async def delete_message(self, chat_id, message_id):
+        self.deleted.append(message_id)
+
+
+class Msg:
+    def __init__(self, user_id=1):
+        self.from_user = type("U", (), {"id": user_id})()
+        self.calls = []
+
+    async def answer(self, text, reply_markup=None):
+        self.calls.append(("text", text))
+
+    async def answer_document(self, document, **kwargs):
+        self.calls.append(("doc", document))
+        if isinstance(document, str):
+            return Sent(document)
+        return Sent(f"fid:{document.url}")
+
+
+@pytest.fixture
+def catalog(monkeypatch, tmp_path):
+    cat = DocumentCatalog(str(tmp_path / "docs.db"))
+    cat.ensure_schema(seed_url="http://all.pdf")
+    monkeypatch.setattr(botApp, "_catalog", cat)
+    return cat
+
+
+def test_resolve_fallback_and_versions(catalog):
+    # общий документ из PDF_URL для всех языков
+    assert catalog.resolve("th")["url"] == "http://all.pdf"
+    ru = catalog.publish("http://ru1.pdf", lang="ru")
+    catalog.publish("http://ru-vip.pdf", lang="ru", segment="vip")
+    assert catalog.resolve("ru")["url"] == "http://ru1.pdf"
+    assert catalog.resolve("ru", "vip")["url"] == "http://ru-vip.pdf"
+    assert catalog.resolve("en", "vip")["url"] == "http://all.pdf"
+    # новая версия заменяет старую, повтор той же ссылки версию не плодит
+    ru2 = catalog.publish("http://ru2.pdf", lang="ru")
+    assert (ru["version"], ru2["version"]) == (1, 2)
+    assert catalog.publish("http://ru2.pdf", lang="ru")["id"] == ru2["id"]
+    assert catalog.resolve("ru")["url"] == "http://ru2.pdf"
+
+
+@pytest.mark.asyncio
+async def test_prewarm_uploads_in_parallel(monkeypatch, catalog):
+    for lang in ("ru", "en", "th"):
+        catalog.publish(f"http://{lang}.pdf", lang=lang)
+    monkeypatch.setattr(botApp, "_settings", dataclasses.replace(botApp.get_settings(), admin_chat_id=42))
+    bot = FakeBot()
+
+    report = await botApp.prewarm_documents(bot)
+    assert report == {"uploaded": 4, "failed": 0}
+    assert bot.peak > 1
+    assert len(bot.deleted) == 4
+    assert catalog.stats()["cached"] == 4
+    # повторный прогрев ничего не загружает
+    assert await botApp.prewarm_documents(bot) == {"uploaded": 0, "failed": 0}
+
+
+@pytest.mark.asyncio
+async def test_send_brochure_uses_file_id_then_recovers(catalog):
+    doc = catalog.publish("http://en.pdf", lang="en")
+    catalog.set_file_id(doc["id"], "cached-id")
+
+    msg = Msg()
+    assert await botApp.send_brochure(msg, catalog.resolve("en")) is True
+    # один лёгкий вызов по file_id
+    assert msg.calls == [("doc", "cached-id")]
+    assert catalog.hits == 1
+
+    # устаревший file_id: откат на URL, новый file_id сохраняется
+    class Stale(Msg):
+        async def answer_document(self, document, **kwargs):
+            if isinstance(document, str):
+                raise RuntimeError("wrong file identifier")
+            return await super().answer_document(document, **kwargs)
+
+    msg = Stale()
+    assert await botApp.send_brochure(msg, catalog.resolve("en")) is True
+    assert catalog.misses == 1
+    assert catalog.resolve("en")["file_id"] == "fid:http://en.pdf"
@@ -1,34 +1,173 @@
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 from freezegun import freeze_time
 
-from botApp import schedule_followup, update_user_fields, init_db, upsert_user
+import pytest
 
+from botApp import schedule_followup, update_user_fields, upsert_user
+from followups import Cadence, FollowupQueue, FollowupDispatcher
 
-def setup_function():
-    init_db()
+
+pytestmark = pytest.mark.usefixtures("isolated_db")
 
 
 @freeze_time("2025-01-01 10:00:00")
 def test_schedule_followup_sets_time(monkeypatch):
-    # заглушим add_job, чтобы не создавать реальную задачу
-    calls = {}
-    def fake_add_job(func, trigger, args, id, replace_existing, misfire_grace_time):
-        calls["id"] = id
-        calls["run_date"] = trigger.run_date
-        calls["args"] = args
-        return None
-
     import botApp
-    # гарантируем, что функция schedule_followup вызовет наш хук
-    monkeypatch.setattr(botApp.scheduler, "add_job", fake_add_job, raising=True)
+    # отдельная очередь, чтобы не зависеть от других тестов
+    queue = FollowupQueue()
+    monkeypatch.setattr(botApp.followup_dispatcher, "queue", queue)
 
     chat_id = 999
     # создаём пользователя, иначе schedule_followup завершится ранее
     upsert_user(chat_id, "test", "User")
-    update_user_fields(chat_id, followup_attempts=0)
+    # on_project: PDF выдан сейчас — от этого момента отсчитываются все шаги
+    update_user_fields(chat_id, followup_attempts=0, file_sent_at=botApp._now().isoformat())
     schedule_followup(chat_id, initial=True)
 
-    # убедимся, что add_job был вызван
-    assert "args" in calls and calls["args"] == [chat_id]
-    assert isinstance(calls["run_date"], datetime)
+    # срок в очереди: через reminder_interval_days, первый шаг каденции
+    due, step = queue.get(chat_id)
+    assert step == 0
+    assert isinstance(due, datetime)
+    interval = botApp.get_runtime().get("reminder_interval_days")
+    assert due == datetime(2025, 1, 1, 10, tzinfo=timezone.utc) + timedelta(days=interval)
+
+
+@freeze_time("2025-01-01 10:00:00")
+def test_next_step_due_matches_restore(monkeypatch):
+    import botApp
+    queue = FollowupQueue()
+    monkeypatch.setattr(botApp.followup_dispatcher, "queue", queue)
+    cadence = Cadence.from_config('{"steps": [{"delay_hours": 2}, {"delay_hours": 24}, {"delay_hours": 48}]}')
+    monkeypatch.setattr(botApp, "get_cadence", lambda: cadence)
+
+    chat_id = 997
+    upsert_user(chat_id, "test", "User")
+    sent_at = datetime(2025, 1, 1, 6, tzinfo=timezone.utc)
+    # первый фоллоу-ап ушёл с опозданием, сейчас 10:00
+    update_user_fields(chat_id, file_sent_at=sent_at.isoformat(), followup_attempts=1)
+    schedule_followup(chat_id)
+    scheduled, step = queue.get(chat_id)
+    assert step == 1 and scheduled == sent_at + timedelta(hours=26)
+
+    # после рестарта — тот же срок
+    queue = FollowupQueue()
+    monkeypatch.setattr(botApp.followup_dispatcher, "queue", queue)
+    botApp.restore_followups()
+    assert queue.get(chat_id) == (scheduled, 1)
+
+
+@pytest.mark.asyncio
+async def test_late_step_keeps_its_delay_after_send(monkeypatch):
+    import botApp
+    queue = FollowupQueue()
+    monkeypatch.setattr(botApp.followup_dispatcher, "queue", queue)
+    cadence = Cadence.from_config('{"steps": [{"delay_hours": 24}, {"delay_hours": 24}], "quiet_hours": [0, 0]}')
+    monkeypatch.setattr(botApp, "get_cadence", lambda: cadence)
+
+    class FakeBot:
+        async def send_message(self, chat_id, text, reply_markup=None):
+            pass
+
+    chat_id = 996
+    upsert_user(chat_id, "test", "User")
+    # PDF выдан 5 дней назад: по якорю оба шага давно просрочены (бот стоял)
+    sent_at = (botApp._now() - timedelta(days=5)).isoformat()
+    update_user_fields(chat_id, file_sent_at=sent_at, last_interaction=sent_at,
+                       followup_attempts=0, tz="America/New_York")
+    before = botApp._now()
+    await botApp.async_followup_job(chat_id, bot=FakeBot())
+    # второй шаг — через свою паузу после фактической отправки, а не через 10 секунд
+    due, step = queue.get(chat_id)
+    assert step == 1 and due >= before + timedelta(hours=24)
+
+
+def test_cadence_from_config_and_quiet_hours():
+    from zoneinfo import ZoneInfo
+    cadence = Cadence.from_config(
+        '{"steps": [{"delay_hours": 2}, {"delay_days": 1, "template": "fallback_question"}],'
+        ' "quiet_hours": [22, 8]}'
+    )
+    assert cadence.max_attempts == 2
+    assert cadence.steps[1].template == "fallback_question"
+
+    tz = ZoneInfo("Asia/Bangkok")  # UTC+7
+    anchor = datetime(2025, 1, 1, 12, tzinfo=timezone.utc)  # 19:00 у лида
+    due = cadence.due_at(anchor, 0)  # 21:00 у лида — не тихие часы
+    assert cadence.adjust_quiet(due, tz) == due
+    late = cadence.due_at(anchor, 1)  # +1 день +2 часа → 21:00 следующего дня
+    assert cadence.adjust_quiet(late, tz) == late
+    night = datetime(2025, 1, 1, 17, tzinfo=timezone.utc)  # 00:00 у лида
+    moved = cadence.adjust_quiet(night, tz)
+    assert moved.astimezone(tz).hour == 8 and moved.astimezone(tz).day == 2
+
+
+def test_queue_handles_many_leads_in_order():
+    import random
+    queue = FollowupQueue()
+    base = datetime(2025, 1, 1, tzinfo=timezone.utc)
+    n = 100_000
+    offsets = list(range(n))
+    random.Random(1).shuffle(offsets)
+    for chat_id, off in enumerate(offsets):
+        queue.push(chat_id, base + timedelta(seconds=off), None)
+    # перенос и удаление не ломают порядок
+    queue.push(0, base + timedelta(seconds=n + 10), "moved")
+    queue.remove(1)
+    assert len(queue) == n - 1
+
+    due_ts = (base + timedelta(seconds=999)).timestamp()
+    popped = []
+    while True:
+        batch = queue.pop_due(due_ts, limit=100)
+        if not batch:
+            break
+        popped.extend(batch)
+    expected = sorted(
+        (off, cid) for cid, off in enumerate(offsets) if off <= 999 and cid not in (0, 1)
+    )
+    assert [cid for cid, _ in popped] == [cid for _, cid in expected]
+
+
+@pytest.mark.asyncio
+async def test_dispatcher_sends_due_in_batches():
+    now = [1000.0]
+    queue = FollowupQueue()
+    batches = []
+
+    async def handler(batch):
+        batches.append([key for key, _ in batch])
+
+    disp = FollowupDispatcher(queue, handler, batch_size=2, clock=lambda: now[0])
+    at = lambda ts: datetime.fromtimestamp(ts, tz=timezone.utc)
+    for key, ts in [("a", 900), ("b", 950), ("c", 990), ("d", 2000)]:
+        disp.schedule(key, at(ts))
+    assert await disp.run_once() == 3
+    assert batches == [["a", "b"], ["c"]]
+    assert "d" in queue
+
+
+@pytest.mark.asyncio
+async def test_followup_job_uses_user_language(monkeypatch):
+    import botApp
+    from templates import TEMPLATES
+
+    queue = FollowupQueue()
+    monkeypatch.setattr(botApp.followup_dispatcher, "queue", queue)
+
+    class FakeBot:
+        def __init__(self):
+            self.sent = []
+        async def send_message(self, chat_id, text, reply_markup=None):
+            self.sent.append((chat_id, text))
+
+    chat_id = 998
+    upsert_user(chat_id, "test", "User")
+    sent_at = (datetime.now(botApp.TZ) - timedelta(days=3)).isoformat()
+    update_user_fields(chat_id, lang="en", file_sent_at=sent_at, last_interaction=sent_at, followup_attempts=0)
 
+    bot = FakeBot()
+    await botApp.async_followup_job(chat_id, bot=bot)
+    # раньше уходил TEMPLATES["followup"] (KeyError) — теперь текст на языке лида
+    assert bot.sent == [(chat_id, TEMPLATES["en"]["followup"])]
+    assert botApp.get_user(chat_id)["followup_attempts"] == 1
+    assert chat_id in queue
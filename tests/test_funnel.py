@@ -0,0 +1,215 @@
+import dataclasses
+from datetime import datetime
+
+import pytest
+from aiogram import Bot, Dispatcher, F, Router
+from aiogram.filters import CommandStart
+from aiogram.methods import AnswerCallbackQuery, EditMessageText, SendMessage, TelegramMethod
+from aiogram.types import Chat, Message, Update
+
+import botApp
+from documents import DocumentCatalog
+from funnel import FunnelMeter, count_api_calls, format_funnel
+
+LEAD = 501
+
+
+@pytest.fixture
+def funnel(isolated_db, monkeypatch, tmp_path):
+    cat = DocumentCatalog(str(tmp_path / "docs.db"))
+    cat.ensure_schema(seed_url="http://all.pdf")
+    doc = cat.publish("http://en.pdf", lang="en")
+    cat.set_file_id(doc["id"], "cached-id")
+    monkeypatch.setattr(botApp, "_catalog", cat)
+    monkeypatch.setattr(botApp, "_funnel_meter", None)
+
+    async def subscribed(bot, chat_id):
+        return True
+
+    monkeypatch.setattr(botApp, "is_subscribed", subscribed)
+
+    def configure(**fields):
+        cfg = dataclasses.replace(botApp.get_settings(), admin_chat_id=42, **fields)
+        monkeypatch.setattr(botApp, "_settings", cfg)
+
+    configure(funnel_compact=0, webhook_reply=0)
+    return configure
+
+
+def _user(user_id):
+    return {"id": user_id, "is_bot": False, "first_name": "Lead", "username": "lead"}
+
+
+def _message(update_id, text, user_id=LEAD):
+    return Update.model_validate({
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id, "date": 1700000000, "text": text,
+            "chat": {"id": user_id, "type": "private"}, "from": _user(user_id),
+        },
+    })
+
+
+def _callback(update_id, data, user_id=LEAD):
+    return Update.model_validate({
+        "update_id": update_id,
+        "callback_query": {
+            "id": f"cb{update_id}", "chat_instance": "ci", "data": data, "from": _user(user_id),
+            "message": {
+                "message_id": 1, "date": 1700000000, "text": "меню",
+                "chat": {"id": user_id, "type": "private"},
+                "from": {"id": 42, "is_bot": True, "first_name": "Bot"},
+            },
+        },
+    })
+
+
+async def run_funnel(monkeypatch, user_id=LEAD):
+    # путь лида /start → язык → проверка подписки → «проект» через диспетчер; сеть — фейковая
+    router = Router()
+    router.message.register(botApp.on_start, CommandStart())
+    router.callback_query.register(botApp.on_set_lang, F.data.startswith("lang:"))
+    router.callback_query.register(botApp.on_check_sub, F.data == "check_sub")
+    router.message.register(botApp.on_project, F.text == "проект")
+    dp = Dispatcher()
+    dp.update.outer_middleware(botApp._meter_funnel)
+    dp.include_router(router)
+    bot = Bot("42:TEST")
+    bot.session.middleware(count_api_calls)
+    requests = []
+
+    async def fake_request(bot, method, timeout=None):
+        requests.append(method)
+        if isinstance(method, AnswerCallbackQuery):
+            return True
+        return Message(message_id=len(requests), date=datetime.now(), chat=Chat(id=user_id, type="private"))
+
+    monkeypatch.setattr(bot.session, "make_request", fake_request)
+    inline = []
+    updates = [_message(1, "/start", user_id), _callback(2, "lang:en", user_id),
+               _callback(3, "check_sub", user_id), _message(4, "проект", user_id)]
+    for update in updates:
+        result = await dp.feed_update(bot, update)
+        if isinstance(result, TelegramMethod):
+            inline.append(result)
+    await bot.session.close()
+    return requests, inline
+
+
+@pytest.mark.asyncio
+async def test_classic_funnel_call_count(funnel, monkeypatch):
+    requests, inline = await run_funnel(monkeypatch)
+    names = [type(m).__name__ for m in requests]
+    # /start, язык (ack + правка), подписка («проверяем», ack, «подписаны»), текст + брошюра
+    assert names == ["SendMessage", "AnswerCallbackQuery", "EditMessageText",
+                     "SendMessage", "AnswerCallbackQuery", "SendMessage", "SendMessage", "SendDocument"]
+    assert not inline
+    stats = botApp.get_funnel_meter().stats()
+    assert stats["calls"] == 8 and stats["entries"] == 1 and stats["conversions"] == 1
+    assert stats["calls_per_conversion"] == 8
+
+
+@pytest.mark.asyncio
+async def test_compact_funnel_call_count(funnel, monkeypatch):
+    funnel(funnel_compact=1)
+    requests, inline = await run_funnel(monkeypatch)
+    names = [type(m).__name__ for m in requests]
+    assert names == ["SendMessage", "AnswerCallbackQuery", "EditMessageText",
+                     "AnswerCallbackQuery", "EditMessageText", "SendDocument"]
+    # результат подписки — правкой того же сообщения, брошюра — с текстом в подписи
+    assert requests[4].text == botApp.get_templates()["en"]["subscribed_ok"]
+    assert requests[5].document == "cached-id"
+    assert requests[5].caption == botApp.get_templates()["en"]["pdf_sent"]
+    assert botApp.get_funnel_meter().stats()["calls_per_conversion"] == 6
+
+
+@pytest.mark.asyncio
+async def test_compact_funnel_with_webhook_reply(funnel, monkeypatch):
+    funnel(funnel_compact=1, webhook_reply=1, webhook_url="https://bot.example/hook")
+    requests, inline = await run_funnel(monkeypatch)
+    # исходящие — только подтверждения кнопок и брошюра, остальное в ответе на вебхук
+    assert [type(m).__name__ for m in requests] == ["AnswerCallbackQuery", "AnswerCallbackQuery", "SendDocument"]
+    assert [type(m) for m in inline] == [SendMessage, EditMessageText, EditMessageText]
+    stats = botApp.get_funnel_meter().stats()
+    assert stats["calls"] == 3 and stats["inline"] == 3
+
+
+@pytest.mark.asyncio
+async def test_long_caption_falls_back_to_text(funnel, monkeypatch):
+    funnel(funnel_compact=1)
+    templates = botApp.get_templates()
+    monkeypatch.setitem(templates["en"], "pdf_sent", "x" * (botApp.CAPTION_LIMIT + 1))
+    requests, _ = await run_funnel(monkeypatch)
+    assert [type(m).__name__ for m in requests[-2:]] == ["SendMessage", "SendDocument"]
+    assert requests[-1].caption is None
+
+
+@pytest.mark.asyncio
+async def test_admin_updates_are_not_counted(funnel, monkeypatch):
+    await run_funnel(monkeypatch, user_id=42)
+    stats = botApp.get_funnel_meter().stats()
+    assert stats["calls"] == 0 and stats["entries"] == 0
+
+
+@pytest.mark.asyncio
+async def test_calls_outside_update_are_not_counted():
+    meter = FunnelMeter()
+    sent = []
+
+    async def make_request(bot, method):
+        sent.append(method)
+        return True
+
+    # фоновая задача (фоллоу-ап) — не в контексте апдейта
+    await count_api_calls(make_request, None, SendMessage(chat_id=1, text="hi"))
+    assert sent and meter.stats()["calls"] == 0
+
+    async def handler(event, data):
+        await count_api_calls(make_request, None, SendMessage(chat_id=1, text="hi"))
+        return AnswerCallbackQuery(callback_query_id="1")
+
+    await meter(handler, None, {})
+    assert meter.stats()["by_method"] == {"SendMessage": 1} and meter.stats()["inline"] == 1
+    meter.reset()
+    assert meter.stats()["calls"] == 0 and meter.stats()["calls_per_entry"] is None
+
+
+@pytest.mark.asyncio
+async def test_admin_funnel_command(funnel):
+    replies = []
+    meter = botApp.get_funnel_meter()
+    meter.entries = meter.conversions = 1
+    meter.record("SendMessage")
+    meter.record("SendDocument")
+
+    class DummyMessage:
+        from_user = type("U", (), {"id": 42})()
+        text = "/funnel"
+
+        async def reply(self, text):
+            replies.append(text)
+
+    await botApp.admin_funnel(DummyMessage())
+    assert replies[0] == "Воронка: классическая\n" + format_funnel(meter.stats())
+    assert "на конверсию: 2.0" in replies[0]
+
+    DummyMessage.text = "/funnel reset"
+    await botApp.admin_funnel(DummyMessage())
+    assert meter.stats()["calls"] == 0 and replies[1] == "Счётчики воронки сброшены."
+
+
+@pytest.mark.asyncio
+async def test_failed_brochure_is_not_a_conversion(funnel, monkeypatch):
+    funnel(funnel_compact=1)
+
+    async def no_brochure(message, doc, caption=None):
+        await message.answer("Не удалось отправить PDF. Свяжитесь с менеджером 👇")
+        return False
+
+    monkeypatch.setattr(botApp, "send_brochure", no_brochure)
+    requests, _ = await run_funnel(monkeypatch)
+    # брошюра не ушла: последним остаётся контакт менеджера, без «подборка готова»; конверсии нет
+    assert requests[-1].text.startswith("Не удалось отправить PDF")
+    assert all(getattr(m, "text", None) != botApp.get_templates()["en"]["pdf_sent"] for m in requests)
+    stats = botApp.get_funnel_meter().stats()
+    assert stats["entries"] == 1 and stats["conversions"] == 0
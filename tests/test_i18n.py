@@ -40,8 +40,7 @@ def _inline_texts(markup) -> list[str]:
     return texts
 
 
-def setup_function():
-    botApp.init_db()
+pytestmark = pytest.mark.usefixtures("isolated_db")
 
 
 @pytest.mark.asyncio
@@ -124,11 +123,6 @@ def test_greeting_keyboard_localized():
 
 @pytest.mark.asyncio
 async def test_fallback_localized_all_langs(monkeypatch):
-    # заглушим запись в шиты в хендлере on_any_message
-    async def noop(*a, **k):
-        return None
-    monkeypatch.setattr(botApp, "gs_update_by_chat_id", noop)
-
     for lang in ("ru", "en", "th"):
         uid = {"ru": 201, "en": 202, "th": 203}[lang]
         botApp.upsert_user(uid, "u", "f")
@@ -146,3 +140,20 @@ async def test_fallback_localized_all_langs(monkeypatch):
         assert (got == expected) or (got in any_lang_first)
 
 
+
+
+@pytest.mark.asyncio
+async def test_language_choice_sets_lead_timezone():
+    for user_id in (103, 104, 105):
+        botApp.upsert_user(user_id, "u", "f")
+    # пояс из импорта точнее языка — остаётся
+    botApp.update_user_fields(105, tz="Asia/Dubai")
+
+    await botApp.on_set_lang(DummyCallback(103, data="lang:th"))
+    await botApp.on_set_lang(DummyCallback(104, data="lang:en"))
+    await botApp.on_set_lang(DummyCallback(105, data="lang:ru"))
+    assert botApp.get_user(103)["tz"] == "Asia/Bangkok"
+    # для en пояса нет — тихие часы по TIMEZONE
+    assert botApp.get_user(104)["tz"] is None
+    assert botApp._user_tz(botApp.get_user(104)) == botApp.get_settings().tz
+    assert botApp.get_user(105)["tz"] == "Asia/Dubai"
@@ -0,0 +1,104 @@
+import csv
+import sqlite3
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
+
+import pytest
+
+import botApp
+from followups import FollowupQueue
+from importer import import_leads, read_csv, rows_from_values
+
+
+pytestmark = pytest.mark.usefixtures("isolated_db")
+
+
+def _write_csv(path, rows):
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        w = csv.writer(f)
+        w.writerow(["chat_id", "username", "first_name", "subscribed", "file_sent", "followup_attempts", "extra"])
+        w.writerows(rows)
+
+
+def test_csv_import_batches_and_merges(tmp_path):
+    # существующий лид: пустые ячейки источника не затирают его данные
+    botApp.upsert_user(1, "old", "Old")
+    botApp.update_user_fields(1, lang="en", last_message="project_requested")
+
+    path = tmp_path / "leads.csv"
+    rows = [[i, f"u{i}", "F", "TRUE" if i % 2 else "FALSE", "2024-01-01T10:00:00", i % 3, "x"] for i in range(1, 5001)]
+    rows[0][2] = ""                       # first_name у лида 1 пустой
+    rows.append(["not-a-number", "", "", "", "", "", ""])
+    rows.append(["", "", "", "", "", "", ""])
+    _write_csv(path, rows)
+
+    header, it = read_csv(str(path))
+    report = import_leads(header, it, botApp.DB_PATH, batch_size=1000, tz=ZoneInfo("Asia/Bangkok"))
+    assert report["read"] == 5002
+    assert report["skipped"] == 2
+    assert report["inserted"] == 4999 and report["updated"] == 1
+    assert report["batches"] == 5
+    assert report["rows_per_second"] > 0
+
+    u1 = botApp.get_user(1)
+    assert (u1["username"], u1["first_name"], u1["lang"]) == ("u1", "Old", "en")
+    assert u1["subscribed"] == 1 and u1["file_sent_at"] == "2024-01-01T10:00:00+07:00"
+    assert botApp.get_user(2)["subscribed"] == 0
+    assert botApp.get_user(3)["followup_attempts"] == 0
+
+
+def test_naive_timestamps_get_bot_timezone(tmp_path, monkeypatch):
+    queue = FollowupQueue()
+    monkeypatch.setattr(botApp.followup_dispatcher, "queue", queue)
+    path = tmp_path / "leads.csv"
+    _write_csv(path, [[1, "a", "A", "yes", "2024-05-01 10:00:00", 0, ""],
+                      [2, "b", "B", "yes", "вчера", 0, ""]])
+    assert botApp.import_main([str(path)]) == 0
+    # время без пояса — в поясе бота (TIMEZONE), нераспознанное не пишется, лид остаётся
+    sent = botApp.get_user(1)["file_sent_at"]
+    assert sent == datetime(2024, 5, 1, 10, tzinfo=botApp.get_settings().tz).isoformat()
+    assert botApp.get_user(2)["file_sent_at"] is None and botApp.get_user(2)["username"] == "b"
+
+    botApp.restore_followups()
+    assert queue.get(1)[1] == 0
+
+    # строка без пояса, записанная в обход импорта: /force_followup не падает
+    botApp.update_user_fields(1, file_sent_at="2024-05-01 10:00:00")
+    botApp.schedule_followup(1)
+    due, _ = queue.get(1)
+    assert due > datetime.now(timezone.utc) - timedelta(seconds=1)
+
+
+def test_import_restores_journal_mode(tmp_path):
+    db_path = str(tmp_path / "plain.db")
+    conn = sqlite3.connect(db_path)
+    conn.execute("CREATE TABLE users (chat_id INTEGER PRIMARY KEY, username TEXT)")
+    conn.close()
+    # режим журнала хранится в файле: после импорта — прежний, а не WAL
+    import_leads(["chat_id", "username"], iter([["1", "a"]]), db_path)
+    conn = sqlite3.connect(db_path)
+    assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "delete"
+    assert conn.execute("SELECT username FROM users").fetchall() == [("a",)]
+    conn.close()
+
+
+def test_import_cli(tmp_path, capsys):
+    path = tmp_path / "leads.csv"
+    _write_csv(path, [[9, "c", "C", "yes", "", "", ""]])
+    assert botApp.import_main([str(path), "--batch-size", "1"]) == 0
+    assert "Добавлено: 1" in capsys.readouterr().out
+    assert botApp.get_user(9)["subscribed"] == 1
+
+
+@pytest.mark.asyncio
+async def test_import_from_sheet(fake_sheets):
+    fake_sheets.rows.extend([
+        ["7", "a", "A", "2024-01-01", "True", "project_requested", "2024-01-02", "1", "False"],
+        ["8", "b", "B", "2024-01-01", "False", "", "", "0", "True"],
+    ])
+    header, rows = rows_from_values(await botApp._sheet_lead_values())
+    report = import_leads(header, rows, botApp.DB_PATH)
+    assert report["inserted"] == 2
+    u7, u8 = botApp.get_user(7), botApp.get_user(8)
+    assert u7["file_sent_at"] == "2024-01-02T00:00:00+00:00" and u7["subscribed"] == 1
+    assert u8["manager_contacted"] == 1
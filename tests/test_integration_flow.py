@@ -4,40 +4,8 @@ import botApp
 
 
 @pytest.mark.asyncio
-async def test_flow_start_check_project(monkeypatch):
-    # 1) Sheets стабы
-    class WS:
-        def __init__(self):
-            self.rows = []
-            self._header = [
-                "chat_id","username","first_name","date_joined","subscribed",
-                "last_message","file_sent","followup_attempts","manager_contacted"
-            ]
-        def append_row(self, row, value_input_option=None):
-            self.rows.append(row)
-        def row_values(self, i):
-            return self._header
-        def find(self, value):
-            raise Exception("not found")
-        @property
-        def spreadsheet(self):
-            class S:
-                def values_batch_update(self, body):
-                    pass
-            return S()
-
-    class GC:
-        def __init__(self):
-            self.ws = WS()
-        def open_by_key(self, key):
-            class S:
-                def __init__(self, ws):
-                    self._ws = ws
-                def worksheet(self, name):
-                    return self._ws
-            return S(self.ws)
-
-    monkeypatch.setattr(botApp, "_build_gspread_client", lambda: GC())
+async def test_flow_start_check_project(monkeypatch, isolated_db):
+    # 1) Sheets — фейковый сервер из conftest (фикстура fake_sheets)
 
     # 2) Telegram get_chat_member всегда member
     async def ok_member(chat_id, user_id):
@@ -0,0 +1,71 @@
+import re
+import time
+
+import pytest
+
+import botApp
+from intents import Intent, normalize
+
+
+def test_normalize_homoglyphs_and_case():
+    assert normalize("  ПРОЕКТ  ") == "проект"
+    # кириллическая «о» в латинском слове и латинская «t» в русском
+    assert normalize("prоekt") == "proekt"
+    assert normalize("проекt") == "проект"
+    assert normalize("Hello   World") == "hello world"
+
+
+def test_keywords_match_project_regex_variants():
+    clf = botApp.intent_classifier
+    ok = ["проект", "Проект", "  ПРОЕКТ  ", "proekt", "project", "prоekt", "проекта", "Project", "โปรเจกต์"]
+    for s in ok:
+        assert clf.classify(s) == Intent("keyword", "project"), s
+    for s in ["про", "projectX", "random", "мой проект", ""]:
+        assert clf.classify(s).kind == "text", s
+    # старое выражение и классификатор согласны на общих примерах
+    for s in ok[:7] + ["про", "projectX", "random"]:
+        assert (re.match(botApp.PROJECT_RE, s) is not None) == (clf.classify(s).kind == "keyword"), s
+
+
+def test_commands_take_precedence():
+    clf = botApp.intent_classifier
+    assert clf.classify("/health") == Intent("command", "health")
+    assert clf.classify("/Health@RomeEstateBot") == Intent("command", "health")
+    assert clf.classify("/manager_contacted 42 off") == Intent("command", "manager_contacted", "42 off")
+    assert clf.classify("/set pdf_url http://x") == Intent("command", "set", "pdf_url http://x")
+    assert clf.classify("/settings") == Intent("command", "settings")
+    # неизвестная команда — в общий fallback
+    assert clf.classify("/unknown").kind == "text"
+
+
+@pytest.mark.asyncio
+async def test_on_message_routes_admin_command(monkeypatch):
+    called = []
+
+    async def fake_health(message):
+        called.append("health")
+
+    async def fake_any(message):
+        called.append("fallback")
+
+    monkeypatch.setitem(botApp.MESSAGE_COMMANDS, "health", fake_health)
+    monkeypatch.setattr(botApp, "on_any_message", fake_any)
+
+    class Msg:
+        text = "/health"
+
+    await botApp.on_message(Msg(), bot=None)
+    Msg.text = "просто вопрос"
+    await botApp.on_message(Msg(), bot=None)
+    assert called == ["health", "fallback"]
+
+
+def test_routing_cost_micro_benchmark():
+    clf = botApp.intent_classifier
+    sample = ["проект", "/health", "Здравствуйте, сколько стоит вилла?", "project", "/export_leads", "ok"] * 5000
+    t0 = time.perf_counter()
+    for text in sample:
+        clf.classify(text)
+    per_msg_us = (time.perf_counter() - t0) / len(sample) * 1e6
+    print(f"intent routing: {per_msg_us:.2f} µs/message")
+    assert per_msg_us < 200
@@ -0,0 +1,90 @@
+import asyncio
+import sqlite3
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import botApp
+from followups import FollowupQueue
+from lifecycle import InflightTracker, Lifecycle
+
+
+pytestmark = pytest.mark.usefixtures("isolated_db")
+
+
+@pytest.mark.asyncio
+async def test_inflight_tracker_waits_for_handlers():
+    tracker = InflightTracker()
+    release = asyncio.Event()
+
+    async def handler(event, data):
+        await release.wait()
+        return "done"
+
+    task = asyncio.create_task(tracker(handler, object(), {}))
+    await asyncio.sleep(0)
+    assert tracker.active == 1
+    assert not await tracker.wait_idle(0.05)
+
+    release.set()
+    assert await tracker.wait_idle(1)
+    assert await task == "done"
+    assert tracker.active == 0 and tracker.handled == 1
+
+
+@pytest.mark.asyncio
+async def test_lifecycle_runs_all_steps_within_deadline():
+    order = []
+
+    async def slow(remaining):
+        order.append("slow")
+        await asyncio.sleep(10)
+
+    async def fast(remaining):
+        order.append(("fast", remaining >= 0.05))
+
+    lc = Lifecycle(deadline=0.2, min_step=0.05)
+    lc.add_step("slow", slow)
+    lc.add_step("fast", fast)
+    report = await lc.shutdown()
+    # медленный шаг обрезан дедлайном, следующий всё равно выполнен
+    assert report["slow"] == "timeout"
+    assert report["fast"].startswith("ok")
+    assert order == ["slow", ("fast", True)]
+
+
+def test_checkpoint_restores_exact_due_and_spreads_overdue(monkeypatch):
+    queue = FollowupQueue()
+    monkeypatch.setattr(botApp.followup_dispatcher, "queue", queue)
+
+    now = datetime.now(timezone.utc)
+    # лид с напоминанием в будущем — сохраняем точный срок через чекпоинт
+    botApp.upsert_user(501, "u", "f")
+    botApp.update_user_fields(501, file_sent_at=now.isoformat(), followup_attempts=0)
+    exact = now + timedelta(hours=5, minutes=17)
+    queue.push(501, exact, 0)
+    # много просроченных — после рестарта не должны уйти одной пачкой
+    old = (now - timedelta(days=30)).isoformat()
+    for chat_id in range(600, 650):
+        botApp.upsert_user(chat_id, "u", "f")
+        botApp.update_user_fields(chat_id, file_sent_at=old, followup_attempts=0)
+
+    assert botApp.checkpoint_followups() == 1
+
+    restored = FollowupQueue()
+    monkeypatch.setattr(botApp.followup_dispatcher, "queue", restored)
+    botApp.restore_followups()
+
+    due, step = restored.get(501)
+    assert step == 0
+    assert abs(due.timestamp() - exact.timestamp()) < 1e-3
+
+    overdue = sorted(restored.get(c)[0].timestamp() for c in range(600, 650))
+    assert len(overdue) == 50
+    assert overdue[-1] - overdue[0] >= 10  # разнесены во времени
+    assert overdue[0] > now.timestamp()
+
+    # чекпоинт одноразовый
+    conn = sqlite3.connect(botApp.DB_PATH)
+    assert conn.execute("SELECT COUNT(*) FROM followup_checkpoint").fetchone()[0] == 0
+    conn.close()
@@ -0,0 +1,123 @@
+import dataclasses
+from datetime import datetime, timezone
+
+import pytest
+
+import botApp
+from memdiag import MemoryTracker, crossed, open_client_sessions, rss_bytes
+
+
+_leak = []
+
+
+def leaky_cache():
+    # имитация кэша, который растёт между снимками
+    _leak.extend(bytearray(1024) for _ in range(2000))
+
+
+def test_tracker_diff_points_to_growing_line():
+    tracker = MemoryTracker(frames=5)
+    try:
+        first = tracker.report()
+        assert "базовый снимок" in first and tracker.tracing
+        leaky_cache()
+        report = tracker.report()
+        top = report.splitlines()[2]
+        # больше всего выросло в leaky_cache
+        assert "test_memdiag.py" in top and top.startswith("+")
+    finally:
+        tracker.stop()
+        _leak.clear()
+    assert not tracker.tracing
+
+
+@pytest.mark.asyncio
+async def test_open_sessions_counted():
+    import aiohttp
+
+    before = open_client_sessions()
+    session = aiohttp.ClientSession()
+    assert open_client_sessions() == before + 1
+    await session.close()
+    assert open_client_sessions() == before
+    assert rss_bytes() > 0
+
+
+def test_crossed_skips_disabled_thresholds():
+    gauges = {"rss_mb": 600, "scheduler_jobs": 5, "client_sessions": 50}
+    assert crossed(gauges, {"rss_mb": 512, "scheduler_jobs": 1000, "client_sessions": 0}) == ["rss_mb = 600 (порог 512)"]
+
+
+@pytest.mark.asyncio
+async def test_memory_check_alerts_once_per_crossing(monkeypatch):
+    cfg = dataclasses.replace(botApp.get_settings(), admin_chat_id=42, memory_alert_rss_mb=1)
+    monkeypatch.setattr(botApp, "_settings", cfg)
+    monkeypatch.setattr(botApp, "_memory_alerted", set())
+
+    class FakeBot:
+        def __init__(self):
+            self.sent = []
+
+        async def send_message(self, chat_id, text):
+            self.sent.append((chat_id, text))
+
+    bot = FakeBot()
+    gauges = botApp.memory_gauges()
+    assert {"rss_mb", "scheduler_jobs", "followup_queue", "client_sessions", "executor_queue"} <= set(gauges)
+
+    assert (await botApp.async_memory_check(bot))[0].startswith("rss_mb")
+    assert bot.sent[0][0] == 42 and "rss_mb" in bot.sent[0][1]
+    # порог всё ещё превышен — повторно не шлём
+    assert await botApp.async_memory_check(bot) == []
+    assert len(bot.sent) == 1
+
+    # вернулись ниже порога, затем снова выше — новое уведомление
+    monkeypatch.setattr(botApp, "_settings", dataclasses.replace(cfg, memory_alert_rss_mb=10 ** 6))
+    await botApp.async_memory_check(bot)
+    monkeypatch.setattr(botApp, "_settings", cfg)
+    await botApp.async_memory_check(bot)
+    assert len(bot.sent) == 2
+
+
+@pytest.mark.asyncio
+async def test_admin_memory_command(monkeypatch):
+    monkeypatch.setattr(botApp, "_settings", dataclasses.replace(botApp.get_settings(), admin_chat_id=42))
+    replies = []
+
+    class DummyMessage:
+        from_user = type("U", (), {"id": 42})()
+        text = "/memory"
+
+        async def reply(self, text):
+            replies.append(text)
+
+    try:
+        await botApp.admin_memory(DummyMessage())
+        await botApp.admin_memory(DummyMessage())
+        assert "rss_mb:" in replies[0] and "базовый снимок" in replies[0]
+        assert "Рост с прошлого снимка" in replies[1]
+        DummyMessage.text = "/memory stop"
+        await botApp.admin_memory(DummyMessage())
+        assert replies[-1] == "tracemalloc выключен."
+    finally:
+        botApp.memory_tracker.stop()
+
+
+def test_gauges_sum_over_tenants(tmp_path, monkeypatch):
+    import json
+
+    from tenants import load_tenants
+
+    base = dataclasses.replace(botApp.get_settings(), db_path=str(tmp_path / "bot.db"))
+    items = [{"name": "rome", "bot_token": "111:aaa"}, {"name": "milan", "bot_token": "222:bbb"}]
+    tenants = load_tenants(json.dumps(items), base, botApp.TEMPLATES)
+    monkeypatch.setattr(botApp, "_tenants", tenants)
+    now = datetime.now(timezone.utc)
+    for tenant, keys in zip(tenants, ((1, 2), (3,))):
+        queue = tenant.bind(botApp.get_followup_dispatcher)().queue
+        for key in keys:
+            queue.push(key, now)
+    # очередь тенанта, а не неиспользуемая глобальная
+    gauges = botApp.memory_gauges()
+    assert gauges["followup_queue"] == 3 and gauges["followup_heap"] == 3
+    assert gauges["sheets_inflight_reads"] == 0 and gauges["dashboard_cache_kb"] == 0
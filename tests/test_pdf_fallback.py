@@ -1,11 +1,12 @@
 import pytest
 from aioresponses import aioresponses
 
-from botApp import on_project, PDF_URL
+import botApp
+from botApp import on_project
 
 
 @pytest.mark.asyncio
-async def test_pdf_fallback_download(monkeypatch):
+async def test_pdf_fallback_download(monkeypatch, isolated_db):
     class Dummy:
         def __init__(self):
             self.sent = []
@@ -25,7 +26,6 @@ async def test_pdf_fallback_download(monkeypatch):
     async def ok_member(chat_id, user_id):
         class M: status = "member"
         return M()
-    import botApp
     monkeypatch.setattr(botApp.Bot, "get_chat_member", staticmethod(ok_member))
 
     # 1) сломаем отправку по URL — бросим исключение
@@ -35,7 +35,7 @@ async def test_pdf_fallback_download(monkeypatch):
 
     # 2) поднимем aioresponses: успешная загрузка
     with aioresponses() as m:
-        m.get(PDF_URL, status=200, body=b"%PDF-1.4 test")
+        m.get(botApp.PDF_URL, status=200, body=b"%PDF-1.4 test")
         # вызовем обработчик
         await on_project(dummy, bot=None)  # bot не используется после заглушек
 
@@ -0,0 +1,92 @@
+import asyncio
+import dataclasses
+import threading
+import time
+
+import pytest
+
+import botApp
+from profiler import LoopLagMonitor, format_collapsed, sample_stacks, top_frames
+
+
+def blocking_handler(seconds):
+    # синхронный вызов в хендлере (как sqlite3 или чтение файла) — цикл стоит
+    time.sleep(seconds)
+
+
+@pytest.mark.asyncio
+async def test_monitor_reports_stall_with_stack():
+    monitor = LoopLagMonitor(threshold=0.1, interval=0.02)
+    monitor.start()
+    try:
+        await asyncio.sleep(0.1)
+        blocking_handler(0.3)
+        await asyncio.sleep(0.1)
+    finally:
+        await monitor.stop()
+
+    stats = monitor.stats()
+    assert stats["stalls"] == 1
+    assert stats["max_ms"] >= 250
+    # стек снят во время зависания и указывает на виновника
+    assert "blocking_handler (test_profiler.py" in monitor.last_stall["stack"]
+    assert "test_monitor_reports_stall_with_stack" in monitor.last_stall["task"]
+
+
+@pytest.mark.asyncio
+async def test_monitor_quiet_loop_has_no_stalls():
+    monitor = LoopLagMonitor(threshold=0.2, interval=0.01)
+    monitor.start()
+    await asyncio.sleep(0.15)
+    await monitor.stop()
+    stats = monitor.stats()
+    assert stats["stalls"] == 0 and stats["last_stall"] is None
+    assert stats["p99_ms"] < 200
+
+
+def test_sampler_collapsed_output():
+    stop = threading.Event()
+
+    def busy_worker():
+        while not stop.is_set():
+            sum(range(1000))
+
+    thread = threading.Thread(target=busy_worker, name="busy")
+    thread.start()
+    try:
+        stacks, samples = sample_stacks(0.2, interval=0.002)
+    finally:
+        stop.set()
+        thread.join()
+
+    assert samples > 10
+    text = format_collapsed(stacks)
+    line = next(line for line in text.splitlines() if line.startswith("busy;"))
+    # формат flamegraph: кадры через ";" и число срезов в конце
+    frames, count = line.rsplit(" ", 1)
+    assert "busy_worker (test_profiler.py" in frames and int(count) > 0
+    assert any(frame.startswith("busy_worker") for frame, _ in top_frames(stacks, limit=10))
+
+
+@pytest.mark.asyncio
+async def test_admin_profile_sends_document(monkeypatch):
+    monkeypatch.setattr(botApp, "_settings", dataclasses.replace(botApp.get_settings(), admin_chat_id=42, profile_max_seconds=1))
+    replies, documents = [], []
+
+    class DummyMessage:
+        text = "/profile 30"
+        from_user = type("U", (), {"id": 42})()
+
+        async def reply(self, text):
+            replies.append(text)
+
+        async def answer_document(self, document, caption=None):
+            documents.append((document, caption))
+
+    await botApp.admin_profile(DummyMessage())
+    # длительность ограничена PROFILE_MAX_SECONDS
+    assert replies == ["Снимаю профиль 1 с…"]
+    document, caption = documents[0]
+    assert document.filename.endswith(".collapsed")
+    assert b"MainThread;" in document.data
+    assert caption.startswith("Профиль 1 с") and "Цикл событий" in caption
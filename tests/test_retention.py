@@ -0,0 +1,105 @@
+import dataclasses
+import sqlite3
+
+import pytest
+
+import botApp
+from documents import DocumentCatalog
+from retention import archive_inactive, archive_path_for, compact, db_stats, prune_documents
+
+
+@pytest.fixture
+def db(isolated_db, monkeypatch):
+    # VACUUM и смена auto_vacuum — на отдельной БД теста, не на общей tests/test.db
+    monkeypatch.setattr(botApp, "last_retention_report", None)
+    return isolated_db
+
+
+def _fill(path, old: int, fresh: int):
+    conn = sqlite3.connect(path)
+    conn.executemany(
+        "INSERT INTO users (chat_id, username, last_interaction, last_message) VALUES (?, ?, ?, ?)",
+        [(i, f"u{i}", "2023-01-01T10:00:00+01:00", "x" * 200) for i in range(1, old + 1)]
+        + [(i, f"u{i}", "2026-10-01T10:00:00+01:00", "y") for i in range(old + 1, old + fresh + 1)],
+    )
+    conn.commit()
+    conn.close()
+
+
+def test_archive_moves_inactive_leads_in_batches(db):
+    _fill(db, old=2500, fresh=10)
+    archive = archive_path_for(db)
+    assert archive.endswith("bot_archive.db")
+
+    moved = archive_inactive(db, archive, "2025-01-01", batch_size=1000)
+    assert moved == 2500
+    assert db_stats(db)["users"] == 10
+
+    conn = sqlite3.connect(archive)
+    count, username, archived_at = conn.execute(
+        "SELECT COUNT(*), MAX(username), MAX(archived_at) FROM users_archive"
+    ).fetchone()
+    conn.close()
+    assert count == 2500 and username and archived_at
+
+    # повторный запуск ничего не делает
+    assert archive_inactive(db, archive, "2025-01-01") == 0
+
+
+def test_prune_keeps_recent_document_versions(db):
+    catalog = DocumentCatalog(db)
+    for i in range(6):
+        catalog.publish(f"http://x/v{i}.pdf", "en", "vip")
+    assert prune_documents(db, keep_versions=3) == 3
+    conn = sqlite3.connect(db)
+    versions = [row[0] for row in conn.execute("SELECT version FROM documents WHERE lang='en' ORDER BY version")]
+    conn.close()
+    assert versions == [4, 5, 6]
+    # активная версия и базовый документ на месте
+    assert catalog.resolve("en", "vip")["url"] == "http://x/v5.pdf"
+    assert catalog.resolve("ru", "default") is not None
+
+
+def test_compact_converts_and_frees_pages(db):
+    _fill(db, old=3000, fresh=0)
+    first = compact(db)
+    assert first["converted"] is True
+    assert db_stats(db)["auto_vacuum"] == "incremental"
+
+    archive_inactive(db, archive_path_for(db), "2025-01-01")
+    assert db_stats(db)["freelist_count"] > 0
+
+    second = compact(db, max_pages=100000)
+    assert second["converted"] is False
+    assert second["pages_freed"] > 0
+    assert db_stats(db)["freelist_count"] == 0
+
+
+async def test_async_retention_and_dbstats(db, monkeypatch):
+    _fill(db, old=50, fresh=5)
+    report = await botApp.async_retention()
+    assert report["archived"] == 50 and report["users_after"] == 5
+    assert report["size_after"] <= report["size_before"]
+    assert botApp.last_retention_report is report
+
+    # RETENTION_MONTHS=0 — архивирование выключено, vacuum выполняется
+    monkeypatch.setattr(botApp, "_settings", dataclasses.replace(botApp.get_settings(), retention_months=0))
+    _fill(db, old=0, fresh=0)
+    conn = sqlite3.connect(db)
+    conn.execute("UPDATE users SET last_interaction = '2000-01-01'")
+    conn.commit()
+    conn.close()
+    assert (await botApp.async_retention())["archived"] == 0
+
+    replies = []
+
+    class DummyMessage:
+        text = "/dbstats"
+        from_user = type("U", (), {"id": 42})()
+
+        async def reply(self, text):
+            replies.append(text)
+
+    await botApp.admin_dbstats(DummyMessage())
+    assert "auto_vacuum: incremental, лидов: 5" in replies[0]
+    assert "Архивировано: 0" in replies[0]
@@ -0,0 +1,121 @@
+import random
+import sqlite3
+
+import pytest
+
+import botApp
+from segments import SegmentIndex
+
+
+def fill_random(db_path, n=500):
+    rnd = random.Random(7)
+    rows = [
+        (chat_id, rnd.choice(["ru", "en", "th", None]), rnd.randint(0, 1),
+         rnd.choice([None, "2024-05-01T10:00:00+07:00"]), rnd.randint(0, 3), int(rnd.random() < 0.2))
+        for chat_id in rnd.sample(range(10 ** 6, 10 ** 7), n)
+    ]
+    conn = sqlite3.connect(db_path)
+    conn.executemany(
+        "INSERT INTO users (chat_id, lang, subscribed, file_sent_at, followup_attempts, manager_contacted) "
+        "VALUES (?, ?, ?, ?, ?, ?)", rows,
+    )
+    conn.commit()
+    conn.close()
+
+
+def sql_ids(db_path, where):
+    conn = sqlite3.connect(db_path)
+    ids = {row[0] for row in conn.execute(f"SELECT chat_id FROM users WHERE {where}")}
+    conn.close()
+    return ids
+
+
+@pytest.mark.parametrize("expr, where", [
+    ("en ∧ subscribed ∧ ¬manager_contacted", "lang='en' AND subscribed=1 AND manager_contacted=0"),
+    ("ru", "COALESCE(lang, 'ru')='ru'"),
+    ("pdf & !(attempts:0 | attempts:1)", "file_sent_at IS NOT NULL AND followup_attempts >= 2"),
+    ("th | manager", "lang='th' OR manager_contacted=1"),
+    ("all & !subscribed", "subscribed=0"),
+])
+def test_query_matches_sql(isolated_db, expr, where):
+    fill_random(isolated_db)
+    index = SegmentIndex.from_db(isolated_db)
+    mask = index.query(expr)
+    expected = sql_ids(isolated_db, where)
+    assert mask.bit_count() == len(expected)
+    # выдача потоком — те же chat_id
+    assert set(index.iter_chat_ids(mask)) == expected
+
+
+def test_query_errors():
+    index = SegmentIndex().load([{"chat_id": 1, "lang": "en"}])
+    for expr in ("subscrbed", "en &", "(en | ru", "en ru", ""):
+        with pytest.raises(ValueError):
+            index.query(expr)
+    # сегмент семейства без лидов — просто пустой
+    assert index.count("segment:vip") == 0 and index.count("attempts:9") == 0
+
+
+@pytest.mark.asyncio
+async def test_index_follows_user_updates(isolated_db):
+    fill_random(isolated_db, n=50)
+    index = await botApp.rebuild_segments()
+    assert index.loaded and len(index) == 50
+    before = index.count("en & subscribed")
+
+    botApp.upsert_user(42, "new", "Lead")
+    assert index.count("all") == 51 and 42 in set(index.iter_chat_ids(index.query("ru & attempts:0")))
+    botApp.update_user_fields(42, lang="en", subscribed=1)
+    assert index.count("en & subscribed") == before + 1
+    botApp.update_user_fields(42, followup_attempts=2, manager_contacted=1)
+    assert 42 in set(index.iter_chat_ids(index.query("attempts:2 & manager_contacted")))
+    assert 42 not in set(index.iter_chat_ids(index.query("attempts:0")))
+    # индекс совпадает с перестроенным из БД
+    assert index.counts() == SegmentIndex.from_db(isolated_db, lang_of=botApp._user_lang).counts()
+
+
+def test_updates_during_rebuild_are_replayed(isolated_db):
+    fill_random(isolated_db, n=20)
+    index = SegmentIndex()
+    index.begin_rebuild()
+    fresh = SegmentIndex.from_db(isolated_db)
+    # пока строился новый индекс, пришёл новый лид и подписка
+    index.add(7)
+    index.update(7, {"subscribed": 1, "lang": "th"})
+    index.finish_rebuild(fresh)
+    assert len(index) == 21
+    assert 7 in set(index.iter_chat_ids(index.query("th & subscribed")))
+
+
+@pytest.mark.asyncio
+async def test_admin_segments_command(isolated_db):
+    fill_random(isolated_db, n=30)
+    await botApp.rebuild_segments()
+    replies = []
+
+    class DummyMessage:
+        from_user = type("U", (), {"id": 42})()
+        text = "/segments"
+
+        async def reply(self, text):
+            replies.append(text)
+
+    await botApp.admin_segments(DummyMessage())
+    assert replies[0].startswith("Лидов в индексе: 30") and "subscribed:" in replies[0]
+
+    DummyMessage.text = "/segments en & subscribed & !manager_contacted"
+    await botApp.admin_segments(DummyMessage())
+    expected = len(sql_ids(isolated_db, "lang='en' AND subscribed=1 AND manager_contacted=0"))
+    assert replies[1].startswith(f"en & subscribed & !manager_contacted: {expected} из 30 (")
+
+    DummyMessage.text = "/segments vip"
+    await botApp.admin_segments(DummyMessage())
+    assert replies[2].startswith("Неизвестный сегмент: vip")
+
+    # лиды, загруженные импортом мимо бота, видны после /segments rebuild
+    from importer import import_leads
+    import_leads(["chat_id", "lang"], iter([["1", "th"], ["2", "th"]]), isolated_db)
+    assert len(botApp.get_segment_index()) == 30
+    DummyMessage.text = "/segments rebuild"
+    await botApp.admin_segments(DummyMessage())
+    assert replies[3].startswith("Лидов в индексе: 32")
@@ -0,0 +1,87 @@
+import os
+import sqlite3
+
+import pytest
+
+import botApp
+from documents import DocumentCatalog
+from settings import Settings, RuntimeSettings
+
+
+def test_settings_from_env_typed():
+    cfg = Settings.from_env({
+        "BOT_TOKEN": "t",
+        "CHANNEL_ID": "-100123",
+        "SHEETS_DRAIN_TIMEOUT": "2.5",
+        "WEBHOOK_URL": "",
+    })
+    assert cfg.bot_token == "t"
+    assert cfg.channel_id == -100123
+    assert cfg.sheets_drain_timeout == 2.5
+    # пустое значение — берём дефолт
+    assert cfg.webhook_url == ""
+    assert cfg.tz.key == "Europe/Amsterdam"
+
+    with pytest.raises(RuntimeError):
+        Settings.from_env({"WEBAPP_PORT": "abc"})
+
+
+def test_runtime_settings_persist_and_notify(tmp_path):
+    db = str(tmp_path / "settings.db")
+    defaults = {"pdf_url": "http://a", "reminder_interval_days": 2, "reminder_max_attempts": 3}
+    rs = RuntimeSettings(db, defaults)
+    seen = []
+    rs.subscribe(lambda k, v: seen.append((k, v)))
+
+    assert rs.get("pdf_url") == "http://a"
+    assert rs.set("reminder_interval_days", "5") == 5
+    assert rs.get("reminder_interval_days") == 5
+    assert seen == [("reminder_interval_days", 5)]
+
+    with pytest.raises(KeyError):
+        rs.set("unknown", "1")
+    with pytest.raises(ValueError):
+        rs.set("reminder_max_attempts", "many")
+
+    # новый экземпляр (рестарт) видит сохранённое значение
+    assert RuntimeSettings(db, defaults).get("reminder_interval_days") == 5
+
+    # изменение из «другого процесса» подтягивается после истечения кэша
+    other = RuntimeSettings(db, defaults)
+    other.set("pdf_url", "http://b")
+    rs.refresh_seconds = 0
+    assert rs.get("pdf_url") == "http://b"
+    assert ("pdf_url", "http://b") in seen
+
+
+@pytest.mark.asyncio
+async def test_admin_update_pdf_persists(monkeypatch, tmp_path, isolated_db):
+    class Dummy:
+        def __init__(self, text):
+            self.from_user = type("U", (), {"id": botApp.get_settings().admin_chat_id})()
+            self.text = text
+            self.replies = []
+        async def reply(self, text):
+            self.replies.append(text)
+
+    runtime = RuntimeSettings(botApp.get_settings().db_path, {"pdf_url": "http://old"})
+    monkeypatch.setattr(botApp, "_runtime", runtime)
+    # каталог документов — во временной БД, чтобы не задеть другие тесты
+    monkeypatch.setattr(botApp, "_catalog", DocumentCatalog(str(tmp_path / "docs.db")))
+
+    await botApp.admin_update_pdf(Dummy("/update_pdf http://new.pdf"))
+    assert botApp.PDF_URL == "http://new.pdf"
+    # значение лежит в таблице settings, а не в глобальной переменной
+    assert RuntimeSettings(runtime.db_path, {}).get("pdf_url") == "http://new.pdf"
+    assert botApp.get_catalog().resolve("en")["url"] == "http://new.pdf"
+
+    conn = sqlite3.connect(runtime.db_path)
+    conn.execute("DELETE FROM settings WHERE key='pdf_url'")
+    conn.commit()
+    conn.close()
+
+
+def test_legacy_config_names():
+    assert botApp.DB_PATH == os.environ["DB_PATH"]
+    assert botApp.TZ == botApp.get_settings().tz
+    assert botApp.REMINDER_MAX_ATTEMPTS == botApp.get_runtime().get("reminder_max_attempts")
@@ -0,0 +1,101 @@
+import asyncio
+
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from sheets_client import AsyncSheetsClient, ServiceAccountToken, SheetsError, rowcol_to_a1
+
+
+def test_rowcol_to_a1():
+    assert rowcol_to_a1(2, 5) == "E2"
+    assert rowcol_to_a1(10, 26) == "Z10"
+    assert rowcol_to_a1(1, 27) == "AA1"
+
+
+@pytest.mark.asyncio
+async def test_concurrent_reads_coalesced_and_connection_reused(fake_sheets):
+    client = fake_sheets.client
+    results = await asyncio.gather(*(client.get_values("'Leads'!1:1") for _ in range(20)))
+    # двадцать одинаковых чтений — один HTTP-запрос
+    assert all(r == results[0] for r in results)
+    assert fake_sheets.calls == [("GET", "get")]
+    assert client.coalesced == 19
+
+    for i in range(5):
+        await client.append("'Leads'!A1", [[str(i)]])
+    await client.batch_update([{"range": "'Leads'!B2", "values": [["x"]]}])
+    # keep-alive: все запросы по одному соединению
+    assert len(fake_sheets.peers) == 1
+    assert fake_sheets.rows[1] == ["0", "x"]
+
+
+@pytest.mark.asyncio
+async def test_unauthorized_refreshes_token_once(fake_sheets):
+    class Rotating:
+        def __init__(self):
+            self.tokens = ["expired", fake_sheets.token]
+            self.invalidated = 0
+
+        async def get(self, session):
+            return self.tokens[0]
+
+        def invalidate(self):
+            self.invalidated += 1
+            self.tokens.pop(0)
+
+    token = Rotating()
+    fake_sheets.client.token = token
+    assert (await fake_sheets.client.get_values("'Leads'!A1")) == [["chat_id"]]
+    assert token.invalidated == 1
+
+    fake_sheets.down = True
+    with pytest.raises(SheetsError) as err:
+        await fake_sheets.client.get_values("'Leads'!A1")
+    assert err.value.status == 503
+
+
+@pytest.mark.asyncio
+async def test_service_account_token_exchange():
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import rsa
+    from google.auth import jwt
+
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    pem = key.private_bytes(
+        serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()
+    ).decode()
+    exchanges = []
+
+    async def token_endpoint(request):
+        form = await request.post()
+        claims = jwt.decode(form["assertion"], verify=False)
+        exchanges.append(claims)
+        await asyncio.sleep(0.01)
+        return web.json_response({"access_token": f"at-{len(exchanges)}", "expires_in": 3600})
+
+    app = web.Application()
+    app.router.add_post("/token", token_endpoint)
+    server = TestServer(app)
+    await server.start_server()
+    info = {
+        "client_email": "bot@example.iam.gserviceaccount.com",
+        "private_key": pem,
+        "private_key_id": "k1",
+        "token_uri": str(server.make_url("/token")),
+    }
+    token = ServiceAccountToken(lambda: info)
+    client = AsyncSheetsClient("sheet", token)
+    try:
+        session = client._get_session()
+        # одновременные запросы ждут одного обмена, дальше — из кэша
+        got = await asyncio.gather(*(token.get(session) for _ in range(5)))
+        assert got == ["at-1"] * 5
+        assert len(exchanges) == 1
+        assert exchanges[0]["iss"] == info["client_email"]
+        assert exchanges[0]["aud"] == info["token_uri"]
+        token.invalidate()
+        assert await token.get(session) == "at-2"
+    finally:
+        await client.close()
+        await server.close()
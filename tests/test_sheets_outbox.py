@@ -0,0 +1,212 @@
+import asyncio
+import sqlite3
+
+import pytest
+
+import botApp
+from outbox import OutboxDrainer, SheetsOutbox
+
+
+pytestmark = pytest.mark.usefixtures("isolated_db")
+
+
+def test_journal_in_same_transaction_and_compaction():
+    botApp.upsert_user(1, "u", "f", sheet=True)
+    botApp.update_user_fields(1, sheet={"subscribed": True}, subscribed=1)
+    botApp.update_user_fields(1, sheet={"last_message": "a"}, last_message="a")
+    botApp.update_user_fields(1, sheet={"last_message": "b"}, last_message="b")
+    botApp.update_user_fields(2, sheet={"followup_attempts": 1})
+
+    items = botApp.get_outbox_drainer().outbox.batch(100)
+    # по одной строке на chat_id, в порядке первого изменения
+    assert [i.chat_id for i in items] == [1, 2]
+    assert items[0].values["subscribed"] == "True"
+    assert items[0].values["last_message"] == "b"
+    assert items[0].values["date_joined"]
+    assert items[0].revision == 3
+
+
+@pytest.mark.asyncio
+async def test_offline_backlog_replays_after_recovery(fake_sheets):
+    fake_sheets.rows.append(["5", "old", "", "2024-01-01", "False", "", "", "0", "False"])
+    fake_sheets.down = True
+    botApp.update_user_fields(5, sheet={"subscribed": True, "last_message": "project_requested"})
+    for chat_id in (6, 7):
+        botApp.update_user_fields(chat_id, sheet={"last_message": "hello"})
+
+    drainer = botApp.get_outbox_drainer()
+    with pytest.raises(Exception):
+        await drainer.run_once()
+    # ничего не потеряно, попытка учтена
+    conn = sqlite3.connect(botApp.DB_PATH)
+    assert conn.execute("SELECT COUNT(*), MIN(attempts) FROM sheets_outbox").fetchone() == (3, 1)
+    conn.close()
+
+    fake_sheets.down = False
+    fake_sheets.calls.clear()
+    assert await drainer.run_once() == 3
+    assert drainer.outbox.pending() == 0
+    # одна пачка: шапка и колонка chat_id, один batchUpdate, один append для новых
+    assert sorted(fake_sheets.calls) == [("GET", "get"), ("GET", "get"), ("POST", "append"), ("POST", "batchUpdate")]
+    assert fake_sheets.rows[1][4:6] == ["True", "project_requested"]
+    assert [row[0] for row in fake_sheets.rows[2:]] == ["6", "7"]
+    assert fake_sheets.rows[2][5] == "hello"
+
+
+@pytest.mark.asyncio
+async def test_handler_replies_before_sheets_write(fake_sheets):
+    class Dummy:
+        def __init__(self):
+            self.from_user = type("U", (), {"id": 301, "username": "u", "first_name": "f"})()
+            self.sent = []
+        async def answer(self, text, reply_markup=None):
+            self.sent.append(text)
+
+    msg = Dummy()
+    await asyncio.wait_for(botApp.on_start(msg, bot=None), timeout=1)
+    # ответ ушёл, запись лежит в журнале и уходит в таблицу фоновой задачей
+    assert msg.sent and not fake_sheets.calls
+    assert await botApp.get_outbox_drainer().run_once() == 1
+    assert fake_sheets.rows[1][:3] == ["301", "u", "f"]
+
+
+@pytest.mark.asyncio
+async def test_update_during_send_is_not_lost(tmp_path):
+    outbox = SheetsOutbox(str(tmp_path / "o.db"))
+    sent = []
+
+    def journal(chat_id, values):
+        conn = sqlite3.connect(outbox.db_path)
+        outbox.init(conn)
+        outbox.journal(conn, chat_id, values)
+        conn.commit()
+        conn.close()
+
+    async def apply(items):
+        sent.append([dict(i.values) for i in items])
+        if len(sent) == 1:
+            # пока пачка летит в таблицу, хендлер меняет того же лида
+            journal(1, {"last_message": "new"})
+
+    journal(1, {"last_message": "old"})
+    drainer = OutboxDrainer(outbox, apply)
+    assert await drainer.run_once() == 2
+    assert sent == [[{"last_message": "old"}], [{"last_message": "new"}]]
+    assert outbox.pending() == 0
+
+
+@pytest.mark.asyncio
+async def test_drainer_backs_off_while_sheets_down(tmp_path):
+    outbox = SheetsOutbox(str(tmp_path / "o.db"))
+    conn = sqlite3.connect(outbox.db_path)
+    outbox.init(conn)
+    outbox.journal(conn, 1, {"subscribed": "True"})
+    conn.commit()
+    conn.close()
+    calls = []
+
+    async def apply(items):
+        calls.append(len(items))
+        raise RuntimeError("503")
+
+    drainer = OutboxDrainer(outbox, apply, interval=0.02, max_backoff=0.1)
+    drainer.start()
+    await asyncio.sleep(0.15)
+    # новые записи не сбивают паузу
+    drainer.notify()
+    await drainer.stop()
+    assert drainer.failing
+    assert 2 <= len(calls) <= 5
+    assert outbox.pending() == 1
+
+
+def _journal(outbox, chat_id, values):
+    conn = sqlite3.connect(outbox.db_path)
+    outbox.init(conn)
+    outbox.journal(conn, chat_id, values)
+    conn.commit()
+    conn.close()
+
+
+@pytest.mark.asyncio
+async def test_rejected_rows_are_parked_and_queue_moves_on(tmp_path):
+    from sheets_client import SheetsError
+
+    outbox = SheetsOutbox(str(tmp_path / "o.db"))
+    for chat_id in (1, 2, 3):
+        _journal(outbox, chat_id, {"last_message": f"m{chat_id}"})
+    applied = []
+    alerts = []
+
+    async def apply(items):
+        if any(item.chat_id == 2 for item in items):
+            raise SheetsError(400, "Invalid value")
+        applied.extend(item.chat_id for item in items)
+
+    async def on_parked(items, error):
+        alerts.append(([item.chat_id for item in items], error))
+
+    drainer = OutboxDrainer(outbox, apply, retryable=botApp._outbox_retryable, on_parked=on_parked)
+    # пачка отклонена: остальные строки уходят по одной, «ядовитая» откладывается
+    assert await drainer.run_once() == 2
+    assert applied == [1, 3]
+    assert outbox.pending() == 0 and outbox.parked() == 1
+    assert alerts == [([2], "Sheets API 400: Invalid value")]
+    # отложенная строка очередь больше не держит
+    _journal(outbox, 4, {"last_message": "m4"})
+    assert await drainer.run_once() == 1 and applied[-1] == 4
+    # новое изменение того же лида — ещё одна попытка
+    _journal(outbox, 2, {"last_message": "fixed"})
+    assert outbox.parked() == 0 and outbox.pending() == 1
+
+
+@pytest.mark.asyncio
+async def test_rows_parked_after_max_attempts(tmp_path):
+    outbox = SheetsOutbox(str(tmp_path / "o.db"))
+    _journal(outbox, 1, {"subscribed": "True"})
+    alerts = []
+
+    async def apply(items):
+        raise RuntimeError("503")
+
+    async def on_parked(items, error):
+        alerts.append(error)
+
+    drainer = OutboxDrainer(outbox, apply, max_attempts=3, on_parked=on_parked)
+    for _ in range(3):
+        with pytest.raises(RuntimeError):
+            await drainer.run_once()
+    assert outbox.pending() == 0 and outbox.parked() == 1
+    assert alerts == ["3 попыток, последняя: 503"]
+    assert await drainer.run_once() == 0
+
+
+@pytest.mark.asyncio
+async def test_notify_during_drain_is_not_lost(tmp_path):
+    drainer = None
+
+    class RacyOutbox(SheetsOutbox):
+        raced = False
+
+        def batch(self, limit):
+            items = super().batch(limit)
+            if not items and not self.raced:
+                # запись из другого потока — сразу после того, как круг увидел пустой журнал
+                self.raced = True
+                _journal(self, 2, {"last_message": "b"})
+                drainer.notify()
+            return items
+
+    outbox = RacyOutbox(str(tmp_path / "o.db"))
+    _journal(outbox, 1, {"last_message": "a"})
+    sent = []
+
+    async def apply(items):
+        sent.append([item.chat_id for item in items])
+
+    # поллинг раз в 10 с: без notify вторая строка в тест не успела бы
+    drainer = OutboxDrainer(outbox, apply, interval=10)
+    drainer.start()
+    await asyncio.sleep(0.1)
+    await drainer.stop()
+    assert sent == [[1], [2]]
@@ -0,0 +1,70 @@
+import pytest
+
+import botApp
+
+
+HEADER = [
+    "chat_id", "username", "first_name", "date_joined", "subscribed",
+    "last_message", "file_sent", "followup_attempts", "manager_contacted",
+]
+
+
+pytestmark = pytest.mark.usefixtures("isolated_db")
+
+
+def test_reconcile_plan_diffs_only_changed_cells():
+    botApp.upsert_user(1, "a", "A")
+    botApp.upsert_user(2, "b", "B")
+    botApp.update_user_fields(2, subscribed=1, last_message="project_requested")
+    users = botApp._load_users_for_sheet()
+    u1 = next(u for u in users if u["chat_id"] == 1)
+
+    values = [
+        HEADER,
+        # совпадает с БД (TRUE/FALSE из Sheets считаем равными True/False)
+        ["1", "a", "A", "x", "FALSE", u1["last_message"] or "", "", "0", "FALSE"],
+        # расходится в двух ячейках
+        ["2", "b", "B", "x", "FALSE", "hello", "", "0", "FALSE"],
+        # есть только в таблице
+        ["3", "c", "C", "x", "FALSE", "", "", "0", "FALSE"],
+    ]
+    plan = botApp._reconcile_plan(values, users)
+    report = plan["report"]
+    assert report["in_sync"] == 1
+    assert report["changed_rows"] == 1
+    assert report["changed_cells"] == 2
+    assert report["sheet_only"] == 1
+    assert report["appended"] == 0
+    assert {(r, c) for r, c, _ in plan["updates"]} == {(3, 5), (3, 6)}
+
+
+@pytest.mark.asyncio
+async def test_reconcile_one_read_one_batch(fake_sheets):
+    for chat_id in range(10, 20):
+        botApp.upsert_user(chat_id, "u", "f")
+    botApp.update_user_fields(10, manager_contacted=1)
+    fake_sheets.rows.extend(
+        [str(chat_id), "u", "f", "x", "False", "", "", "0", "False"]
+        for chat_id in range(10, 15)
+    )
+
+    dry = await botApp.reconcile_sheet(dry_run=True)
+    assert dry["changed_cells"] == 1 and dry["appended"] == 5
+    assert fake_sheets.calls == [("GET", "get")]
+
+    report = await botApp.reconcile_sheet()
+    # одно чтение, один batchUpdate, один append на весь прогон
+    assert fake_sheets.calls[1:] == [("GET", "get"), ("POST", "batchUpdate"), ("POST", "append")]
+    assert fake_sheets.rows[1][8] == "True"
+    assert [row[0] for row in fake_sheets.rows[6:]] == [str(i) for i in range(15, 20)]
+    assert report["appended"] == 5 and report["finished_at"]
+
+
+@pytest.mark.asyncio
+async def test_reconcile_and_outbox_do_not_duplicate_new_lead(fake_sheets):
+    import asyncio
+    # лид создан, пока сверка читает таблицу: его строку дописывают и журнал, и сверка
+    botApp.upsert_user(5, "e", "E", sheet=True)
+    drainer = botApp.get_outbox_drainer()
+    await asyncio.gather(botApp.reconcile_sheet(), drainer.run_once())
+    assert [row[0] for row in fake_sheets.rows[1:]] == ["5"]
@@ -0,0 +1,105 @@
+import os
+import sqlite3
+
+import pytest
+
+import botApp
+from snapshots import export_snapshot, lead_status, prune_snapshots
+
+pa = pytest.importorskip("pyarrow")
+
+
+@pytest.fixture
+def db_settings(tmp_path):
+    return {"snapshot_dir": str(tmp_path / "snapshots")}
+
+
+@pytest.fixture
+def leads_db(isolated_db):
+    db_path = isolated_db
+    conn = sqlite3.connect(db_path)
+    conn.executemany(
+        "INSERT INTO users (chat_id, username, subscribed, last_interaction, file_sent_at, manager_contacted, lang) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?)",
+        [
+            (1, "new", 0, "2024-05-01T10:00:00+07:00", None, 0, "ru"),
+            (2, "sub", 1, "2024-05-02T10:00:00", None, 0, "en"),
+            (3, "pdf", 1, "2024-05-03T10:00:00+07:00", "2024-05-03T10:05:00+07:00", 0, "ru"),
+            (4, "mgr", 1, None, "2024-05-04T10:05:00+07:00", 1, "th"),
+            (5, None, 0, None, None, 0, None),
+        ],
+    )
+    conn.commit()
+    conn.close()
+    return db_path
+
+
+@pytest.mark.parametrize("fmt", ["parquet", "arrow"])
+def test_export_snapshot_columns(leads_db, tmp_path, fmt):
+    out_dir = str(tmp_path / "snapshots")
+    # пачки по 2 строки: словари дописываются между пачками
+    report = export_snapshot(leads_db, out_dir, "2024-05-05", fmt=fmt, chunk_size=2)
+    assert report["rows"] == 5
+    assert report["path"] == os.path.join(out_dir, "date=2024-05-05", f"users.{fmt}")
+    assert not os.path.exists(report["path"] + ".tmp")
+
+    if fmt == "parquet":
+        import pyarrow.parquet as pq
+        table = pq.read_table(report["path"])
+    else:
+        import pyarrow.ipc as ipc
+        table = ipc.open_file(report["path"]).read_all()
+
+    assert pa.types.is_dictionary(table.schema.field("lang").type)
+    assert pa.types.is_dictionary(table.schema.field("status").type)
+    rows = table.to_pylist()
+    assert [row["chat_id"] for row in rows] == [1, 2, 3, 4, 5]
+    assert [row["status"] for row in rows] == ["new", "subscribed", "file_sent", "manager", "new"]
+    assert [row["lang"] for row in rows] == ["ru", "en", "ru", "th", None]
+    assert rows[3]["manager_contacted"] is True and rows[0]["subscribed"] is False
+    # время — в UTC; без смещения считается UTC
+    assert rows[0]["last_interaction"].isoformat() == "2024-05-01T03:00:00+00:00"
+    assert rows[1]["last_interaction"].isoformat() == "2024-05-02T10:00:00+00:00"
+
+
+def test_export_does_not_wait_for_writer(leads_db, tmp_path):
+    # бот держит открытую транзакцию записи — выгрузка читает последнее зафиксированное состояние
+    writer = sqlite3.connect(leads_db, isolation_level=None)
+    writer.execute("BEGIN IMMEDIATE")
+    writer.execute("UPDATE users SET lang='en' WHERE chat_id=1")
+    try:
+        report = export_snapshot(leads_db, str(tmp_path / "snapshots"), "2024-05-05")
+    finally:
+        writer.execute("COMMIT")
+        writer.close()
+    import pyarrow.parquet as pq
+    assert pq.read_table(report["path"]).column("lang").to_pylist()[0] == "ru"
+
+
+def test_prune_keeps_latest_days(tmp_path):
+    for day in ("2024-05-01", "2024-05-02", "2024-05-03"):
+        os.makedirs(tmp_path / f"date={day}")
+    assert prune_snapshots(str(tmp_path), keep_days=2) == ["date=2024-05-01"]
+    assert sorted(os.listdir(tmp_path)) == ["date=2024-05-02", "date=2024-05-03"]
+    assert prune_snapshots(str(tmp_path), keep_days=0) == []
+
+
+def test_lead_status_order():
+    assert lead_status(1, "2024-05-01", 1) == "manager"
+    assert lead_status(0, None, 0) == "new"
+
+
+@pytest.mark.asyncio
+async def test_admin_snapshot_command(leads_db):
+    replies = []
+
+    class DummyMessage:
+        from_user = type("U", (), {"id": 42})()
+        text = "/snapshot"
+
+        async def reply(self, text):
+            replies.append(text)
+
+    await botApp.admin_snapshot(DummyMessage())
+    assert replies[0].startswith(f"Снимок {botApp._now().date().isoformat()}: 5 лидов")
+    assert os.path.isfile(replies[0].splitlines()[1])
@@ -0,0 +1,46 @@
+import json
+import os
+import subprocess
+import sys
+
+import botApp
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+
+# тяжёлые модули, которые не должны грузиться при импорте botApp
+LAZY_MODULES = ["google.auth", "apscheduler", "aiohttp.web", "aiogram.webhook"]
+
+PROBE = """
+import json, sys, time
+t0 = time.perf_counter()
+import botApp
+elapsed = time.perf_counter() - t0
+print(json.dumps({
+    "import_seconds": elapsed,
+    "loaded": [m for m in %r if m in sys.modules],
+}))
+""" % (LAZY_MODULES,)
+
+
+def _probe() -> dict:
+    out = subprocess.run(
+        [sys.executable, "-c", PROBE],
+        cwd=PROJECT_ROOT,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def test_import_does_not_load_heavy_stack():
+    result = _probe()
+    assert result["loaded"] == []
+    # холодный импорт — для сравнения между версиями (pytest -s)
+    print(f"botApp import: {result['import_seconds'] * 1000:.1f} ms")
+
+
+def test_scheduler_is_created_lazily():
+    scheduler = botApp.scheduler
+    assert scheduler is botApp.get_scheduler()
+    assert "apscheduler" in sys.modules
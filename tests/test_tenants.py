@@ -0,0 +1,241 @@
+import asyncio
+import dataclasses
+import json
+
+import pytest
+
+import botApp
+from tenants import TenantMiddleware, current_tenant, load_tenants
+
+
+def make_tenants(tmp_path, **extra):
+    base = dataclasses.replace(
+        botApp.get_settings(), db_path=str(tmp_path / "bot.db"),
+        webhook_url="https://example.com/tg", webhook_path="/tg",
+    )
+    items = [
+        {"name": "rome", "bot_token": "111:aaa", "channel_id": -1001},
+        {"name": "milan", "bot_token": "222:bbb", "channel_id": -1002, "pdf_url": "https://milan/pdf",
+         "templates": {"ru": {"greeting": "Добро пожаловать в Милан"}}},
+    ]
+    return load_tenants(json.dumps(items), base, botApp.TEMPLATES, env=extra)
+
+
+def test_load_tenants_defaults(tmp_path):
+    rome, milan = make_tenants(tmp_path)
+    # свой файл БД и путь вебхука у каждого бота
+    assert rome.settings.db_path == str(tmp_path / "bot_rome.db")
+    assert milan.settings.db_path == str(tmp_path / "bot_milan.db")
+    assert milan.settings.webhook_path == "/tg/milan"
+    assert milan.settings.webhook_url == "https://example.com/tg/milan"
+    assert milan.settings.bot_token == "222:bbb" and milan.settings.pdf_url == "https://milan/pdf"
+    # шаблоны: переопределён только greeting, остальное — общее
+    assert rome.templates is None
+    assert milan.templates["ru"]["greeting"] == "Добро пожаловать в Милан"
+    assert milan.templates["ru"]["choose_lang"] == botApp.TEMPLATES["ru"]["choose_lang"]
+    assert botApp.TEMPLATES["ru"]["greeting"] != "Добро пожаловать в Милан"
+
+
+def test_load_tenants_from_file_and_common_env(tmp_path):
+    path = tmp_path / "tenants.json"
+    path.write_text(json.dumps([{"name": "rome", "bot_token": "111:aaa"}]), encoding="utf-8")
+    base = dataclasses.replace(botApp.get_settings(), db_path=str(tmp_path / "bot.db"))
+    (rome,) = load_tenants(str(path), base, botApp.TEMPLATES, env={"ADMIN_CHAT_ID": "7"})
+    # чего нет в описании бота — из общего окружения
+    assert rome.settings.admin_chat_id == 7
+
+
+@pytest.mark.parametrize("items, error", [
+    ([{"name": "a", "bot_token": "1:x"}, {"name": "a", "bot_token": "2:y"}], "unique"),
+    ([{"name": "a", "bot_token": "1:x", "colour": "red"}], "unknown settings"),
+    ([{"name": "a"}], "bot_token is required"),
+    ([{"name": "a", "bot_token": "1:x", "db_path": "x.db"}, {"name": "b", "bot_token": "2:y", "db_path": "x.db"}],
+     "already used"),
+])
+def test_load_tenants_validation(tmp_path, items, error):
+    base = dataclasses.replace(botApp.get_settings(), db_path=str(tmp_path / "bot.db"))
+    with pytest.raises(ValueError, match=error):
+        load_tenants(json.dumps(items), base, botApp.TEMPLATES, env={})
+
+
+def test_tenant_data_is_isolated(tmp_path):
+    rome, milan = make_tenants(tmp_path)
+
+    def register(chat_id):
+        botApp.init_db()
+        botApp.upsert_user(chat_id, "u", "U")
+        return botApp.get_settings().db_path, botApp.get_runtime(), botApp.get_breaker("sheets")
+
+    rome_db, rome_runtime, rome_breaker = rome.bind(register)(1)
+    milan_db, milan_runtime, milan_breaker = milan.bind(register)(2)
+    assert rome_db != milan_db
+    # лениво созданные объекты — свои у каждого бота, но переиспользуются внутри него
+    assert rome_runtime is not milan_runtime and rome_breaker is not milan_breaker
+    assert rome.bind(botApp.get_runtime)() is rome_runtime
+    # лид одного бота не виден другому
+    assert rome.bind(botApp.get_user)(1) is not None
+    assert rome.bind(botApp.get_user)(2) is None
+    assert milan.bind(botApp.get_user)(1) is None
+    # вне контекста — прежний глобальный режим
+    assert current_tenant() is None
+    assert botApp.get_settings().db_path not in (rome_db, milan_db)
+
+
+def test_tenant_dashboard_shows_only_own_errors(tmp_path, monkeypatch):
+    from collections import deque
+    rome, milan = make_tenants(tmp_path)
+    errors = botApp.recent_errors
+    monkeypatch.setattr(errors, "records", deque(maxlen=50))
+    monkeypatch.setattr(errors, "_totals", {})
+    botApp.logger.addHandler(errors)
+    try:
+        rome.bind(botApp.logger.warning)("Sheets outbox: parked [101]")
+        milan.bind(botApp.logger.error)("Sheets outbox: parked [202]")
+    finally:
+        botApp.logger.removeHandler(errors)
+
+    def summary():
+        botApp.init_db()
+        return botApp._dashboard_summary()["recent_errors"]
+
+    rome_errors, milan_errors = rome.bind(summary)(), milan.bind(summary)()
+    assert [e["message"] for e in rome_errors["items"]] == ["Sheets outbox: parked [101]"]
+    assert [e["message"] for e in milan_errors["items"]] == ["Sheets outbox: parked [202]"]
+    assert rome_errors["total"] == milan_errors["total"] == 1
+    # без тенантов (один бот) — все записи процесса
+    assert len(errors.view()["items"]) == 2
+
+
+def test_scheduler_jobs_are_per_tenant(tmp_path, monkeypatch):
+    rome, milan = make_tenants(tmp_path)
+    jobs = {}
+
+    class FakeScheduler:
+        def add_job(self, func, trigger, id, replace_existing, **kwargs):
+            jobs[id] = func
+
+    monkeypatch.setattr(botApp, "get_scheduler", lambda: FakeScheduler())
+    rome.bind(botApp.schedule_retention)()
+    milan.bind(botApp.schedule_retention)()
+    botApp.schedule_retention()
+    assert set(jobs) == {"rome:retention", "milan:retention", "retention"}
+
+
+@pytest.mark.asyncio
+async def test_bound_job_runs_in_tenant_context(tmp_path):
+    rome, _ = make_tenants(tmp_path)
+    seen = []
+
+    async def job():
+        await asyncio.sleep(0)
+        seen.append(botApp.get_settings().bot_token)
+
+    await rome.bind(job)()
+    assert seen == ["111:aaa"] and current_tenant() is None
+
+
+@pytest.mark.asyncio
+async def test_middleware_selects_tenant_by_bot(tmp_path):
+    rome, milan = make_tenants(tmp_path)
+
+    class DummyBot:
+        def __init__(self, id):
+            self.id = id
+
+    rome.bot, milan.bot = DummyBot(111), DummyBot(222)
+    middleware = TenantMiddleware([rome, milan])
+
+    async def handler(event, data):
+        await asyncio.sleep(0)
+        return current_tenant(), botApp.get_templates()["ru"]["greeting"]
+
+    tenant, greeting = await middleware(handler, None, {"bot": DummyBot(222)})
+    assert tenant is milan and greeting == "Добро пожаловать в Милан"
+    tenant, greeting = await middleware(handler, None, {"bot": DummyBot(111)})
+    assert tenant is rome and greeting == botApp.TEMPLATES["ru"]["greeting"]
+    # незнакомый бот — без тенанта
+    assert (await middleware(handler, None, {"bot": DummyBot(333)}))[0] is None
+    assert current_tenant() is None
+
+
+@pytest.mark.asyncio
+async def test_concurrent_tenants_do_not_leak(tmp_path):
+    rome, milan = make_tenants(tmp_path)
+
+    async def read_token(delay):
+        await asyncio.sleep(delay)
+        return botApp.get_settings().bot_token
+
+    tokens = await asyncio.gather(rome.bind(read_token)(0.02), milan.bind(read_token)(0.01))
+    assert tokens == ["111:aaa", "222:bbb"]
+
+
+@pytest.mark.asyncio
+async def test_shared_sheets_session_is_not_closed(fake_sheets):
+    import aiohttp
+
+    from sheets_client import AsyncSheetsClient, StaticToken
+
+    session = aiohttp.ClientSession()
+    try:
+        client = AsyncSheetsClient("sheet", StaticToken(fake_sheets.token), base_url=fake_sheets.client.base_url,
+                                   max_connections=1, session=session)
+        assert await client.get_values("'Leads'!A1:I1")
+        await client.close()
+        # сессия общая — закрывает её владелец, клиент продолжает работать
+        assert not session.closed
+        assert await client.get_values("'Leads'!A1:I1")
+    finally:
+        await session.close()
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("api_up", [True, False])
+async def test_tenant_followup_half_open_probe(tmp_path, api_up):
+    from datetime import datetime, timedelta
+
+    from aiogram import Bot
+    from aiogram.exceptions import TelegramNetworkError
+    from aiogram.types import Chat, Message
+
+    from breakers import TelegramBreakerMiddleware
+
+    rome, _ = make_tenants(tmp_path)
+    sent = []
+
+    async def scenario():
+        botApp.init_db()
+        # бот тенанта — на общей сессии с предохранителем, как в create_tenants_app
+        bot = Bot("111:aaa")
+        bot.session.middleware(TelegramBreakerMiddleware(lambda: botApp.get_breaker("telegram")))
+        rome.bot = bot
+
+        async def make_request(bot, method, timeout=None):
+            sent.append(type(method).__name__)
+            if not api_up:
+                raise TelegramNetworkError(method=method, message="timeout")
+            return Message(message_id=1, date=datetime.now(), chat=Chat(id=7, type="private"))
+
+        bot.session.make_request = make_request
+        now = [1000.0]
+        breaker = botApp.get_breaker("telegram")
+        breaker._clock = lambda: now[0]
+        for _ in range(breaker.min_calls):
+            breaker.record_failure("network")
+        now[0] += breaker.open_seconds
+        assert breaker.state == "half_open"
+
+        botApp.upsert_user(7, "t", "T")
+        sent_at = (datetime.now(botApp.TZ) - timedelta(days=3)).isoformat()
+        botApp.update_user_fields(7, file_sent_at=sent_at, last_interaction=sent_at, followup_attempts=0)
+        await botApp.async_followup_job(7, bot=rome.bot)
+        await bot.session.close()
+        return breaker.state, botApp.get_user(7)["followup_attempts"]
+
+    state, attempts = await rome.bind(scenario)()
+    # пробный вызов реально уходит в Bot API и один раз решает судьбу цепи
+    assert sent == ["SendMessage"]
+    if api_up:
+        assert state == "closed" and attempts == 1
+    else:
+        assert state == "open" and attempts == 0
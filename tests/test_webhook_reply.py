@@ -0,0 +1,99 @@
+import dataclasses
+
+import pytest
+from aiogram import Bot, Dispatcher, Router
+from aiogram.filters import CommandStart
+
+import botApp
+
+
+pytestmark = pytest.mark.usefixtures("isolated_db")
+
+
+def _update(text="/start", user_id=501):
+    user = {"id": user_id, "is_bot": False, "first_name": "Lead", "username": "lead"}
+    return {
+        "update_id": 1,
+        "message": {
+            "message_id": 10, "date": 1700000000, "text": text,
+            "chat": {"id": user_id, "type": "private"}, "from": user,
+        },
+    }
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("reply", [1, 0])
+async def test_start_reply_goes_into_webhook_response(monkeypatch, reply):
+    import asyncio
+    from datetime import datetime
+
+    from aiohttp.test_utils import TestClient, TestServer
+    from aiogram.types import Chat, Message
+
+    cfg = dataclasses.replace(botApp.get_settings(), webhook_url="https://bot.example/hook",
+                              webhook_path="/hook", webhook_reply=reply, dashboard_token="")
+    monkeypatch.setattr(botApp, "_settings", cfg)
+    # отдельный роутер: botApp.router уже может быть подключён к другому диспетчеру
+    router = Router()
+    router.message.register(botApp.on_start, CommandStart())
+    dp = Dispatcher()
+    dp.include_router(router)
+    bot = Bot("42:TEST")
+    sent = []
+
+    async def make_request(bot, method, timeout=None):
+        sent.append(type(method).__name__)
+        if type(method).__name__ != "SendMessage":
+            raise AssertionError("не ожидали запроса к Bot API")
+        return Message(message_id=1, date=datetime.now(), chat=Chat(id=501, type="private"))
+
+    monkeypatch.setattr(bot.session, "make_request", make_request)
+
+    app = botApp.build_webhook_app(dp, [(bot, cfg, None, "/dashboard")])
+    async with TestClient(TestServer(app)) as client:
+        resp = await client.post("/hook", json=_update())
+        body = await resp.read()
+        for _ in range(50):
+            if botApp.get_user(501) and "SendMessage" in sent:
+                break
+            await asyncio.sleep(0.01)
+    await bot.session.close()
+
+    assert resp.status == 200
+    if reply:
+        # апдейт обработан до ответа: приветствие — в теле ответа на вебхук
+        assert b"sendMessage" in body and b"501" in body
+        assert "SendMessage" not in sent
+    else:
+        # без WEBHOOK_REPLY Telegram сразу получает пустой ответ, хендлер работает в фоне
+        assert b"sendMessage" not in body
+        assert "SendMessage" in sent
+    assert botApp.get_user(501)["username"] == "lead"
+
+
+@pytest.mark.asyncio
+async def test_reply_inline_returns_method_only_when_enabled(monkeypatch):
+    sent = []
+
+    class DummyMessage:
+        from_user = type("U", (), {"id": 502, "username": "u", "first_name": "F"})()
+        text = "вопрос"
+
+        def answer(self, text, **kwargs):
+            async def call():
+                sent.append(text)
+                return "message"
+            return call()
+
+    # без WEBHOOK_REPLY ответ отправляется сразу
+    assert await botApp.on_any_message(DummyMessage()) == "message"
+    assert len(sent) == 1
+
+    monkeypatch.setattr(botApp, "_settings", dataclasses.replace(botApp.get_settings(), webhook_reply=1))
+    assert not botApp.webhook_reply_enabled()  # в polling-режиме (нет WEBHOOK_URL) флаг не действует
+
+    monkeypatch.setattr(botApp, "_settings", dataclasses.replace(botApp.get_settings(), webhook_url="https://x/hook"))
+    method = await botApp.on_any_message(DummyMessage())
+    # метод возвращён, а не выполнен: его отправит aiogram в ответе на вебхук
+    assert len(sent) == 1
+    assert await method == "message"